@@ -0,0 +1,203 @@
+"""Typed, immutable analysis shared by the analyzer, controller and renderers.
+
+Model output (Gemini, the mock, the local detector) is validated once by
+Analysis.from_dict into Detection / Analysis objects that are never mutated
+afterwards, so any thread can hold on to one without copying it. Per-class
+counts are computed at construction. Output that does not fit the schema
+raises AnalysisError before anything downstream sees it.
+
+Boxes are normalized 0-1000 [y_min, x_min, y_max, x_max]; an empty box means
+"present, location unknown" (e.g. a pedestrian reported by the PIR sensor).
+"""
+import math
+from collections import Counter
+from types import MappingProxyType
+
+KINDS     = ("vehicles", "emergency_vehicles", "pedestrians", "hands")
+DENSITIES = ("low", "medium", "high", "gridlock")
+
+
+class AnalysisError(ValueError):
+    """Analyzer output that does not fit the analysis schema."""
+
+
+def density_from_count(n_vehicles):
+    if n_vehicles >= 8:
+        return "high"
+    if n_vehicles >= 3:
+        return "medium"
+    return "low"
+
+
+def _number(v):
+    # json.loads accepts NaN / Infinity; neither is a coordinate or a measurement
+    if isinstance(v, float):
+        return math.isfinite(v)
+    return isinstance(v, int) and not isinstance(v, bool)
+
+
+def _flag(v, what):
+    if isinstance(v, bool):
+        return v
+    if v is None:
+        return False
+    if isinstance(v, str) and v.lower() in ("true", "false"):
+        return v.lower() == "true"
+    raise AnalysisError(f"{what} is not a boolean: {v!r}")
+
+
+class _Frozen:
+    __slots__ = ()
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} is immutable")
+
+    __delattr__ = __setattr__
+
+    def replace(self, **changes):
+        """Copy with some fields changed."""
+        fields = {name: getattr(self, name) for name in self._fields}
+        fields.update(changes)
+        return type(self)(**fields)
+
+
+class Detection(_Frozen):
+    __slots__ = ("kind", "box", "type", "crossing", "source", "track_id", "dwell", "speed")
+    _fields   = __slots__
+
+    def __init__(self, kind, box=(), type=None, crossing=False, source="gemini",
+                 track_id=None, dwell=None, speed=None):
+        init = object.__setattr__
+        init(self, "kind", kind)
+        init(self, "box", tuple(box))
+        init(self, "type", type)
+        init(self, "crossing", crossing)
+        init(self, "source", source)
+        init(self, "track_id", track_id)        # set on tracked snapshots (tracker.py)
+        init(self, "dwell", dwell)
+        init(self, "speed", speed)
+
+    @classmethod
+    def from_dict(cls, kind, obj):
+        """Validated detection, or None for a degenerate box."""
+        if not isinstance(obj, dict):
+            raise AnalysisError(f"{kind} item is not an object: {obj!r}")
+        box = obj.get("box_2d") or ()
+        if box:
+            if not isinstance(box, (list, tuple)) or len(box) != 4 or not all(map(_number, box)):
+                raise AnalysisError(f"bad box_2d in {kind}: {box!r}")
+            box = tuple(int(min(max(v, 0), 1000)) for v in box)
+            if box[2] <= box[0] or box[3] <= box[1]:
+                return None
+        kind_type = obj.get("type")
+        if kind_type is not None and not isinstance(kind_type, str):
+            raise AnalysisError(f"bad type in {kind}: {kind_type!r}")
+        source = obj.get("source") or "gemini"
+        if not isinstance(source, str):
+            raise AnalysisError(f"bad source in {kind}: {source!r}")
+        track_id = obj.get("track_id")
+        if track_id is not None and not (isinstance(track_id, int) and not isinstance(track_id, bool)):
+            raise AnalysisError(f"bad track_id in {kind}: {track_id!r}")
+        # Tracker estimates, present on tracked snapshots and logs
+        dwell, speed = obj.get("dwell"), obj.get("speed")
+        for name, value in (("dwell", dwell), ("speed", speed)):
+            if value is not None and not _number(value):
+                raise AnalysisError(f"bad {name} in {kind}: {value!r}")
+        return cls(kind, box,
+                   type=kind_type.lower() if kind_type else
+                        {"vehicles": "car", "emergency_vehicles": "emergency"}.get(kind),
+                   crossing=_flag(obj.get("crossing"), "crossing"),
+                   source=source, track_id=track_id, dwell=dwell, speed=speed)
+
+    def to_dict(self):
+        out = {"box_2d": list(self.box)}
+        if self.type is not None:
+            out["type"] = self.type
+        if self.kind == "pedestrians":
+            out["crossing"] = self.crossing
+        out["source"] = self.source
+        for name in ("track_id", "dwell", "speed"):
+            value = getattr(self, name)
+            if value is not None:
+                out[name] = value
+        return out
+
+    def __repr__(self):
+        return f"Detection({self.kind}, {self.type or ''}, {list(self.box)}, source={self.source})"
+
+
+class Analysis(_Frozen):
+    __slots__ = KINDS + ("traffic_density", "recommended_action", "emergency_priority", "counts")
+    _fields   = KINDS + ("traffic_density", "recommended_action", "emergency_priority")
+
+    def __init__(self, vehicles=(), emergency_vehicles=(), pedestrians=(), hands=(),
+                 traffic_density="", recommended_action="", emergency_priority=False):
+        init = object.__setattr__
+        init(self, "vehicles", tuple(vehicles))
+        init(self, "emergency_vehicles", tuple(emergency_vehicles))
+        init(self, "pedestrians", tuple(pedestrians))
+        init(self, "hands", tuple(hands))
+        init(self, "traffic_density", traffic_density)
+        init(self, "recommended_action", recommended_action)
+        init(self, "emergency_priority", emergency_priority)
+        # Per-class counts, once — vehicle / emergency types plus pedestrians
+        counts = Counter(d.type for d in self.vehicles)
+        counts.update(d.type for d in self.emergency_vehicles)
+        counts["pedestrians"] = len(self.pedestrians)
+        counts["crossing"]    = sum(1 for p in self.pedestrians if p.crossing)
+        init(self, "counts", MappingProxyType(counts))
+
+    @classmethod
+    def from_dict(cls, data):
+        """Validate a JSON-style analysis (model output, mock, snapshot)."""
+        if isinstance(data, Analysis):
+            return data
+        if not isinstance(data, dict):
+            raise AnalysisError(f"analysis is not an object: {type(data).__name__}")
+        fields = {}
+        for kind in KINDS:
+            items = data.get(kind)
+            if items is None:
+                items = []
+            elif not isinstance(items, list):
+                raise AnalysisError(f"{kind} is not a list")
+            fields[kind] = [d for d in (Detection.from_dict(kind, obj) for obj in items) if d]
+        density = data.get("traffic_density") or (
+            density_from_count(len(fields["vehicles"])) if any(fields.values()) else "")
+        if not isinstance(density, str) or (density and density.lower() not in DENSITIES):
+            raise AnalysisError(f"bad traffic_density: {density!r}")
+        action = data.get("recommended_action") or ""
+        if not isinstance(action, str):
+            raise AnalysisError(f"bad recommended_action: {action!r}")
+        return cls(traffic_density=density.lower(), recommended_action=action,
+                   emergency_priority=_flag(data.get("emergency_priority"), "emergency_priority"),
+                   **fields)
+
+    def to_dict(self):
+        out = {kind: [d.to_dict() for d in getattr(self, kind)] for kind in KINDS}
+        out["traffic_density"]    = self.traffic_density
+        out["recommended_action"] = self.recommended_action
+        out["emergency_priority"] = self.emergency_priority
+        return out
+
+    def detections(self, kinds=KINDS):
+        for kind in kinds:
+            yield from getattr(self, kind)
+
+    def map_boxes(self, fn):
+        """Copy with `fn` applied to every located box."""
+        return self.replace(**{kind: [d.replace(box=fn(d.box)) if d.box else d
+                                      for d in getattr(self, kind)] for kind in KINDS})
+
+    def __bool__(self):
+        # False only for EMPTY-like results — "no analysis yet". A streamed
+        # emergency_priority lands before any other field and must count.
+        return (self.emergency_priority or bool(self.traffic_density)
+                or any(getattr(self, kind) for kind in KINDS))
+
+    def __repr__(self):
+        return (f"Analysis({self.traffic_density or '-'}, {len(self.vehicles)} vehicles, "
+                f"{len(self.emergency_vehicles)} emergency, {len(self.pedestrians)} pedestrians)")
+
+
+EMPTY = Analysis()
@@ -0,0 +1,234 @@
+"""Replay a recorded video through the frame path and time every stage.
+
+    python benchmark.py traffic.mp4                      # as fast as possible
+    python benchmark.py traffic.mp4 --realtime           # paced at the video's fps
+    python benchmark.py traffic.mp4 --out new.json --compare old.json
+
+Gemini is replaced by a deterministic stand-in with configurable latency,
+so runs cost no quota and are comparable between commits. Results (per-stage
+latency percentiles, frames/sec, peak RSS) are written as JSON.
+"""
+import argparse
+import json
+import platform
+import random
+import resource
+import subprocess
+import sys
+import time
+import av, cv2
+import pipeline
+from analysis_model import EMPTY, Analysis
+import state
+from map_renderer import render_map
+from scheduler import QuotaScheduler
+from encoder import PayloadEncoder
+from frame_mailbox import FrameMailbox
+from signal_controller import TrafficSignalController
+from standin_server import random_analysis
+
+TRACK_BUDGET_MS = 5.0          # per-frame tracker cost the WebRTC budget allows (720p)
+
+# ── Stage recorder ───────────────────────────────────────────────────────────
+class _Span:
+    __slots__ = ("samples", "t0")
+
+    def __init__(self, samples):
+        self.samples = samples
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+
+    def __exit__(self, *exc):
+        self.samples.append(time.perf_counter() - self.t0)
+
+class StageRecorder:
+    def __init__(self):
+        self.samples = {}
+
+    def span(self, name):
+        return _Span(self.samples.setdefault(name, []))
+
+    def summary(self):
+        out = {}
+        for name, xs in sorted(self.samples.items()):
+            xs = sorted(xs)
+            pct = lambda p: xs[min(len(xs) - 1, int(p / 100 * len(xs)))] * 1000
+            out[name] = {"count": len(xs), "mean_ms": sum(xs) / len(xs) * 1000,
+                         "p50_ms": pct(50), "p90_ms": pct(90), "p99_ms": pct(99),
+                         "max_ms": xs[-1] * 1000}
+        return out
+
+# ── Deterministic Gemini stand-in ────────────────────────────────────────────
+def make_fake_analyzer(latency, jitter, seed=0, emergency_rate=0.0):
+    rng = random.Random(seed)
+
+    def fake_analyze_frame(frame_bytes, prompt=None, on_field=None):
+        total = max(0.0, rng.gauss(latency, jitter))
+        fields = random_analysis(rng, emergency_rate)
+        if on_field is None:
+            time.sleep(total)
+        else:
+            # Streamed in prompt order, time spread by output size like a real model
+            sizes = {key: len(json.dumps(value)) for key, value in fields.items()}
+            for key, value in fields.items():
+                time.sleep(total * sizes[key] / sum(sizes.values()))
+                on_field(key, value)
+        return Analysis.from_dict(fields)
+
+    return fake_analyze_frame
+
+def _reset_state(call_interval, local_detector, encoder=None):
+    state.scheduler = QuotaScheduler(per_minute=10**6, per_day=10**9, reserve=0,
+                                     open_hour=0, close_hour=24)
+    state.last_analysis, state.analysis_version = EMPTY, 0
+    state.next_allowed_call, state.analyzing = 0.0, False
+    state.api_calls_made = state.gate_hits = state.gate_misses = 0
+    state.use_mock = False
+    state.encoder = encoder or PayloadEncoder()
+    state.mailbox = FrameMailbox()
+    state.use_local_detector = local_detector
+    if local_detector:
+        from local_detector import LocalDetector
+        state.local_detector = LocalDetector()
+    pipeline._CALL_INTERVAL = call_interval
+
+def _git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"],
+                                       stderr=subprocess.DEVNULL, text=True).strip()
+    except Exception:
+        return None
+
+# ── Run ──────────────────────────────────────────────────────────────────────
+def run(video, realtime=False, max_frames=None, latency=1.5, jitter=0.3,
+        call_interval=pipeline._CALL_INTERVAL, rerun_every=5.0, local_detector=False,
+        encoder=None):
+    cap = cv2.VideoCapture(video)
+    if not cap.isOpened():
+        raise SystemExit(f"cannot open {video}")
+    fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+    size = (int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)), int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)))
+
+    rec = StageRecorder()
+    pipeline.span = rec.span
+    pipeline.analyze_frame = pipeline.analyze_frame_stream = make_fake_analyzer(latency, jitter)
+    _reset_state(call_interval, local_detector, encoder)
+    controller = TrafficSignalController()
+
+    frames, next_rerun = 0, 0.0
+    start = time.perf_counter()
+    while max_frames is None or frames < max_frames:
+        ok, img = cap.read()
+        if not ok:
+            break
+        frame = av.VideoFrame.from_ndarray(img, format="bgr24")
+        with rec.span("callback"):
+            pipeline.video_frame_callback(frame)
+        frames += 1
+
+        # What one dashboard rerun does with the result
+        video_t = frames / fps
+        if video_t >= next_rerun:
+            next_rerun = video_t + rerun_every
+            with state.lock:
+                analysis = state.last_analysis
+            with rec.span("controller_update"):
+                signal = controller.update(analysis, {})
+            with rec.span("map_render"):
+                render_map(analysis, signal)
+
+        if realtime:
+            delay = start + video_t - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+    wall = time.perf_counter() - start
+    cap.release()
+    state.executor.submit(lambda: None).result()     # let the last analysis land
+
+    return {
+        "meta": {
+            "commit": _git_commit(), "video": video, "video_fps": fps, "frame_size": size,
+            "realtime": realtime, "latency_s": latency, "jitter_s": jitter,
+            "call_interval_s": call_interval, "local_detector": local_detector,
+            "roi": state.encoder.roi, "upload_budget": state.encoder.budget,
+            "grayscale": state.encoder.grayscale,
+            "python": platform.python_version(), "opencv": cv2.__version__,
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "frames":     frames,
+        "wall_s":     wall,
+        "fps":        frames / wall if wall else 0.0,
+        "api_calls":  state.api_calls_made,
+        "uploads":    state.encoder.stats(),
+        "mailbox":    state.mailbox.stats(),
+        "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "stages":     rec.summary(),
+    }
+
+def compare(new, old):
+    print(f"{'stage':<18}{'p50 old':>10}{'p50 new':>10}{'p99 old':>10}{'p99 new':>10}{'Δp50':>9}")
+    for name in sorted(set(new["stages"]) | set(old["stages"])):
+        a, b = old["stages"].get(name), new["stages"].get(name)
+        if not a or not b:
+            print(f"{name:<18}{'(only in ' + ('new' if b else 'old') + ')':>40}")
+            continue
+        delta = (b["p50_ms"] - a["p50_ms"]) / a["p50_ms"] * 100 if a["p50_ms"] else 0.0
+        print(f"{name:<18}{a['p50_ms']:>10.3f}{b['p50_ms']:>10.3f}"
+              f"{a['p99_ms']:>10.3f}{b['p99_ms']:>10.3f}{delta:>+8.1f}%")
+    print(f"{'fps':<18}{old['fps']:>10.1f}{new['fps']:>10.1f}")
+    print(f"{'max RSS (MB)':<18}{old['max_rss_mb']:>10.1f}{new['max_rss_mb']:>10.1f}")
+    if old.get("uploads") and new.get("uploads"):
+        print(f"{'upload KB':<18}{old['uploads']['mean_bytes'] / 1024:>10.1f}"
+              f"{new['uploads']['mean_bytes'] / 1024:>10.1f}")
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("video")
+    ap.add_argument("--realtime", action="store_true", help="pace frames at the video's fps")
+    ap.add_argument("--frames", type=int, default=None, help="stop after this many frames")
+    ap.add_argument("--latency", type=float, default=1.5, help="stand-in Gemini latency (s)")
+    ap.add_argument("--jitter", type=float, default=0.3, help="latency std-dev (s)")
+    ap.add_argument("--call-interval", type=float, default=pipeline._CALL_INTERVAL)
+    ap.add_argument("--rerun-every", type=float, default=5.0,
+                    help="simulate a dashboard rerun every N seconds of video")
+    ap.add_argument("--local-detector", action="store_true")
+    ap.add_argument("--roi", help="upload crop as y_min,x_min,y_max,x_max (0-1000)")
+    ap.add_argument("--budget", type=int, default=60_000, help="upload byte budget")
+    ap.add_argument("--grayscale", action="store_true", help="upload single-channel JPEGs")
+    ap.add_argument("--out", default="bench_results.json")
+    ap.add_argument("--compare", metavar="OLD_JSON")
+    args = ap.parse_args(argv)
+
+    result = run(args.video, realtime=args.realtime, max_frames=args.frames,
+                 latency=args.latency, jitter=args.jitter, call_interval=args.call_interval,
+                 rerun_every=args.rerun_every, local_detector=args.local_detector,
+                 encoder=PayloadEncoder(roi=[float(v) for v in args.roi.split(",")] if args.roi else None,
+                                        budget=args.budget, grayscale=args.grayscale))
+    with open(args.out, "w") as f:
+        json.dump(result, f, indent=2)
+    print(f"{result['frames']} frames in {result['wall_s']:.1f}s "
+          f"({result['fps']:.1f} fps), {result['api_calls']} analyses, "
+          f"peak RSS {result['max_rss_mb']:.0f} MB → {args.out}")
+    if result["uploads"]:
+        up = result["uploads"]
+        print(f"  uploads: {up['mean_bytes'] / 1024:.1f} KB avg, last "
+              f"{up['last']['width']}x{up['last']['height']} q{up['last']['quality']}")
+    box = result["mailbox"]
+    print(f"  mailbox: {box['posted']} frames posted, {box['taken']} taken by the worker, "
+          f"{box['dropped']} overwritten")
+    for name, s in result["stages"].items():
+        print(f"  {name:<18} n={s['count']:<6} p50={s['p50_ms']:.3f}ms "
+              f"p90={s['p90_ms']:.3f}ms p99={s['p99_ms']:.3f}ms")
+    track = result["stages"].get("track")
+    if track:
+        w, h = result["meta"]["frame_size"]
+        verdict = "within" if track["p99_ms"] <= TRACK_BUDGET_MS else "OVER"
+        print(f"  tracker at {w}x{h}: p50 {track['p50_ms']:.2f}ms, p99 {track['p99_ms']:.2f}ms per frame "
+              f"— {verdict} the {TRACK_BUDGET_MS:.0f}ms budget")
+    if args.compare:
+        with open(args.compare) as f:
+            compare(result, json.load(f))
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,144 @@
+"""Adaptive JPEG encoder for analysis uploads.
+
+Crops to a region of interest (road plus crosswalk), then picks resolution
+and JPEG quality so each upload stays under a byte budget. The settings carry
+over between frames, so a steady scene usually costs one encode. Boxes in the
+response are in the crop's 0-1000 space; to_frame() maps them back to the
+full frame. Bytes sent and round-trip time are logged per call.
+
+Configured from the environment:
+    ANALYSIS_ROI="y_min,x_min,y_max,x_max"   0-1000, default the whole frame
+    UPLOAD_BUDGET=60000                      bytes per upload
+    UPLOAD_GRAYSCALE=1                       send a single-channel JPEG
+"""
+import os
+import threading
+import time
+from collections import deque
+import cv2
+from mosaic import expand_box
+import metrics
+
+FULL_FRAME  = (0, 0, 1000, 1000)
+BYTE_BUDGET = 60_000
+MAX_WIDTH   = 960          # what the uploads used to be
+MIN_WIDTH   = 384
+MAX_QUALITY = 90
+MIN_QUALITY = 40
+SOFT_QUALITY = 70          # below this, shrinking the image hurts less than more artifacts
+HEADROOM    = 0.6          # under this share of the budget, try better settings
+LOG_SIZE    = 256
+
+
+class Payload:
+    __slots__ = ("data", "region", "width", "height", "quality", "grayscale")
+
+    def __init__(self, data, region, width, height, quality, grayscale):
+        self.data      = data
+        self.region    = region
+        self.width     = width
+        self.height    = height
+        self.quality   = quality
+        self.grayscale = grayscale
+
+
+class PayloadEncoder:
+    def __init__(self, roi=None, budget=BYTE_BUDGET, grayscale=False,
+                 max_width=MAX_WIDTH, min_width=MIN_WIDTH):
+        self.roi       = tuple(roi) if roi else FULL_FRAME
+        self.budget    = budget
+        self.grayscale = grayscale
+        self.max_width = max_width
+        self.min_width = min_width
+        self.width     = max_width
+        self.quality   = MAX_QUALITY
+        self.log       = deque(maxlen=LOG_SIZE)
+        self._lock     = threading.Lock()
+
+    @classmethod
+    def from_env(cls):
+        roi = os.getenv("ANALYSIS_ROI")
+        return cls(roi=[float(v) for v in roi.split(",")] if roi else None,
+                   budget=int(os.getenv("UPLOAD_BUDGET", BYTE_BUDGET)),
+                   grayscale=os.getenv("UPLOAD_GRAYSCALE", "") not in ("", "0"))
+
+    # ── Encoding ─────────────────────────────────────────────────────────────
+    def _crop(self, img):
+        h, w = img.shape[:2]
+        y0, x0, y1, x1 = self.roi
+        return img[int(y0 * h / 1000):int(y1 * h / 1000), int(x0 * w / 1000):int(x1 * w / 1000)]
+
+    def _step_down(self, size):
+        """Cheapest loss first: quality down to SOFT_QUALITY, then resolution,
+        then the rest of the quality range."""
+        if self.quality > SOFT_QUALITY:
+            self.quality = max(SOFT_QUALITY, self.quality - 10)
+        elif self.width > self.min_width:
+            # JPEG size is roughly proportional to pixel count
+            scale = min(0.9, (self.budget / size) ** 0.5)
+            self.width = max(self.min_width, int(self.width * scale))
+        elif self.quality > MIN_QUALITY:
+            self.quality = max(MIN_QUALITY, self.quality - 10)
+        else:
+            return False
+        return True
+
+    def _step_up(self):
+        if self.quality < SOFT_QUALITY:
+            self.quality = min(SOFT_QUALITY, self.quality + 5)
+        elif self.width < self.max_width:
+            self.width = min(self.max_width, int(self.width * 1.15))
+        elif self.quality < MAX_QUALITY:
+            self.quality = min(MAX_QUALITY, self.quality + 5)
+
+    def encode(self, img):
+        crop = self._crop(img)
+        ch, cw = crop.shape[:2]
+        if self.grayscale:
+            crop = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+        with self._lock:
+            scaled, scaled_w = None, None
+            while True:
+                w = min(self.width, cw)
+                if w != scaled_w:
+                    h = max(1, round(ch * w / cw))
+                    scaled = crop if w == cw else cv2.resize(crop, (w, h), interpolation=cv2.INTER_AREA)
+                    scaled_w = w
+                _, buf = cv2.imencode('.jpg', scaled, [cv2.IMWRITE_JPEG_QUALITY, self.quality])
+                if len(buf) <= self.budget or not self._step_down(len(buf)):
+                    break
+            quality = self.quality
+            if len(buf) < self.budget * HEADROOM:
+                self._step_up()
+        metrics.observe("upload_bytes", len(buf), unit="bytes")
+        return Payload(buf.tobytes(), self.roi, scaled.shape[1], scaled.shape[0],
+                       quality, self.grayscale)
+
+    # ── Response side ────────────────────────────────────────────────────────
+    @staticmethod
+    def to_frame(analysis, payload):
+        """Analysis with every box mapped from the payload crop to the full frame."""
+        if tuple(payload.region) == FULL_FRAME or not analysis:
+            return analysis
+        return analysis.map_boxes(lambda box: expand_box(box, payload.region))
+
+    def record(self, payload, rtt, ok):
+        self.log.append({"t": time.time(), "bytes": len(payload.data), "rtt": rtt, "ok": ok,
+                         "width": payload.width, "height": payload.height,
+                         "quality": payload.quality, "grayscale": payload.grayscale})
+
+    def stats(self):
+        """Summary of recent uploads for the dashboard / benchmark."""
+        calls = list(self.log)
+        if not calls:
+            return None
+        rtts  = sorted(c["rtt"] for c in calls if c["ok"])
+        last  = calls[-1]
+        return {
+            "calls":      len(calls),
+            "errors":     sum(1 for c in calls if not c["ok"]),
+            "mean_bytes": sum(c["bytes"] for c in calls) / len(calls),
+            "rtt_p50":    rtts[len(rtts) // 2] if rtts else None,
+            "rtt_max":    rtts[-1] if rtts else None,
+            "last":       {k: last[k] for k in ("bytes", "width", "height", "quality", "grayscale")},
+        }
@@ -0,0 +1,505 @@
+"""Traffic engine: capture → analyze → signal controller → Arduino / voice alerts.
+
+    python engine.py --camera 0 --arduino /dev/ttyACM0 --record logs/
+    python engine.py --video traffic.mp4 --loop --mock
+    python engine.py --replay logs/ --speed 4         # no camera, no Gemini
+    python engine.py --cameras 0 1 2 3                # one mosaic call for four approaches
+
+The control loop runs once per process on its own clock, not once per
+Streamlit rerun per browser session. Its latest state (analysis, signal,
+annotated frame, map PNG, quota and metrics) is published to shared memory
+(see snapshot.py); app.py only reads and renders it, so ten dashboards cost
+about the same as one. Without a running engine, app.py starts an embedded
+Engine on a background thread of its own process instead.
+"""
+import argparse
+import sys
+import threading
+import time
+import cv2
+import numpy as np
+from arduino_controller import ArduinoController
+from analysis_model import EMPTY, Analysis, Detection
+from local_detector import LocalDetector, merge as merge_local
+from map_renderer import render_map
+from signal_controller import TrafficSignalController
+from voice_alerts import play_alert, play_sequence, warm_cache
+import metrics
+import overlay
+import pipeline
+import state
+
+# ── Constants ────────────────────────────────────────────────────────────────
+CONTROL_EVERY  = 1.0           # controller / Arduino / alerts
+PUBLISH_EVERY  = 0.25          # snapshot (and preview frame) refresh
+ARDUINO_RESEND = 5.0           # repeat an unchanged WALK / STOP this often
+PREVIEW_WIDTH  = 640
+PREVIEW_QUALITY = 70
+
+def idle_signal():
+    return {
+        "action": "idle", "light_state": "green", "walk_sign": False,
+        "message": "⚠️ Daily API quota exhausted. Analysis resumes tomorrow."
+                   if state.scheduler.exhausted()
+                   else ("Camera active — waiting for first analysis..."
+                         if state.camera_active
+                         else "Waiting for camera...")
+    }
+
+class Engine:
+    def __init__(self, arduino_port=None, sensors=None, writer=None, preview=False, wake=None):
+        self.controller = TrafficSignalController()
+        self.arduino    = None
+        self.sensors    = sensors       # SensorReader, or None
+        self.writer     = writer        # SnapshotWriter, or None when embedded
+        self.preview    = preview       # publish the annotated frame as JPEG
+        self.started_at = time.time()
+        self.replay_at  = None          # log time being replayed (replay())
+        self.wake       = wake or state.wake    # run the controller now (emergency)
+        self.last_alert_state = None
+        self.last_pir   = False
+        self._sent      = (None, 0.0)   # last Arduino command and when
+        self._frame     = None          # latest annotated frame (capture thread)
+        self._latest    = None
+        self._stop      = threading.Event()
+        if arduino_port:
+            self.connect_arduino(arduino_port)
+
+    def connect_arduino(self, port):
+        if self.arduino:
+            self.arduino.close()
+        self.arduino = ArduinoController(port)
+        self._sent   = (None, 0.0)
+
+    # ── Control ──────────────────────────────────────────────────────────────
+    def latest_analysis(self):
+        """(Gemini analysis, local analysis, age of the first in s or None)."""
+        with state.lock:
+            analysis = state.last_analysis
+            local    = state.local_analysis if state.use_local_detector else EMPTY
+            age      = time.time() - state.analysis_at if state.analysis_at else None
+        return analysis, local, age
+
+    def control_tick(self):
+        analysis, local, age = self.latest_analysis()
+        analysis = merge_local(local, analysis, remote_age=age)
+
+        # Merge Arduino PIR sensor into analysis
+        ard = self.arduino
+        pir_now = bool(ard and ard.connected and ard.sensor_triggered)
+        if pir_now and not self.last_pir:
+            state.priority_pending = True       # PIR edge — analyze soon, from the reserve
+        self.last_pir = pir_now
+        if pir_now and not analysis.pedestrians:
+            # PIR fired — inject a synthetic pedestrian waiting to cross
+            analysis = analysis.replace(
+                pedestrians=[Detection("pedestrians", crossing=False, source="pir")])
+
+        sensor_counts = self.sensors.get_counts() if self.sensors else {}
+        # Live readers keep O(1) windowed rates; a replay only has the totals
+        get_rates     = getattr(self.sensors, "get_rates", None)
+        sensor_rates  = get_rates(self.controller.window) if get_rates else None
+        with metrics.span("controller_update"):
+            signal = (self.controller.update(analysis, sensor_counts, sensor_rates=sensor_rates)
+                      if analysis else None)
+        if signal is None:
+            signal = idle_signal()
+        if state.recorder:
+            state.recorder.signal(signal)
+            state.recorder.sensors(sensor_counts, pir_now)
+
+        if ard and ard.connected:
+            command, now = ("WALK" if signal.get("walk_sign") else "STOP"), time.time()
+            if command != self._sent[0] or now - self._sent[1] >= ARDUINO_RESEND:
+                with metrics.span("arduino_send"):
+                    ard.send(command)
+                self._sent = (command, now)
+
+        if analysis:
+            self._alert(analysis, signal)
+        with metrics.span("map_render"):
+            map_png = render_map(analysis, signal, pir_now)
+        return analysis, signal, pir_now, map_png, sensor_counts
+
+    def _alert(self, analysis, signal):
+        # emergency_priority alone is enough — with streaming it arrives first
+        emergency = analysis.emergency_priority or analysis.counts["ambulance"] > 0
+        walk     = bool(signal.get("walk_sign"))
+        has_peds = bool(analysis.pedestrians)
+        alert_state = f"{signal.get('action')}_{has_peds}_{walk}_{emergency}"
+        if alert_state == self.last_alert_state:
+            return
+        self.last_alert_state = alert_state
+        if emergency:
+            play_alert("do_not_cross")
+        elif has_peds and walk:
+            play_sequence("pedestrians_on_road", "walk")
+        elif has_peds:
+            play_sequence("pedestrians_on_road", "wait")
+
+    # ── Publishing ───────────────────────────────────────────────────────────
+    def _meta(self, analysis, signal, pir_now, sensor_counts):
+        with state.lock:
+            calls, hits, misses = state.api_calls_made, state.gate_hits, state.gate_misses
+            tracked = state.tracked
+        ard = self.arduino
+        return {
+            "published_at":  time.time(),
+            "started_at":    self.started_at,
+            "analysis":      analysis,
+            "tracked":       tracked,
+            "signal":        signal,
+            "pir":           pir_now,
+            "sensors":       sensor_counts,
+            "camera_active": state.camera_active,
+            "api_calls":     calls,
+            "gate_hits":     hits,
+            "gate_misses":   misses,
+            "forecast":      state.scheduler.forecast(),
+            "uploads":       state.encoder.stats(),
+            "mailbox":       state.mailbox.stats(),
+            "arduino":       {"port": getattr(ard, "port", None),
+                              "connected": bool(ard and ard.connected)},
+            "use_mock":      state.use_mock,
+            "use_local_detector": state.use_local_detector,
+            "recording":     state.recorder.stats() if state.recorder else None,
+            "replay_at":     self.replay_at,
+            "metrics":       metrics.snapshot(),
+        }
+
+    def _preview_jpeg(self):
+        img = self._frame
+        if img is None:
+            return b""
+        h, w = img.shape[:2]
+        if w > PREVIEW_WIDTH:
+            img = cv2.resize(img, (PREVIEW_WIDTH, h * PREVIEW_WIDTH // w), interpolation=cv2.INTER_AREA)
+        ok, buf = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, PREVIEW_QUALITY])
+        return buf.tobytes() if ok else b""
+
+    def snapshot(self):
+        """Latest published state, same shape as SnapshotReader.read()."""
+        return self._latest
+
+    def run(self):
+        """Control / publish loop; returns when stop() is called."""
+        next_control, tick = 0.0, None
+        while not self._stop.is_set():
+            now = time.monotonic()
+            if tick is None or now >= next_control or self.wake.is_set():
+                self.wake.clear()       # set early by pipeline.py on an emergency
+                tick = self.control_tick()
+                next_control = now + CONTROL_EVERY
+            analysis, signal, pir_now, map_png, sensor_counts = tick
+            meta  = self._meta(analysis, signal, pir_now, sensor_counts)
+            frame = self._preview_jpeg() if self.preview else b""
+            if self.writer:
+                self.writer.publish(meta, frame, map_png)
+            self._latest = dict(meta, frame=frame, map=map_png)
+            self.wake.wait(PUBLISH_EVERY)
+
+    def start(self):
+        threading.Thread(target=self.run, daemon=True, name="traffic-engine").start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        self.wake.set()
+
+    # ── Capture (headless only — embedded mode gets frames from WebRTC) ──────
+    def capture(self, source, loop=False):
+        """`source` is a camera index, a file / stream URL or a ready-made
+        VideoCapture-like object (see fleet.SyntheticSource)."""
+        if hasattr(source, "read"):
+            cap = source
+        else:
+            cap = cv2.VideoCapture(int(source) if str(source).isdigit() else source)
+        if not cap.isOpened():
+            raise SystemExit(f"cannot open {source}")
+        is_file = not str(source).isdigit()
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        start, n = time.monotonic(), 0
+        while not self._stop.is_set():
+            ok, img = cap.read()
+            if not ok:
+                if is_file and loop:
+                    cap.set(cv2.CAP_PROP_POS_FRAMES, 0)
+                    start, n = time.monotonic(), 0
+                    continue
+                break
+            with metrics.span("engine_frame"):
+                self._frame = self.process(img)
+            metrics.inc("engine_frames")
+            n += 1
+            if is_file:
+                # Pace recorded video at its own frame rate
+                delay = start + n / fps - time.monotonic()
+                if delay > 0:
+                    time.sleep(delay)
+        cap.release()
+
+    def process(self, img):
+        """Analyze / track one captured frame; returns it annotated."""
+        return pipeline.process_image(img)
+
+    # ── Replay (headless only) ───────────────────────────────────────────────
+    def replay(self, log, speed=1.0, start=None, end=None, loop=False):
+        """Drive the engine from a recorded event log instead of the camera
+        and Gemini. Logged analyses become state.last_analysis, keyframes the
+        preview and sensor records the loop-detector / PIR inputs; the
+        controller runs live on them, on the log's clock."""
+        self.arduino = _ReplayArduino()
+        self.sensors = _ReplaySensors()
+        kinds = ("analysis", "keyframe", "sensors")
+        while not self._stop.is_set():
+            origin, keyframe = None, None
+            for t, kind, value in log.range(start, end, kinds):
+                if origin is None:
+                    origin = (t, time.monotonic())
+                    self.controller.clock = lambda: origin[0] + (time.monotonic() - origin[1]) * speed
+                delay = origin[1] + (t - origin[0]) / speed - time.monotonic()
+                if delay > 0 and self._stop.wait(delay):
+                    return
+                self.replay_at = t
+                if kind == "analysis":
+                    analysis = Analysis.from_dict(value)
+                    with state.lock:
+                        state.last_analysis = analysis
+                        state.analysis_version += 1
+                        state.analysis_at = time.time()
+                    if keyframe is not None:
+                        # The keyframe is logged just before the analysis made from it
+                        self._frame = overlay.draw_analysis(keyframe.copy(), analysis)
+                elif kind == "keyframe":
+                    img = cv2.imdecode(np.frombuffer(value, np.uint8), cv2.IMREAD_COLOR)
+                    if img is not None:
+                        self._frame = keyframe = img
+                else:
+                    self.sensors.counts = value["counts"]
+                    self.arduino.sensor_triggered = value["pir"]
+            if not loop or origin is None:
+                return
+
+
+class _ReplayArduino:
+    """Stands in for the Arduino during a replay: PIR from the log, commands dropped."""
+    port, connected, sensor_triggered = "replay", True, False
+
+    def send(self, command):
+        pass
+
+    def close(self):
+        pass
+
+
+class _ReplaySensors:
+    counts = {}
+
+    def get_counts(self):
+        return dict(self.counts)
+
+# ── Camera group (headless only) ─────────────────────────────────────────────
+class CameraGroup:
+    """Several cameras analyzed together: one mosaic Gemini call per
+    scheduler token instead of one call per camera (mosaic.py).
+
+    Each camera is a _Camera engine with its own controller and snapshot
+    ("<TRAFFIC_SNAPSHOT>_<i>"); its capture thread posts frames to its own
+    FrameMailbox. The group's worker takes the newest frame of every camera,
+    makes one call when the spacing, backoff and scheduler allow it, and
+    hands each per-camera analysis to that camera's controller. There is no
+    scene gate or tracker here — overlays show the last analysis as is.
+    """
+    def __init__(self, sources, writers, arduino_port=None, sensors=None, analyze=None):
+        from frame_mailbox import FrameMailbox
+        import mosaic
+        self.sources   = list(sources)
+        self.encode    = mosaic.encode_cameras
+        self.analyze   = analyze or mosaic.send      # encode_cameras() request → [Analysis]
+        self.mailboxes = [FrameMailbox() for _ in self.sources]
+        self.analyses  = [(EMPTY, 0.0)] * len(self.sources)    # (Analysis, time it landed)
+        # The Arduino and loop detectors are wired to the first camera's approach
+        self.engines   = [_Camera(self, i, writer=w, preview=True,
+                                  arduino_port=arduino_port if i == 0 else None,
+                                  sensors=sensors if i == 0 else None)
+                          for i, w in enumerate(writers)]
+        self._stop     = threading.Event()
+
+    def analyze_once(self, frames):
+        """One call for all `frames`; False if the scheduler had no token.
+        The request is built first, so a failure there spends no quota."""
+        request = None if state.use_mock else self.encode(frames)
+        priority = state.priority_pending or any(a.emergency_priority for a, _ in self.analyses)
+        if not (state.use_mock or state.scheduler.try_acquire(priority=priority)):
+            return False
+        with state.lock:
+            state.api_calls_made += 1
+            state.priority_pending = False
+        metrics.inc("gemini_calls")
+        with metrics.span("analyze_cameras"):
+            if state.use_mock:
+                results = [pipeline.mock_analysis() for _ in frames]
+            else:
+                results = self.analyze(request)
+        now = time.time()
+        self.analyses = [(a, now) for a in results]
+        with state.lock:
+            state.analysis_version += 1
+            state.analysis_at       = now
+        for engine, analysis in zip(self.engines, results):
+            if analysis.emergency_priority:
+                engine.wake.set()
+        return True
+
+    def run(self):
+        """Analysis worker; returns when stop() is called."""
+        frames = [None] * len(self.sources)
+        next_call = 0.0
+        while not self._stop.wait(max(0.0, next_call - time.time())):
+            for i, mailbox in enumerate(self.mailboxes):
+                img = mailbox.take()
+                if img is not None:
+                    frames[i] = img         # valid until this mailbox's next take()
+            if any(f is None for f in frames):
+                next_call = time.time() + pipeline._GATE_RECHECK     # a camera has not started
+                continue
+            try:
+                called = self.analyze_once(frames)
+            except Exception as e:
+                backoff = pipeline.backoff_after(e)
+                next_call = time.time() + (backoff if backoff is not None else pipeline._GATE_RECHECK)
+                continue
+            next_call = time.time() + (pipeline._CALL_INTERVAL if called else pipeline._GATE_RECHECK)
+
+    def start(self):
+        for engine in self.engines:
+            engine.start()
+        threading.Thread(target=self.run, daemon=True, name="camera-group").start()
+        return self
+
+    def capture(self, loop=False):
+        """Capture every camera on its own thread; returns when all have ended."""
+        threads = [threading.Thread(target=engine.capture, args=(source, loop), daemon=True)
+                   for engine, source in zip(self.engines, self.sources)]
+        for t in threads:
+            t.start()
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(0.5)
+
+    def stop(self):
+        self._stop.set()
+        for engine in self.engines:
+            engine.stop()
+
+
+class _Camera(Engine):
+    """One camera of a CameraGroup, controlled on the group's analysis of it."""
+    def __init__(self, group, index, **kwargs):
+        super().__init__(wake=threading.Event(), **kwargs)
+        self.group    = group
+        self.index    = index
+        self._drawn   = None
+        self._overlay = None
+
+    def latest_analysis(self):
+        analysis, at = self.group.analyses[self.index]
+        return analysis, EMPTY, time.time() - at if at else None
+
+    def process(self, img):
+        state.camera_active = True
+        self.group.mailboxes[self.index].post(img)
+        analysis = self.group.analyses[self.index][0]
+        if analysis is not self._drawn:
+            self._drawn, self._overlay = analysis, overlay.build(analysis)
+        boxes, styles, labels = self._overlay
+        h, w = img.shape[:2]
+        overlay.draw(img, overlay.to_pixels(boxes, w, h), styles, labels)
+        return img
+
+# ── Entry point ──────────────────────────────────────────────────────────────
+def main(argv=None):
+    from snapshot import SnapshotWriter
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    src = ap.add_mutually_exclusive_group()
+    src.add_argument("--camera", default="0", help="camera index or stream URL")
+    src.add_argument("--video", help="recorded video file instead of a camera")
+    ap.add_argument("--loop", action="store_true", help="restart the video when it ends")
+    ap.add_argument("--arduino", metavar="PORT", help="serial port of the signal Arduino")
+    ap.add_argument("--sensors", metavar="PORT", help="vehicle detector serial port, or MOCK")
+    ap.add_argument("--mock", action="store_true", help="mock analysis instead of Gemini")
+    ap.add_argument("--local-detector", action="store_true")
+    ap.add_argument("--no-stream", action="store_true",
+                    help="wait for whole Gemini responses instead of streaming them")
+    src.add_argument("--replay", metavar="DIR", help="replay an event log instead of a camera")
+    src.add_argument("--cameras", nargs="+", metavar="SRC",
+                     help="several cameras (indexes, files or URLs) analyzed in one mosaic call; "
+                          "snapshots <name>_0, <name>_1, ... and --arduino / --sensors go with the first")
+    ap.add_argument("--speed", type=float, default=1.0, help="replay speed")
+    ap.add_argument("--from", dest="start", help="replay from (epoch seconds or ISO time)")
+    ap.add_argument("--to", dest="end", help="replay until")
+    ap.add_argument("--record", metavar="DIR", help="append analyses, signals and sensor events here")
+    ap.add_argument("--no-keyframes", action="store_true", help="record without the analyzed JPEGs")
+    ap.add_argument("--metrics-port", type=int, help="serve /metrics on this port")
+    args = ap.parse_args(argv)
+    if args.cameras and args.record:
+        ap.error("--record takes one camera; not with --cameras")
+
+    state.use_mock = args.mock
+    state.use_streaming = not args.no_stream
+    state.use_local_detector = args.local_detector
+    if args.local_detector:
+        state.local_detector = LocalDetector()
+    sensors = None
+    if args.sensors:
+        from sensor_reader import SensorReader
+        sensors = SensorReader(args.sensors)
+        sensors.start()
+    if args.metrics_port:
+        metrics.start_exporter(args.metrics_port)
+    if args.record:
+        from event_log import EventLog
+        state.recorder = EventLog(args.record, keyframes=not args.no_keyframes)
+    warm_cache()
+
+    if args.cameras:
+        return run_group(args, sensors)
+    writer = SnapshotWriter()
+    engine = Engine(args.arduino, sensors=sensors, writer=writer, preview=True).start()
+    print(f"engine running — snapshot '{writer.shm.name}'")
+    try:
+        if args.replay:
+            from event_log import LogReader, parse_time
+            log = LogReader(args.replay)
+            print(f"replaying {len(log)} records from {args.replay} at {args.speed:g}x")
+            engine.replay(log, speed=args.speed, start=parse_time(args.start),
+                          end=parse_time(args.end), loop=args.loop)
+        else:
+            engine.capture(args.video or args.camera, loop=args.loop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        engine.stop()
+        time.sleep(PUBLISH_EVERY)       # let an in-flight publish finish
+        writer.close()
+        if state.recorder:
+            state.recorder.close()
+
+def run_group(args, sensors):
+    from snapshot import NAME, SnapshotWriter
+    writers = [SnapshotWriter(f"{NAME}_{i}") for i in range(len(args.cameras))]
+    group = CameraGroup(args.cameras, writers, args.arduino, sensors=sensors).start()
+    print(f"engine running {len(args.cameras)} cameras — snapshots "
+          + ", ".join(f"'{w.shm.name}'" for w in writers))
+    try:
+        group.capture(loop=args.loop)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        group.stop()
+        time.sleep(PUBLISH_EVERY)
+        for w in writers:
+            w.close()
+
+if __name__ == "__main__":
+    sys.exit(main())
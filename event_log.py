@@ -0,0 +1,251 @@
+"""Append-only log of analyses, signal decisions, sensor events and keyframes.
+
+engine.py --record DIR writes it; engine.py --replay DIR drives the
+controller and dashboard from it instead of the camera and Gemini.
+
+    python event_log.py logs/                          # segments, time range, counts
+    python event_log.py logs/ --kind signal --from 2026-10-17T08:00 --to 2026-10-17T09:00
+
+A log is a directory of segment files named by the time of their first
+record (ms since the epoch). A segment is MAGIC followed by records:
+
+    t (f64) | kind (u8) | length (u32) | crc32 (u32) | payload
+
+Payloads are compact JSON, except keyframes (the JPEG sent with an
+analysis). Records are never rewritten; a new segment starts every
+SEGMENT_BYTES and every time a writer opens the log, so a crash can at
+worst leave a torn last record, which the reader ignores.
+
+LogReader memory-maps the segments and keeps only record times and offsets
+in memory; a time-range query is a bisect per segment, and payloads are
+decoded only for the records asked for.
+"""
+import argparse
+import bisect
+import json
+import mmap
+import os
+import struct
+import threading
+import time
+import zlib
+from array import array
+from datetime import datetime
+
+MAGIC         = b"TLOG\x01\x00\x00\x00"
+SUFFIX        = ".tlog"
+SEGMENT_BYTES = 64 * 1024 * 1024
+
+_HEADER = struct.Struct("<dBII")
+
+ANALYSIS, SIGNAL, SENSORS, KEYFRAME = 1, 2, 3, 4
+KINDS = {ANALYSIS: "analysis", SIGNAL: "signal", SENSORS: "sensors", KEYFRAME: "keyframe"}
+_CODES = {name: code for code, name in KINDS.items()}
+
+# Signal fields worth a record when they change — not the per-second message
+_SIGNAL_KEYS = ("action", "light_state", "walk_sign", "phase")
+
+
+def _json(obj):
+    return json.dumps(obj, separators=(",", ":")).encode()
+
+
+# ── Writing ──────────────────────────────────────────────────────────────────
+class EventLog:
+    def __init__(self, directory, keyframes=True, segment_bytes=SEGMENT_BYTES):
+        os.makedirs(directory, exist_ok=True)
+        self.directory     = directory
+        self.keyframes     = keyframes
+        self.segment_bytes = segment_bytes
+        self.records       = 0
+        self.bytes         = 0
+        self._lock    = threading.Lock()
+        self._file    = None
+        self._size    = 0
+        self._last_t  = 0.0
+        self._signal  = None
+        self._sensors = None
+
+    def _roll(self, t):
+        if self._file:
+            self._file.close()
+        path = os.path.join(self.directory, f"{int(t * 1000):015d}{SUFFIX}")
+        while os.path.exists(path):         # reopened within the same millisecond
+            t += 0.001
+            path = os.path.join(self.directory, f"{int(t * 1000):015d}{SUFFIX}")
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+        self._size = len(MAGIC)
+
+    def append(self, kind, payload, t=None):
+        with self._lock:
+            # Time order is what the reader's bisect relies on
+            t = max(time.time() if t is None else t, self._last_t)
+            if self._file is None or self._size + _HEADER.size + len(payload) > self.segment_bytes:
+                self._roll(t)
+            self._file.write(_HEADER.pack(t, _CODES.get(kind, kind), len(payload), zlib.crc32(payload)))
+            self._file.write(payload)
+            self._file.flush()
+            self._size  += _HEADER.size + len(payload)
+            self._last_t = t
+            self.records += 1
+            self.bytes   += _HEADER.size + len(payload)
+
+    def analysis(self, analysis, jpeg=None, t=None):
+        """A completed analysis, preceded by the JPEG it was made from."""
+        if jpeg and self.keyframes:
+            self.append(KEYFRAME, bytes(jpeg), t)
+        self.append(ANALYSIS, _json(analysis.to_dict()), t)
+
+    def signal(self, signal, t=None):
+        """Controller output — only when the phase or lights change."""
+        key = tuple(signal.get(k) for k in _SIGNAL_KEYS)
+        if key != self._signal:
+            self._signal = key
+            self.append(SIGNAL, _json(signal), t)
+
+    def sensors(self, counts, pir, t=None):
+        """Loop-detector totals and the PIR state, when either changes."""
+        key = (tuple(sorted((counts or {}).items())), bool(pir))
+        if key != self._sensors:
+            self._sensors = key
+            self.append(SENSORS, _json({"counts": counts or {}, "pir": bool(pir)}), t)
+
+    def stats(self):
+        return {"directory": self.directory, "records": self.records, "bytes": self.bytes}
+
+    def close(self):
+        with self._lock:
+            if self._file:
+                self._file.close()
+                self._file = None
+
+
+# ── Reading ──────────────────────────────────────────────────────────────────
+class _Segment:
+    def __init__(self, path):
+        self.path    = path
+        self.times   = array("d")
+        self.offsets = array("Q")
+        self.mm      = None
+        with open(path, "rb") as f:
+            size = os.fstat(f.fileno()).st_size
+            if size <= len(MAGIC):
+                return
+            self.mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self.mm[:len(MAGIC)] != MAGIC:
+            raise ValueError(f"{path} is not an event log segment")
+        # Hop from header to header — payloads are not touched
+        pos, unpack = len(MAGIC), _HEADER.unpack_from
+        while pos + _HEADER.size <= size:
+            t, _, length, _ = unpack(self.mm, pos)
+            if pos + _HEADER.size + length > size:
+                break                       # torn last record
+            self.times.append(t)
+            self.offsets.append(pos)
+            pos += _HEADER.size + length
+
+    def records(self, start, end, codes):
+        lo = 0 if start is None else bisect.bisect_left(self.times, start)
+        hi = len(self.times) if end is None else bisect.bisect_right(self.times, end)
+        mm = self.mm
+        for i in range(lo, hi):
+            pos = self.offsets[i]
+            t, code, length, crc = _HEADER.unpack_from(mm, pos)
+            if codes and code not in codes:
+                continue
+            payload = mm[pos + _HEADER.size:pos + _HEADER.size + length]
+            if zlib.crc32(payload) != crc:
+                continue                    # corrupt — skip rather than guess
+            yield t, code, payload
+
+    def close(self):
+        if self.mm:
+            self.mm.close()
+
+
+class LogReader:
+    def __init__(self, directory):
+        names = sorted(n for n in os.listdir(directory) if n.endswith(SUFFIX))
+        segments = (_Segment(os.path.join(directory, n)) for n in names)
+        self.segments = [s for s in segments if s.times]
+
+    @property
+    def start(self):
+        return self.segments[0].times[0] if self.segments else None
+
+    @property
+    def end(self):
+        return self.segments[-1].times[-1] if self.segments else None
+
+    def __len__(self):
+        return sum(len(s.times) for s in self.segments)
+
+    def range(self, start=None, end=None, kinds=None):
+        """(t, kind, value) for every record with start <= t <= end, in time
+        order. JSON records are decoded; keyframes are JPEG bytes."""
+        codes = {_CODES[k] for k in kinds} if kinds else None
+        for seg in self.segments:
+            if (start is not None and seg.times[-1] < start) or (end is not None and seg.times[0] > end):
+                continue
+            for t, code, payload in seg.records(start, end, codes):
+                yield t, KINDS.get(code, code), payload if code == KEYFRAME else json.loads(payload)
+
+    def counts(self):
+        out = {}
+        for seg in self.segments:
+            for pos in seg.offsets:
+                name = KINDS.get(seg.mm[pos + 8], "unknown")
+                out[name] = out.get(name, 0) + 1
+        return out
+
+    def close(self):
+        for seg in self.segments:
+            seg.close()
+
+
+# ── Command line ─────────────────────────────────────────────────────────────
+def parse_time(value):
+    """Epoch seconds or an ISO date/time (local)."""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        return datetime.fromisoformat(value).timestamp()
+
+
+def _stamp(t):
+    return datetime.fromtimestamp(t).isoformat(timespec="milliseconds")
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("directory")
+    ap.add_argument("--from", dest="start", help="epoch seconds or ISO time")
+    ap.add_argument("--to", dest="end")
+    ap.add_argument("--kind", action="append", choices=list(_CODES),
+                    help="print these records as JSON lines (repeatable)")
+    args = ap.parse_args(argv)
+
+    log = LogReader(args.directory)
+    try:
+        if args.kind:
+            for t, kind, value in log.range(parse_time(args.start), parse_time(args.end), args.kind):
+                if kind == "keyframe":
+                    value = {"jpeg_bytes": len(value)}
+                print(json.dumps({"t": t, "time": _stamp(t), "kind": kind, "value": value}))
+        elif not len(log):
+            print("empty log")
+        else:
+            size = sum(os.path.getsize(s.path) for s in log.segments)
+            print(f"{len(log.segments)} segment(s), {size / 1e6:.1f} MB, "
+                  f"{_stamp(log.start)} → {_stamp(log.end)}")
+            for name, n in sorted(log.counts().items()):
+                print(f"  {name:<10}{n:>8}")
+    finally:
+        log.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,502 @@
+"""Run several intersections on one box, sharing one API key and TTS account.
+
+    python fleet.py --synthetic 8 --mock --always-open --per-day 2000
+    python fleet.py --config intersections.json
+    python fleet.py --intersections 8 --mock --always-open --per-day 2000 --duration 90 --check
+
+Each intersection is its own process with its own `state`, controller,
+tracker, Gemini client, sensor reader and Arduino port, running an Engine
+that publishes to snapshot "traffic_engine_<n>". The parent runs the Broker:
+it owns the single QuotaScheduler for the shared key and the TTS
+concurrency limit, and grants both by priority — emergencies first, then
+the densest scene. A grant an intersection no longer needs is handed back
+and refunded to the scheduler; a TTS slot that does not come in time is
+given up and the alert skipped.
+
+--check runs the fleet for --duration seconds and then verifies that every
+intersection published snapshots and that the calls granted never exceeded
+the per-minute or per-day limit. It also replays seeded ticks in which
+emergency and routine bids race for fewer grants than there are bids, and
+checks the order the broker granted them in.
+
+--config takes a JSON list of intersections:
+    [{"name": "5th & Main", "camera": "0", "arduino": "/dev/ttyACM0", "sensors": "/dev/ttyUSB0"},
+     {"name": "test", "video": "traffic.mp4"}, {"name": "sim", "synthetic": true}]
+"""
+import argparse
+import bisect
+import itertools
+import json
+import multiprocessing as mp
+import os
+import queue
+import random
+import signal
+import sys
+import threading
+import time
+from collections import Counter, deque
+from contextlib import contextmanager
+from datetime import date
+import cv2
+import numpy as np
+from scheduler import QuotaScheduler, PER_MINUTE, PER_DAY, RESERVE
+import snapshot
+
+TICK          = 0.05       # broker grant loop
+FORECAST_EVERY = 1.0       # broker → intersections quota forecast
+BID_TTL       = 3.0        # a bid not renewed this long is dropped (pipeline re-asks every 1 s)
+GRANT_TTL     = 5.0        # a grant not spent this long is handed back
+TTS_SLOTS     = 2          # concurrent ElevenLabs syntheses across the fleet
+TTS_WAIT      = 10.0       # give up on a TTS slot (and the alert) after this long
+AGING         = 60.0       # a bid gains one density level per this many seconds waiting
+_DENSITY_RANK = {"low": 1, "medium": 2, "high": 3, "gridlock": 4}
+_UNSEEN       = 4          # no analysis yet — as urgent as gridlock
+
+
+def _bid_rank(bid, now):
+    """Sort key — emergencies first, then the densest scene (aged, so quiet
+    intersections are not starved), then priority triggers (PIR / major
+    scene change), then whoever asked first."""
+    need = bid["density"] + (now - bid["since"]) / AGING
+    return (not bid["emergency"], -need, -bid["vehicles"], not bid["priority"], bid["since"])
+
+
+# ── Broker (parent process) ──────────────────────────────────────────────────
+class Broker:
+    def __init__(self, scheduler, requests, replies, tts_slots=TTS_SLOTS):
+        self.scheduler = scheduler
+        self.requests  = requests       # (kind, intersection, payload) from every worker
+        self.replies   = replies        # one queue per intersection
+        self.tts_slots = tts_slots
+        self.bids      = {}             # intersection -> latest bid
+        self.tts_wait  = []             # (urgent, t, intersection, request id)
+        self.tts_busy  = 0
+        self.granted   = [0] * len(replies)
+        self.refunded  = [0] * len(replies)
+        self.tts_granted = [0] * len(replies)
+        self.log       = []             # one dict per grant, for --check
+        self._ids      = itertools.count()
+
+    def handle(self, kind, i, payload):
+        if kind == "bid":
+            old = self.bids.get(i)
+            payload["since"] = old["since"] if old else time.monotonic()
+            payload["at"]    = time.monotonic()
+            self.bids[i] = payload
+        elif kind == "release":
+            gid, grant = payload
+            self.scheduler.refund(grant)
+            self.log[gid]["refunded"] = True
+            self.granted[i]  -= 1
+            self.refunded[i] += 1
+        elif kind == "rate_limited":
+            self.scheduler.on_rate_limited(payload)
+        elif kind == "daily_exhausted":
+            self.scheduler.on_daily_exhausted()
+        elif kind == "tts":
+            rid, urgent = payload
+            self.tts_wait.append((urgent, time.monotonic(), i, rid))
+        elif kind == "tts_cancel":
+            self.tts_wait = [w for w in self.tts_wait if (w[2], w[3]) != (i, payload)]
+        elif kind == "tts_done":
+            self.tts_busy -= 1
+        elif kind == "hello":
+            self.replies[i].put(("forecast", self.scheduler.forecast()))
+
+    def grant(self):
+        now = time.monotonic()
+        for i in [i for i, bid in self.bids.items() if now - bid["at"] > BID_TTL]:
+            del self.bids[i]            # the intersection stopped asking
+        for i, bid in sorted(self.bids.items(), key=lambda kv: _bid_rank(kv[1], now)):
+            # Ranked order: once the best bid is refused, so is everything after it
+            grant = self.scheduler.acquire(priority=bid["priority"] or bid["emergency"])
+            if grant is None:
+                break
+            del self.bids[i]
+            gid = next(self._ids)
+            self.log.append({"t": grant[1], "intersection": i, "emergency": bid["emergency"],
+                             "density": bid["density"], "refunded": False})
+            self.granted[i] += 1
+            self.replies[i].put(("grant", (gid, grant)))
+        if self.tts_wait and self.tts_busy < self.tts_slots:
+            self.tts_wait.sort(key=lambda w: (not w[0], w[1]))
+            while self.tts_wait and self.tts_busy < self.tts_slots:
+                _, _, i, rid = self.tts_wait.pop(0)
+                self.tts_busy += 1
+                self.tts_granted[i] += 1
+                self.replies[i].put(("tts", rid))
+
+    def run(self, stop):
+        next_forecast = 0.0
+        while not stop.is_set():
+            try:
+                msg = self.requests.get(timeout=TICK)
+                while True:
+                    self.handle(*msg)
+                    msg = self.requests.get_nowait()
+            except queue.Empty:
+                pass
+            self.grant()
+            if time.monotonic() >= next_forecast:
+                next_forecast = time.monotonic() + FORECAST_EVERY
+                fc = self.scheduler.forecast()
+                for q in self.replies:
+                    q.put(("forecast", fc))
+
+
+# ── Broker client (intersection process) ─────────────────────────────────────
+class BrokerClient:
+    """Stands in for state.scheduler inside an intersection process.
+
+    try_acquire() never blocks the frame path: it spends a grant the broker
+    already sent, or files a bid and returns False — pipeline.py looks again
+    after _GATE_RECHECK anyway. Grants not spent within GRANT_TTL (the scene
+    settled while the bid waited) go back to the broker.
+    """
+    def __init__(self, index, requests, replies, limits=None):
+        self.index     = index
+        self.requests  = requests
+        self.replies   = replies
+        self.granted   = deque()        # (received, grant id, grant)
+        # Until the broker's first reply: an untouched budget with the fleet's limits
+        self._forecast = QuotaScheduler(**(limits or {})).forecast()
+        self._tts      = {}
+        self._ids      = itertools.count()
+        self._lock     = threading.Lock()
+        self._ready    = threading.Event()
+        threading.Thread(target=self._listen, daemon=True).start()
+        self.requests.put(("hello", index, None))
+        self._ready.wait(5.0)
+
+    def _listen(self):
+        while True:
+            try:
+                kind, payload = self.replies.get(timeout=GRANT_TTL / 2)
+            except queue.Empty:
+                kind = None
+            if kind == "grant":
+                with self._lock:
+                    self.granted.append((time.monotonic(), *payload))
+            elif kind == "forecast":
+                self._forecast = payload
+                self._ready.set()
+            elif kind == "tts":
+                with self._lock:
+                    ready = self._tts.pop(payload, None)
+                if ready is not None:
+                    ready.set()
+                else:                   # granted after we gave up on it
+                    self.requests.put(("tts_done", self.index, None))
+            self._expire()
+
+    def _expire(self):
+        now = time.monotonic()
+        with self._lock:
+            while self.granted and now - self.granted[0][0] > GRANT_TTL:
+                _, gid, grant = self.granted.popleft()
+                self.requests.put(("release", self.index, (gid, grant)))
+
+    def try_acquire(self, priority=False):
+        import state
+        self._expire()
+        with self._lock:
+            if self.granted:
+                self.granted.popleft()
+                return True
+        with state.lock:
+            analysis = state.last_analysis
+        self.requests.put(("bid", self.index, {
+            "priority":  bool(priority),
+            "emergency": analysis.emergency_priority,
+            "density":   _DENSITY_RANK.get(analysis.traffic_density, _UNSEEN),
+            "vehicles":  len(analysis.vehicles),
+        }))
+        return False
+
+    def on_rate_limited(self, retry_after):
+        self.requests.put(("rate_limited", self.index, retry_after))
+
+    def on_daily_exhausted(self):
+        self.requests.put(("daily_exhausted", self.index, None))
+
+    def forecast(self):
+        return self._forecast
+
+    def exhausted(self):
+        return bool(self._forecast and self._forecast["exhausted"])
+
+    @contextmanager
+    def tts_slot(self, text):
+        """Wait for one of the fleet's TTS slots (AudioCache.limiter)."""
+        from voice_alerts import PHRASES
+        rid, ready = next(self._ids), threading.Event()
+        with self._lock:
+            self._tts[rid] = ready
+        urgent = text == PHRASES["do_not_cross"] or text.startswith("Attention")
+        self.requests.put(("tts", self.index, (rid, urgent)))
+        if not ready.wait(TTS_WAIT):
+            with self._lock:
+                abandoned = self._tts.pop(rid, None) is not None
+            if abandoned:               # (else the slot arrived just now — use it)
+                self.requests.put(("tts_cancel", self.index, rid))
+                raise TimeoutError(f"no TTS slot from the broker within {TTS_WAIT:.0f}s")
+        try:
+            yield
+        finally:
+            self.requests.put(("tts_done", self.index, None))
+
+
+# ── Synthetic camera ─────────────────────────────────────────────────────────
+class SyntheticSource:
+    """cv2.VideoCapture stand-in: cars driving across a two-lane road, with
+    traffic that swells and fades on a per-seed cycle."""
+    def __init__(self, seed=0, size=(1280, 720), fps=15.0, max_cars=12, period=120.0):
+        rng = np.random.default_rng(seed)
+        w, h = size
+        self.fps, self.size, self.period = fps, size, period
+        self.phase = rng.uniform(0, 2 * np.pi)
+        self.n = 0
+        base = np.full((h, w, 3), (70, 110, 70), np.uint8)        # grass
+        base[h // 3:2 * h // 3] = (60, 60, 60)                   # road
+        base[h // 2 - 2:h // 2 + 2, ::40] = (0, 200, 230)        # centre line
+        for x in range(w // 2 - 90, w // 2 + 90, 30):            # crosswalk
+            base[h // 3:2 * h // 3, x:x + 15] = (220, 220, 220)
+        self.base = base
+        lanes = rng.integers(0, 2, max_cars)
+        self.y      = np.where(lanes == 0, h // 3 + 20, h // 2 + 20)
+        self.x      = rng.uniform(0, w, max_cars)
+        self.speed  = np.where(lanes == 0, 1, -1) * rng.uniform(4, 12, max_cars)
+        self.length = rng.integers(60, 160, max_cars)
+        self.color  = rng.integers(40, 255, (max_cars, 3))
+
+    def isOpened(self):
+        return True
+
+    def get(self, prop):
+        return self.fps if prop == cv2.CAP_PROP_FPS else 0.0
+
+    def set(self, prop, value):
+        return False
+
+    def read(self):
+        w, h = self.size
+        t = self.n / self.fps
+        self.n += 1
+        active = int(len(self.x) * (0.55 + 0.45 * np.sin(2 * np.pi * t / self.period + self.phase)))
+        self.x = (self.x + self.speed) % (w + 160)
+        img = self.base.copy()
+        for i in range(active):
+            x0 = int(self.x[i]) - 160
+            cv2.rectangle(img, (x0, int(self.y[i])), (x0 + int(self.length[i]), int(self.y[i]) + 60),
+                          tuple(int(c) for c in self.color[i]), -1)
+        return True, img
+
+    def release(self):
+        pass
+
+
+# ── Intersection process ─────────────────────────────────────────────────────
+def run_intersection(index, spec, requests, replies, opts):
+    import pipeline
+    import state
+    from engine import Engine
+    from voice_alerts import get_queue, warm_cache
+
+    state.scheduler = BrokerClient(index, requests, replies, opts["limits"])
+    get_queue().cache.limiter = state.scheduler.tts_slot
+    state.use_local_detector = opts["local_detector"]
+    if opts["local_detector"]:
+        from local_detector import LocalDetector
+        state.local_detector = LocalDetector()
+    if opts["mock"]:
+        from benchmark import make_fake_analyzer
+        pipeline.analyze_frame = pipeline.analyze_frame_stream = make_fake_analyzer(
+            opts["latency"], opts["jitter"], seed=index, emergency_rate=opts["emergency_rate"])
+    sensors = None
+    if spec.get("sensors"):
+        from sensor_reader import SensorReader
+        sensors = SensorReader(spec["sensors"])
+        sensors.start()
+    warm_cache()
+
+    writer = snapshot.SnapshotWriter(f"{snapshot.NAME}_{index}")
+    engine = Engine(spec.get("arduino"), sensors=sensors, writer=writer, preview=True).start()
+    signal.signal(signal.SIGTERM, lambda *_: engine.stop())
+    signal.signal(signal.SIGINT, signal.SIG_IGN)     # the parent shuts us down
+    if spec.get("synthetic"):
+        source = SyntheticSource(seed=index)
+    else:
+        source = spec.get("video") or spec.get("camera", "0")
+    try:
+        engine.capture(source, loop=True)
+    finally:
+        engine.stop()
+        time.sleep(0.3)                 # let an in-flight publish finish
+        writer.close()
+
+
+# ── Parent ───────────────────────────────────────────────────────────────────
+def _report(specs, readers, broker, started):
+    print(f"\n── {time.time() - started:6.0f}s ── quota {broker.scheduler.forecast()['used_today']} used · "
+          f"{len(broker.bids)} waiting · TTS {broker.tts_busy}/{broker.tts_slots} busy, "
+          f"{len(broker.tts_wait)} queued")
+    print(f"{'#':>3} {'name':<16}{'fps':>6}{'frame p50':>11}{'calls':>7}{'tts':>5}  {'density':<9}{'veh':>4}  signal")
+    for i, spec in enumerate(specs):
+        if readers[i] is None:
+            readers[i] = snapshot.attach(f"{snapshot.NAME}_{i}")
+        snap = readers[i].read() if readers[i] else None
+        if not snap:
+            print(f"{i:>3} {spec['name']:<16}  (starting)")
+            continue
+        frames  = snap["metrics"]["counters"].get("engine_frames", 0)
+        span    = snap["metrics"]["spans"].get("engine_frame")
+        elapsed = max(1e-6, snap["published_at"] - snap["started_at"])
+        a = snap["analysis"]
+        print(f"{i:>3} {spec['name']:<16}{frames / elapsed:>6.1f}"
+              f"{(span['p50'] * 1000 if span else 0):>9.1f}ms{broker.granted[i]:>7}"
+              f"{broker.tts_granted[i]:>5}  {a.get('traffic_density', '-'):<9}"
+              f"{len(a.get('vehicles', [])):>4}  {snap['signal'].get('action')}")
+
+def check(specs, readers, broker):
+    """--check: what the fleet promises, after a bounded run. Returns the failures."""
+    failures = []
+    for i, spec in enumerate(specs):
+        reader = readers[i] or snapshot.attach(f"{snapshot.NAME}_{i}")
+        snap   = reader.read() if reader else None
+        if not snap:
+            failures.append(f"{spec['name']}: never published a snapshot")
+        elif not snap["metrics"]["counters"].get("engine_frames"):
+            failures.append(f"{spec['name']}: published, but processed no frames")
+        elif time.time() - snap["published_at"] > 5:
+            failures.append(f"{spec['name']}: last snapshot is {time.time() - snap['published_at']:.0f}s old")
+
+    log  = list(broker.log)
+    used = sorted(g["t"] for g in log if not g["refunded"])
+    sched = broker.scheduler
+    busiest = max((bisect.bisect_left(used, t + 60) - k for k, t in enumerate(used)), default=0)
+    if busiest > sched.per_minute:
+        failures.append(f"{busiest} calls granted within one minute (limit {sched.per_minute})")
+    per_day = Counter(date.fromtimestamp(t) for t in used)
+    if per_day and max(per_day.values()) > sched.per_day:
+        failures.append(f"{max(per_day.values())} calls granted in one day (limit {sched.per_day})")
+    print(f"\ncheck: {len(log)} grants ({len(log) - len(used)} handed back), "
+          f"{sum(g['emergency'] for g in log)} to emergencies, busiest minute {busiest}/{sched.per_minute}, "
+          f"{len(used)}/{sched.per_day} of the day")
+    for seed in range(5):
+        failures += [f"grant order, seed {seed}: {f}" for f in check_grant_order(seed)]
+    return failures
+
+def check_grant_order(seed, n_bids=8, per_minute=4):
+    """One broker tick in which routine bids (filed first) and emergency bids
+    race for `per_minute` grants: emergencies must all be granted first, and
+    the routine grants that follow go to the densest scenes."""
+    rng = random.Random(seed)
+    noon = time.mktime(date.today().timetuple()) + 12 * 3600
+    sched = QuotaScheduler(per_minute=per_minute, per_day=100, reserve=50,
+                           open_hour=0, close_hour=24, clock=lambda: noon)
+    broker = Broker(sched, None, [queue.Queue() for _ in range(n_bids)])
+    emergency = set(rng.sample(range(1, n_bids), rng.randint(1, per_minute - 1)))   # bid 0 is routine
+    for i in range(n_bids):
+        broker.handle("bid", i, {"priority": True, "emergency": i in emergency,
+                                 "density": rng.randint(1, 4), "vehicles": rng.randint(0, 12)})
+    broker.grant()
+
+    order = [g["intersection"] for g in broker.log]
+    failures = []
+    if len(order) != per_minute:
+        failures.append(f"{len(order)} grants, expected {per_minute}")
+    if set(order[:len(emergency)]) != emergency:
+        failures.append(f"grants {order}: emergencies {sorted(emergency)} were not all served first")
+    routine = [broker.log[k]["density"] for k, i in enumerate(order) if i not in emergency]
+    if routine != sorted(routine, reverse=True):
+        failures.append(f"routine grants by density {routine}, expected densest first")
+    if any(g["emergency"] for g in broker.bids.values()):
+        failures.append("an emergency bid was left waiting")
+    for i in order:
+        kind, _ = broker.replies[i].get_nowait()
+        if kind != "grant":
+            failures.append(f"intersection {i} got {kind!r} instead of its grant")
+    return failures
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    src = ap.add_mutually_exclusive_group(required=True)
+    src.add_argument("--synthetic", "--intersections", type=int, metavar="N",
+                     help="N intersections on synthetic video")
+    src.add_argument("--config", help="JSON list of intersections")
+    ap.add_argument("--mock", action="store_true",
+                    help="stand-in analyzer (and stub TTS) instead of Gemini / ElevenLabs")
+    ap.add_argument("--latency", type=float, default=1.5, help="stand-in analyzer latency (s)")
+    ap.add_argument("--jitter", type=float, default=0.3)
+    ap.add_argument("--emergency-rate", type=float, default=0.05,
+                    help="share of stand-in analyses that report an emergency vehicle")
+    ap.add_argument("--local-detector", action="store_true")
+    ap.add_argument("--per-minute", type=int, default=PER_MINUTE)
+    ap.add_argument("--per-day", type=int, default=PER_DAY)
+    ap.add_argument("--reserve", type=int, default=RESERVE)
+    ap.add_argument("--always-open", action="store_true", help="ignore the operating hours")
+    ap.add_argument("--tts-slots", type=int, default=TTS_SLOTS)
+    ap.add_argument("--duration", type=float, help="stop after this many seconds")
+    ap.add_argument("--report-every", type=float, default=10.0)
+    ap.add_argument("--check", action="store_true",
+                    help="verify snapshots, quota limits and emergency-first grants after --duration (default 60 s)")
+    args = ap.parse_args(argv)
+    if args.check and args.duration is None:
+        args.duration = 60.0
+
+    if args.config:
+        with open(args.config) as f:
+            specs = json.load(f)
+    else:
+        specs = [{"synthetic": True} for _ in range(args.synthetic)]
+    for i, spec in enumerate(specs):
+        spec.setdefault("name", f"intersection-{i}")
+    if args.mock:
+        os.environ["TTS_BACKEND"] = "stub"          # inherited by the workers
+
+    hours = {"open_hour": 0, "close_hour": 24} if args.always_open else {}
+    scheduler = QuotaScheduler(per_minute=args.per_minute, per_day=args.per_day,
+                               reserve=args.reserve, **hours)
+    ctx      = mp.get_context("spawn")
+    requests = ctx.Queue()
+    replies  = [ctx.Queue() for _ in specs]
+    broker   = Broker(scheduler, requests, replies, args.tts_slots)
+    opts = {"mock": args.mock, "latency": args.latency, "jitter": args.jitter,
+            "emergency_rate": args.emergency_rate, "local_detector": args.local_detector,
+            "limits": dict(per_minute=args.per_minute, per_day=args.per_day,
+                           reserve=args.reserve, **hours)}
+
+    stop = threading.Event()
+    threading.Thread(target=broker.run, args=(stop,), daemon=True).start()
+    procs = [ctx.Process(target=run_intersection, args=(i, spec, requests, replies[i], opts),
+                         name=spec["name"], daemon=True)
+             for i, spec in enumerate(specs)]
+    for p in procs:
+        p.start()
+    print(f"{len(procs)} intersections running")
+
+    readers, started, failures = [None] * len(specs), time.time(), None
+    try:
+        while args.duration is None or time.time() - started < args.duration:
+            time.sleep(min(args.report_every, args.duration or args.report_every))
+            _report(specs, readers, broker, started)
+        if args.check:
+            failures = check(specs, readers, broker)      # before the workers unlink their snapshots
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for p in procs:
+            p.terminate()
+        for p in procs:
+            p.join(5)
+        stop.set()
+    if failures:
+        print("check FAILED:\n  " + "\n  ".join(failures))
+        return 1
+    if failures is not None:
+        print("check passed")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
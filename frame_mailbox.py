@@ -0,0 +1,61 @@
+"""Latest-frame handoff from the video thread to the analysis worker.
+
+The media thread posts every frame; the worker takes whichever frame is
+newest when it gets round to it. Older frames are simply overwritten, so
+the worker never analyzes a stale frame and the callback never waits for it.
+
+Three preallocated buffers rotate between the two sides (triple buffering):
+the writer copies into its own back buffer and swaps it with the ready one,
+the reader swaps the ready buffer with its front one. The swaps are
+reference swaps under a lock held for a few instructions; the only per-frame
+work on the media thread is one copy into memory that is already there. The
+copy is needed because the callback draws the overlay on its frame in place.
+"""
+import threading
+import time
+import numpy as np
+import metrics
+
+
+class FrameMailbox:
+    def __init__(self):
+        self._lock      = threading.Lock()
+        self._slots     = None      # [back (writer), ready, front (reader)]
+        self._fresh     = False     # ready holds a frame nobody has taken yet
+        self._posted_at = 0.0
+        self.posted     = 0
+        self.taken      = 0
+        self.dropped    = 0         # frames overwritten before the worker took them
+
+    def post(self, img):
+        """Publish a frame. Constant cost: one copy, no allocation."""
+        slots = self._slots
+        if slots is None or slots[0].shape != img.shape or slots[0].dtype != img.dtype:
+            slots = [np.empty_like(img) for _ in range(3)]     # first frame / new resolution
+            with self._lock:
+                self._slots, self._fresh = slots, False
+        np.copyto(slots[0], img)        # the back buffer belongs to the writer alone
+        with self._lock:
+            slots[0], slots[1] = slots[1], slots[0]
+            if self._fresh:
+                self.dropped += 1
+            self._fresh     = True
+            self._posted_at = time.time()
+            self.posted    += 1
+
+    def take(self):
+        """Newest frame not taken yet, or None. The array stays valid (and
+        unchanged) until the next take()."""
+        with self._lock:
+            if not self._fresh:
+                return None
+            slots = self._slots
+            slots[1], slots[2] = slots[2], slots[1]
+            self._fresh = False
+            self.taken += 1
+            age = time.time() - self._posted_at
+        metrics.observe("frame_age", age)
+        return slots[2]
+
+    def stats(self):
+        return {"posted": self.posted, "taken": self.taken, "dropped": self.dropped}
@@ -1,22 +1,42 @@
 import os, json
-from google import genai
-from google.genai.types import GenerateContentConfig, Part
+import threading
 from dotenv import load_dotenv
+from analysis_model import Analysis
+import metrics
 
 load_dotenv()
-_key = os.getenv("GEMINI_API_KEY")
-print(f"DEBUG: Using API Key ending in ...{_key[-4:] if _key else 'NOT SET - add GEMINI_API_KEY to .env'}")
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY"))
+# Point at standin_server.py (or a proxy) instead of the real API
+BASE_URL = os.getenv("GEMINI_BASE_URL")
+MODEL    = "gemini-2.5-flash"
 
-SYSTEM_PROMPT = """You are a smart city traffic analysis AI. Analyze the image carefully and return JSON:
+_client      = None
+_client_lock = threading.Lock()
+
+def client():
+    """The genai client, created on the first call — mock and replay runs
+    import this module without an API key (or the SDK) ever being needed."""
+    global _client
+    with _client_lock:
+        if _client is None:
+            from google import genai
+            from google.genai.types import HttpOptions
+            key = os.getenv("GEMINI_API_KEY")
+            print(f"DEBUG: Using API Key ending in ...{key[-4:] if key else 'NOT SET - add GEMINI_API_KEY to .env'}"
+                  + (f" against {BASE_URL}" if BASE_URL else ""))
+            _client = genai.Client(api_key=key or ("stand-in" if BASE_URL else None),
+                                   http_options=HttpOptions(base_url=BASE_URL) if BASE_URL else None)
+        return _client
+
+SYSTEM_PROMPT = """You are a smart city traffic analysis AI. Analyze the image carefully and return JSON
+with the fields in exactly this order:
 {
-  "vehicles": [{"type": "car|truck|bus", "box_2d": [y_min, x_min, y_max, x_max]}],
+  "emergency_priority": true|false,
   "emergency_vehicles": [{"type": "ambulance|police", "box_2d": [y_min, x_min, y_max, x_max]}],
   "pedestrians": [{"box_2d": [y_min, x_min, y_max, x_max], "crossing": true}],
-  "hands": [{"box_2d": [y_min, x_min, y_max, x_max]}],
   "traffic_density": "low|medium|high",
-  "recommended_action": "description",
-  "emergency_priority": true|false
+  "vehicles": [{"type": "car|truck|bus", "box_2d": [y_min, x_min, y_max, x_max]}],
+  "hands": [{"box_2d": [y_min, x_min, y_max, x_max]}],
+  "recommended_action": "description"
 }
 Rules:
 - All box_2d coordinates must be normalized to the range 0-1000.
@@ -24,16 +44,98 @@ Rules:
 - Only include objects you are highly confident are present. Do not guess.
 - For hands: detect any clearly visible human hand or wrist in the frame."""
 
-def analyze_frame(frame_bytes: bytes) -> dict:
+# A str.format template — SYSTEM_PROMPT's JSON braces stay out of it
+_MOSAIC_SUFFIX = """
+The image is a mosaic of {n} traffic cameras tiled in a grid of {rows} rows x {cols} columns,
+numbered 0 to {last} left-to-right, top-to-bottom, separated by black borders.
+- Coordinates are still normalized 0-1000 over the WHOLE mosaic.
+- Add "camera": <tile number> to every detected object.
+- Add "cameras": [{{"camera": 0, "traffic_density": "low|medium|high", "emergency_priority": true|false}}, ...]
+  with one entry per tile; the top-level traffic_density/emergency_priority describe the busiest tile."""
+
+def mosaic_prompt(n: int, rows: int, cols: int) -> str:
+    return SYSTEM_PROMPT + _MOSAIC_SUFFIX.format(n=n, rows=rows, cols=cols, last=n - 1)
+
+def _request(frame_bytes, prompt):
+    from google.genai.types import GenerateContentConfig, Part
     image_part = Part.from_bytes(data=frame_bytes, mime_type="image/jpeg")
     config = GenerateContentConfig(
-        system_instruction=SYSTEM_PROMPT,
+        system_instruction=prompt,
         temperature=0.3,
         response_mime_type="application/json"
     )
-    response = client.models.generate_content(
-        model="gemini-2.5-flash",
-        contents=[image_part, "Analyze this image."],
-        config=config
-    )
+    return dict(model=MODEL, contents=[image_part, "Analyze this image."], config=config)
+
+def generate_json(frame_bytes: bytes, prompt: str = SYSTEM_PROMPT) -> dict:
+    """Raw JSON response for one image (mosaic.py splits it per camera)."""
+    response = client().models.generate_content(**_request(frame_bytes, prompt))
     return json.loads(response.text)
+
+@metrics.timed("analyze_frame")
+def analyze_frame(frame_bytes: bytes, prompt: str = SYSTEM_PROMPT) -> Analysis:
+    return Analysis.from_dict(generate_json(frame_bytes, prompt))
+
+# ── Streaming ────────────────────────────────────────────────────────────────
+class FieldParser:
+    """Incremental parser for a JSON object arriving in chunks.
+
+    feed() returns each top-level (key, value) pair as soon as its value is
+    complete, so the first fields of the response can be acted on while the
+    model is still generating the rest.
+    """
+    def __init__(self):
+        self.fields  = {}
+        self._buf    = ""
+        self._pos    = 0
+        self._depth  = 0
+        self._in_str = False
+        self._escape = False
+        self._start  = None     # where the current top-level field begins
+
+    def feed(self, chunk):
+        self._buf += chunk
+        buf, done = self._buf, []
+        for i in range(self._pos, len(buf)):
+            c = buf[i]
+            if self._in_str:
+                if self._escape:
+                    self._escape = False
+                elif c == "\\":
+                    self._escape = True
+                elif c == '"':
+                    self._in_str = False
+            elif c == '"':
+                self._in_str = True
+            elif c in "{[":
+                self._depth += 1
+                if self._depth == 1:
+                    self._start = i + 1
+            elif c in "}]":
+                if self._depth == 1:
+                    done += self._field(buf[self._start:i])
+                self._depth -= 1
+            elif c == "," and self._depth == 1:
+                done += self._field(buf[self._start:i])
+                self._start = i + 1
+        self._pos = len(buf)
+        return done
+
+    def _field(self, text):
+        if not text.strip():
+            return []
+        (key, value), = json.loads("{" + text + "}").items()
+        self.fields[key] = value
+        return [(key, value)]
+
+@metrics.timed("analyze_frame")
+def analyze_frame_stream(frame_bytes: bytes, prompt: str = SYSTEM_PROMPT, on_field=None) -> Analysis:
+    """analyze_frame over the streaming API: on_field(key, value) is called for
+    every top-level field as soon as it has been generated."""
+    parser, chunks = FieldParser(), []
+    for chunk in client().models.generate_content_stream(**_request(frame_bytes, prompt)):
+        text = chunk.text or ""
+        chunks.append(text)
+        for key, value in parser.feed(text):
+            if on_field:
+                on_field(key, value)
+    return Analysis.from_dict(json.loads("".join(chunks)))
@@ -0,0 +1,238 @@
+"""Sustained-pressure test of the quota scheduler and 429 backoff against the stand-in server.
+
+    python load_test.py --sessions 4 --duration 300 --rpm 10 --rpd 40
+    python load_test.py --sessions 8 --shared-key --day-seconds 120 --out load.json
+    python load_test.py --server http://127.0.0.1:8765 --sessions 2   # server already running
+
+Each session is its own process with its own `state`, QuotaScheduler and
+Gemini client pointed at the stand-in (GEMINI_BASE_URL / ELEVENLABS_BASE_URL),
+and calls the real pipeline.run_analysis as fast as the scheduler and the
+backoff let it — the frame path minus the scene gate. Optionally it also
+synthesizes a new phrase every few seconds through voice_alerts. Sessions
+get one API key each, or share one with --shared-key (one project's quota
+split between dashboards).
+
+Reported per session: calls and their outcomes, calls deferred by the
+scheduler, achieved calls/minute against the server limit, the backoff
+taken after each 429, calls made after daily exhaustion (should be none),
+latency percentiles and TTS outcomes; plus the server's own counts.
+
+Sessions import pipeline, so google-genai must be installed (and elevenlabs
+unless --tts-every 0); they talk to the stand-in through the SDKs themselves.
+"""
+import argparse
+import importlib.util
+import json
+import multiprocessing as mp
+import os
+import queue
+import random
+import tempfile
+import threading
+import time
+import urllib.request
+from scheduler import PER_MINUTE, PER_DAY, RESERVE
+from standin_server import Scenario, start
+
+TICK = 0.05                # session loop when nothing is allowed yet
+
+
+# ── Session (child process) ──────────────────────────────────────────────────
+def _outcome(before, after):
+    for counter, name in (("daily_quota_exhausted", "daily_exhausted"), ("rate_limited", "rate_limited"),
+                          ("gemini_errors", "error")):
+        if after.get(counter, 0) > before.get(counter, 0):
+            return name
+    return "ok"
+
+
+def _tts_loop(index, stop, out, every):
+    import voice_alerts
+    cache, n = voice_alerts.AudioCache(voice_alerts.ElevenLabsBackend()), 0
+    while not stop.wait(every):
+        n += 1
+        t0 = time.time()
+        try:
+            cache.get(f"Session {index} announcement {n}.")     # always a cache miss
+            result = "ok"
+        except Exception as e:
+            result = "rate_limited" if "429" in str(e) else "error"
+        out.append({"t": t0, "outcome": result, "latency": time.time() - t0})
+
+
+def run_session(index, opts, results):
+    key = opts["key"] or f"load-session-{index}"
+    os.environ.update(GEMINI_BASE_URL=opts["url"], GEMINI_API_KEY=key,
+                      ELEVENLABS_BASE_URL=opts["url"], ELEVENLABS_API_KEY=key,
+                      TTS_CACHE_DIR=os.path.join(opts["tmp"], f"tts-{index}"))
+    import cv2
+    import numpy as np
+    import metrics
+    import pipeline
+    import state
+    from encoder import FULL_FRAME, Payload
+    from scheduler import QuotaScheduler
+
+    state.scheduler = QuotaScheduler(per_minute=opts["per_minute"], per_day=opts["per_day"],
+                                     reserve=opts["reserve"], open_hour=0, close_hour=24)
+    state.use_streaming = opts["stream"]
+    pipeline._CALL_INTERVAL = opts["call_interval"]
+    _, jpeg = cv2.imencode(".jpg", np.zeros((270, 480, 3), np.uint8))
+    payload = Payload(jpeg.tobytes(), FULL_FRAME, 480, 270, 70, False)   # content is not looked at
+    rng = random.Random(index)
+
+    tts, stop = [], threading.Event()
+    if opts["tts_every"]:
+        threading.Thread(target=_tts_loop, args=(index, stop, tts, opts["tts_every"]), daemon=True).start()
+
+    calls, deferred = [], 0
+    start_t = time.time()
+    end = start_t + opts["duration"]
+    while time.time() < end:
+        now = time.time()
+        if now < state.next_allowed_call:
+            time.sleep(min(TICK, state.next_allowed_call - now))
+            continue
+        priority = rng.random() < opts["priority_share"]
+        if not state.scheduler.try_acquire(priority=priority):
+            deferred += 1
+            state.next_allowed_call = now + pipeline._GATE_RECHECK
+            continue
+        before = metrics.snapshot()["counters"]
+        pipeline.run_analysis(payload)
+        done = time.time()
+        calls.append({"t": now - start_t, "priority": priority, "latency": done - now,
+                      "outcome": _outcome(before, metrics.snapshot()["counters"]),
+                      "backoff": max(0.0, state.next_allowed_call - done)})
+    stop.set()
+    results.put({"index": index, "key": key, "duration": opts["duration"], "calls": calls,
+                 "deferred": deferred, "tts": list(tts), "forecast": state.scheduler.forecast()})
+
+
+# ── Report ───────────────────────────────────────────────────────────────────
+def _pct(xs, q):
+    xs = sorted(xs)
+    return xs[int(q * (len(xs) - 1))] if xs else None
+
+
+def summarize(session):
+    calls = session["calls"]
+    outcomes = {}
+    for c in calls:
+        outcomes[c["outcome"]] = outcomes.get(c["outcome"], 0) + 1
+    first_daily = next((c["t"] for c in calls if c["outcome"] == "daily_exhausted"), None)
+    backoffs = [c["backoff"] for c in calls if c["outcome"] == "rate_limited"]
+    ok = [c["latency"] for c in calls if c["outcome"] == "ok"]
+    tts = {}
+    for r in session["tts"]:
+        tts[r["outcome"]] = tts.get(r["outcome"], 0) + 1
+    return {
+        "session":         session["index"],
+        "calls":           len(calls),
+        "outcomes":        outcomes,
+        "deferred":        session["deferred"],
+        "calls_per_min":   len(calls) * 60 / session["duration"],
+        "ok_per_min":      outcomes.get("ok", 0) * 60 / session["duration"],
+        "backoff_mean_s":  sum(backoffs) / len(backoffs) if backoffs else None,
+        "after_daily_exhaustion": sum(1 for c in calls if first_daily is not None and c["t"] > first_daily),
+        "latency_p50_s":   _pct(ok, 0.5),
+        "latency_p95_s":   _pct(ok, 0.95),
+        "tts":             tts,
+    }
+
+
+def _fmt(v, spec=".1f"):
+    return "-" if v is None else format(v, spec)
+
+
+def report(summaries, server_stats):
+    print(f"{'#':>3}{'calls':>7}{'ok':>6}{'429/m':>7}{'429/d':>7}{'err':>5}{'defer':>7}"
+          f"{'ok/min':>8}{'backoff':>9}{'p50':>7}{'p95':>7}{'after-day':>10}  tts")
+    for s in summaries:
+        o = s["outcomes"]
+        print(f"{s['session']:>3}{s['calls']:>7}{o.get('ok', 0):>6}{o.get('rate_limited', 0):>7}"
+              f"{o.get('daily_exhausted', 0):>7}{o.get('error', 0):>5}{s['deferred']:>7}"
+              f"{s['ok_per_min']:>8.2f}{_fmt(s['backoff_mean_s']):>9}{_fmt(s['latency_p50_s'], '.2f'):>7}"
+              f"{_fmt(s['latency_p95_s'], '.2f'):>7}{s['after_daily_exhaustion']:>10}  {s['tts'] or '-'}")
+    if server_stats:
+        print("server:", ", ".join(f"{k} {v}" for k, v in sorted(server_stats["counts"].items())))
+
+
+def _installed(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ModuleNotFoundError:         # parent package missing
+        return False
+
+
+# ── Entry point ──────────────────────────────────────────────────────────────
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--sessions", type=int, default=4)
+    ap.add_argument("--duration", type=float, default=120.0, help="seconds")
+    ap.add_argument("--shared-key", action="store_true", help="all sessions use one API key")
+    ap.add_argument("--server", help="URL of a running standin_server.py (default: start one here)")
+    ap.add_argument("--per-minute", type=int, default=PER_MINUTE, help="client-side scheduler budget")
+    ap.add_argument("--per-day", type=int, default=PER_DAY)
+    ap.add_argument("--reserve", type=int, default=RESERVE)
+    ap.add_argument("--call-interval", type=float, default=1.0,
+                    help="pipeline spacing after a successful call (s)")
+    ap.add_argument("--priority-share", type=float, default=0.1,
+                    help="share of calls made as priority triggers")
+    ap.add_argument("--no-stream", action="store_true", help="whole responses instead of streaming")
+    ap.add_argument("--tts-every", type=float, default=5.0, help="seconds between TTS requests (0: none)")
+    ap.add_argument("--out", help="write summaries and raw timelines as JSON")
+    Scenario.add_arguments(ap)
+    args = ap.parse_args(argv)
+    needed  = {"google-genai": "google.genai"} | ({"elevenlabs": "elevenlabs"} if args.tts_every else {})
+    missing = [pkg for pkg, mod in needed.items() if not _installed(mod)]
+    if missing:
+        ap.error(f"sessions run the real pipeline — install {', '.join(missing)} first")
+
+    server = None
+    if args.server:
+        url = args.server.rstrip("/")
+    else:
+        server = start(Scenario.from_args(args), port=0)
+        url = server.url
+        print(f"stand-in on {url}: {args.rpm} rpm / {args.rpd} per day per key, latency {args.latency}")
+
+    tmp = tempfile.mkdtemp(prefix="load_test_")
+    opts = {"url": url, "key": "load-shared-key" if args.shared_key else None, "tmp": tmp,
+            "duration": args.duration, "per_minute": args.per_minute, "per_day": args.per_day,
+            "reserve": args.reserve, "call_interval": args.call_interval,
+            "priority_share": args.priority_share, "stream": not args.no_stream,
+            "tts_every": args.tts_every}
+    ctx = mp.get_context("spawn")
+    results = ctx.Queue()
+    procs = [ctx.Process(target=run_session, args=(i, opts, results), daemon=True)
+             for i in range(args.sessions)]
+    for p in procs:
+        p.start()
+    print(f"{args.sessions} session(s) for {args.duration:.0f}s "
+          f"({'one shared key' if args.shared_key else 'one key each'})")
+    sessions = []
+    for _ in procs:
+        try:
+            sessions.append(results.get(timeout=args.duration + 60))
+        except queue.Empty:
+            print("a session did not report back — see its output above")
+            break
+    sessions.sort(key=lambda s: s["index"])
+    for p in procs:
+        p.join(timeout=5)
+
+    with urllib.request.urlopen(f"{url}/standin/stats", timeout=5) as r:
+        server_stats = json.load(r)
+    summaries = [summarize(s) for s in sessions]
+    report(summaries, server_stats)
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"args": vars(args), "summaries": summaries, "server": server_stats,
+                       "sessions": sessions}, f, indent=2)
+    if server:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+"""CPU-only detectors that run at frame rate between Gemini calls.
+
+Every analyzer returns the same Analysis as gemini_analyzer.analyze_frame
+(boxes normalized to 0-1000, [y_min, x_min, y_max, x_max]) so the rest of
+the app does not care where an analysis came from.
+"""
+import cv2
+import numpy as np
+from analysis_model import Analysis, Detection, density_from_count
+
+_PROC_WIDTH   = 320        # frames are downscaled to this width before detection
+DENSITY_STALE = 60.0       # s — past this, local counts decide traffic_density
+
+
+def _to_box_2d(x, y, w, h, img_w, img_h):
+    return (int(y * 1000 / img_h), int(x * 1000 / img_w),
+            int((y + h) * 1000 / img_h), int((x + w) * 1000 / img_w))
+
+
+def _iou(a, b):
+    y1, x1 = max(a[0], b[0]), max(a[1], b[1])
+    y2, x2 = min(a[2], b[2]), min(a[3], b[3])
+    inter = max(0, y2 - y1) * max(0, x2 - x1)
+    if inter == 0:
+        return 0.0
+    area_a = (a[2] - a[0]) * (a[3] - a[1])
+    area_b = (b[2] - b[0]) * (b[3] - b[1])
+    return inter / float(area_a + area_b - inter)
+
+
+def _combine(items, others, min_iou, confirm):
+    """`items` plus the `others` none of them overlaps; an overlapping pair is
+    kept once, as confirm(item, other)."""
+    others = [o for o in others if o.box]
+    matched, out = set(), []
+    for item in items:
+        scores = [_iou(item.box, o.box) for o in others]
+        best = max(range(len(scores)), key=scores.__getitem__, default=None)
+        if best is not None and scores[best] >= min_iou:
+            matched.add(best)
+            item = confirm(item, others[best])
+        out.append(item)
+    out.extend(o for i, o in enumerate(others) if i not in matched)
+    return out
+
+
+def _downscale(img):
+    h, w = img.shape[:2]
+    if w <= _PROC_WIDTH:
+        return img
+    return cv2.resize(img, (_PROC_WIDTH, int(h * _PROC_WIDTH / w)),
+                      interpolation=cv2.INTER_AREA)
+
+
+class FrameAnalyzer:
+    """Interface for anything that turns a BGR frame into an Analysis."""
+    name = "base"
+
+    def analyze(self, img) -> Analysis:
+        raise NotImplementedError
+
+
+class MotionBlobDetector(FrameAnalyzer):
+    """MOG2 background subtraction + contour blobs.
+
+    Tall, narrow blobs are reported as pedestrians, everything else as cars.
+    """
+    name = "motion"
+
+    def __init__(self, min_area=0.002, history=300, var_threshold=25):
+        self.min_area = min_area           # fraction of the frame area
+        self._bg = cv2.createBackgroundSubtractorMOG2(
+            history=history, varThreshold=var_threshold, detectShadows=True)
+        self._kernel = cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (5, 5))
+
+    def analyze(self, img) -> Analysis:
+        small = _downscale(img)
+        h, w = small.shape[:2]
+        mask = self._bg.apply(small)
+        # MOG2 marks shadows as 127 — keep only confident foreground
+        _, mask = cv2.threshold(mask, 200, 255, cv2.THRESH_BINARY)
+        mask = cv2.morphologyEx(mask, cv2.MORPH_OPEN, self._kernel)
+        mask = cv2.dilate(mask, self._kernel, iterations=2)
+        contours, _ = cv2.findContours(mask, cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+        vehicles, pedestrians = [], []
+        min_px = self.min_area * w * h
+        for c in contours:
+            if cv2.contourArea(c) < min_px:
+                continue
+            x, y, bw, bh = cv2.boundingRect(c)
+            box = _to_box_2d(x, y, bw, bh, w, h)
+            if bh > 1.6 * bw:
+                pedestrians.append(Detection("pedestrians", box, source=self.name))
+            else:
+                vehicles.append(Detection("vehicles", box, type="car", source=self.name))
+        return Analysis(vehicles=vehicles, pedestrians=pedestrians,
+                        traffic_density=density_from_count(len(vehicles)),
+                        recommended_action="Local detector estimate")
+
+
+class HOGPedestrianDetector(FrameAnalyzer):
+    """OpenCV's default HOG+SVM people detector."""
+    name = "hog"
+
+    def __init__(self, min_weight=0.5):
+        self.min_weight = min_weight
+        self._hog = cv2.HOGDescriptor()
+        self._hog.setSVMDetector(cv2.HOGDescriptor_getDefaultPeopleDetector())
+
+    def analyze(self, img) -> Analysis:
+        small = _downscale(img)
+        h, w = small.shape[:2]
+        rects, weights = self._hog.detectMultiScale(small, winStride=(8, 8),
+                                                    padding=(8, 8), scale=1.05)
+        pedestrians = [
+            Detection("pedestrians", _to_box_2d(x, y, bw, bh, w, h), source=self.name)
+            for (x, y, bw, bh), wt in zip(rects, np.ravel(weights))
+            if wt >= self.min_weight
+        ]
+        return Analysis(pedestrians=pedestrians, traffic_density="low")
+
+
+class LocalDetector(FrameAnalyzer):
+    """Motion blobs every frame; HOG people detection every `hog_every` frames
+    (it is ~10x slower) with the last result reused in between. Both sets of
+    pedestrians are kept: HOG finds people standing still, motion finds the
+    moving or partly hidden ones HOG misses."""
+    name = "local"
+
+    def __init__(self, use_hog=True, hog_every=5):
+        self.motion    = MotionBlobDetector()
+        self.hog       = HOGPedestrianDetector() if use_hog else None
+        self.hog_every = hog_every
+        self._frame    = 0
+        self._hog_peds = []
+
+    def analyze(self, img) -> Analysis:
+        result = self.motion.analyze(img)
+        if self.hog is not None:
+            if self._frame % self.hog_every == 0:
+                self._hog_peds = self.hog.analyze(img).pedestrians
+            self._frame += 1
+            pedestrians = _combine(result.pedestrians, self._hog_peds, 0.2, lambda p, h: h)
+            result = result.replace(pedestrians=pedestrians)
+        return result
+
+
+def merge(local: Analysis, remote: Analysis, remote_age=None) -> Analysis:
+    """Combine a frame-rate local analysis with the last Gemini analysis.
+
+    Moving objects come from the local detector (their boxes are current);
+    Gemini confirms or classifies them where boxes overlap, and its unmatched
+    boxes are kept because background subtraction loses stopped vehicles and
+    waiting pedestrians. Emergency vehicles and hands come only from Gemini.
+    traffic_density stays Gemini's unless its analysis is older than
+    DENSITY_STALE seconds (`remote_age`), when the local count is fresher.
+    """
+    if not local:
+        return remote
+    if not remote:
+        return local
+
+    vehicles = _combine(local.vehicles, remote.vehicles, 0.3,
+                        lambda v, r: v.replace(type=r.type or v.type))
+    pedestrians = _combine(local.pedestrians, remote.pedestrians, 0.2,
+                           lambda p, r: p.replace(crossing=r.crossing))
+    density = remote.traffic_density
+    if not density or (remote_age is not None and remote_age > DENSITY_STALE):
+        density = density_from_count(len(vehicles))
+    return remote.replace(vehicles=vehicles, pedestrians=pedestrians, traffic_density=density)
@@ -0,0 +1,148 @@
+"""Top-down intersection map, rendered with OpenCV.
+
+The road, crosswalk and housings never change, so they are drawn once into a
+base raster. Each map is that raster plus a handful of dynamic elements
+(light, walk sign, sensor badge, vehicle/pedestrian labels), and the encoded
+PNG is memoized on exactly those inputs — an unchanged rerun costs a dict
+lookup, a changed one a few milliseconds.
+"""
+from functools import lru_cache
+import cv2
+import numpy as np
+
+_S      = 32                     # pixels per map unit (map is 10 x 15 units)
+_TITLE  = 24                     # title band above the map, in pixels
+_W, _H  = 10 * _S, 15 * _S + _TITLE
+_FONT   = cv2.FONT_HERSHEY_SIMPLEX
+_BOLD   = cv2.FONT_HERSHEY_DUPLEX
+
+_LABELS      = {'car': 'CAR', 'truck': 'TRK', 'bus': 'BUS', 'ambulance': 'AMB', 'police': 'POL'}
+_LANE1_SLOTS = [(3.75, 11.5), (3.75, 9.5)]     # lane 1 (left, going up)
+_LANE2_SLOTS = [(6.25, 3.5), (6.25, 1.5)]      # lane 2 (right, going down)
+_PED_SLOTS   = [(3.0, 7.3), (4.2, 6.8), (5.5, 7.4), (6.8, 7.0)]
+_LIGHTS      = {'green': ('#00dd55', 'G'), 'yellow': ('#f5c542', 'Y'), 'red': ('#dd2200', 'R')}
+
+
+def _bgr(hex_color):
+    h = hex_color.lstrip('#')
+    return int(h[4:6], 16), int(h[2:4], 16), int(h[0:2], 16)
+
+
+def _blend(fg, bg, alpha):
+    return tuple(int(f * alpha + b * (1 - alpha)) for f, b in zip(_bgr(fg), _bgr(bg)))
+
+
+def _pt(x, y):
+    """Map units (origin bottom-left) → pixel (origin top-left)."""
+    return int(round(x * _S)), int(round(_TITLE + (15 - y) * _S))
+
+
+def _rounded_box(img, x, y, w, h, fill, edge, thickness=1, pad=0.1):
+    """Filled rounded rectangle spanning (x, y)-(x+w, y+h) in map units."""
+    (x1, y2), (x2, y1) = _pt(x - pad, y - pad), _pt(x + w + pad, y + h + pad)
+    r = int(pad * _S * 1.5) + 2
+    for color, grow in ((edge, thickness), (fill, 0)):
+        cv2.rectangle(img, (x1 + r - grow, y1 - grow), (x2 - r + grow, y2 + grow), color, -1)
+        cv2.rectangle(img, (x1 - grow, y1 + r - grow), (x2 + grow, y2 - r + grow), color, -1)
+        for cx, cy in ((x1 + r, y1 + r), (x2 - r, y1 + r), (x1 + r, y2 - r), (x2 - r, y2 - r)):
+            cv2.circle(img, (cx, cy), r + grow, color, -1, cv2.LINE_AA)
+
+
+def _text(img, s, x, y, color, scale=0.4, font=_FONT, thickness=1):
+    """Text centred on (x, y) map units."""
+    (tw, th), _ = cv2.getTextSize(s, font, scale, thickness)
+    px, py = _pt(x, y)
+    cv2.putText(img, s, (px - tw // 2, py + th // 2), font, scale, color, thickness, cv2.LINE_AA)
+
+
+def _tag(img, s, x, y, color, scale):
+    """Label in a dark box with a coloured outline (vehicles / pedestrians)."""
+    (tw, th), _ = cv2.getTextSize(s, _BOLD, scale, 1)
+    px, py = _pt(x, y)
+    p1, p2 = (px - tw // 2 - 4, py - th // 2 - 4), (px + tw // 2 + 4, py + th // 2 + 4)
+    cv2.rectangle(img, p1, p2, _bgr('#222222'), -1)
+    cv2.rectangle(img, p1, p2, color, 1, cv2.LINE_AA)
+    cv2.putText(img, s, (px - tw // 2, py + th // 2), _BOLD, scale, color, 1, cv2.LINE_AA)
+
+
+@lru_cache(maxsize=1)
+def _base_layer():
+    img = np.empty((_H, _W, 3), dtype=np.uint8)
+    img[:] = _bgr('#0e1117')
+
+    # ── Road ──
+    cv2.rectangle(img, _pt(2.5, 15), _pt(7.5, 0), _bgr('#3a3a3a'), -1)
+    cv2.rectangle(img, _pt(2.5, 15), _pt(7.5, 0), _bgr('#555555'), 1)
+    # Lane divider (dashed yellow centre line)
+    for y in range(0, 15, 2):
+        cv2.line(img, _pt(5, y), _pt(5, y + 1), _blend('#f5c542', '#3a3a3a', 0.8), 2, cv2.LINE_AA)
+    # Road edge lines (white)
+    for x in (2.5, 7.5):
+        cv2.line(img, _pt(x, 0), _pt(x, 15), _blend('#ffffff', '#3a3a3a', 0.5), 2, cv2.LINE_AA)
+
+    # ── Direction arrows ──
+    cv2.arrowedLine(img, _pt(3.75, 10.5), _pt(3.75, 12.5), _bgr('#888888'), 2, cv2.LINE_AA, tipLength=0.2)
+    cv2.arrowedLine(img, _pt(6.25, 4.5), _pt(6.25, 2.5), _bgr('#888888'), 2, cv2.LINE_AA, tipLength=0.2)
+
+    # ── Crosswalk (5 white stripes) ──
+    stripe = _blend('#ffffff', '#3a3a3a', 0.9)
+    for i in range(5):
+        y = 6.5 + i * 0.45
+        cv2.rectangle(img, _pt(2.5, y + 0.3), _pt(7.5, y), stripe, -1)
+
+    # ── Traffic light housing & sensor badge ──
+    _rounded_box(img, 8.0, 13.0, 1.5, 1.8, _bgr('#111111'), _bgr('#444444'))
+    _rounded_box(img, 0.1, 5.3, 1.8, 0.7, _bgr('#0d2540'), _bgr('#3a7bd5'), thickness=2)
+
+    title = 'Intersection - Top Down'
+    (tw, _), _ = cv2.getTextSize(title, _FONT, 0.4, 1)
+    cv2.putText(img, title, ((_W - tw) // 2, 16), _FONT, 0.4, _bgr('#8b9ab8'), 1, cv2.LINE_AA)
+    img.setflags(write=False)
+    return img
+
+
+@lru_cache(maxsize=64)
+def _render_png(light, walk_on, pir_active, vehicle_types, n_peds):
+    img = _base_layer().copy()
+
+    # ── Traffic light ──
+    color, letter = _LIGHTS.get(light, _LIGHTS['red'])
+    cv2.circle(img, _pt(8.75, 14.1), int(0.55 * _S), _bgr(color), -1, cv2.LINE_AA)
+    _text(img, letter, 8.75, 14.1, (255, 255, 255), 0.5, _BOLD)
+
+    # ── Walk sign ──
+    sign_color = _bgr('#00dd55') if walk_on else _bgr('#dd2200')
+    _rounded_box(img, 0.1, 6.3, 1.8, 1.5, _bgr('#111111'), sign_color, thickness=2, pad=0.15)
+    if walk_on:
+        _text(img, 'WALK', 1.0, 7.05, sign_color, 0.4, _BOLD)
+    else:
+        _text(img, "DON'T", 1.0, 7.3, sign_color, 0.35, _BOLD)
+        _text(img, 'WALK', 1.0, 6.8, sign_color, 0.35, _BOLD)
+
+    # ── Sensor label ──
+    _text(img, '[!] MOTION' if pir_active else 'SENSOR', 1.0, 5.65,
+          _bgr('#ff6633') if pir_active else _bgr('#3a7bd5'), 0.3)
+
+    # ── Vehicles on road ──
+    for (x, y), vtype in zip(_LANE1_SLOTS + _LANE2_SLOTS, vehicle_types):
+        color = _bgr('#ff4444') if vtype in ('ambulance', 'police') else _bgr('#00ccff')
+        _tag(img, _LABELS.get(vtype, 'CAR'), x, y, color, 0.4)
+
+    # ── Pedestrians on crosswalk ──
+    for px, py in _PED_SLOTS[:n_peds]:
+        _tag(img, 'PED', px, py, _bgr('#ffaa00'), 0.35)
+
+    ok, buf = cv2.imencode('.png', img)
+    return buf.tobytes()
+
+
+def render_map(analysis, signal, pir_active=False) -> bytes:
+    """PNG bytes of the intersection map for this analysis / signal / PIR state."""
+    slots = len(_LANE1_SLOTS) + len(_LANE2_SLOTS)
+    vehicles = analysis.vehicles + analysis.emergency_vehicles
+    vehicle_types = tuple(v.type or 'car' for v in vehicles[:slots])
+    return _render_png(signal.get('light_state', 'green'),
+                       bool(signal.get('walk_sign', False)),
+                       bool(pir_active),
+                       vehicle_types,
+                       min(len(analysis.pedestrians), len(_PED_SLOTS)))
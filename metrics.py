@@ -0,0 +1,169 @@
+"""Low-overhead in-process metrics.
+
+    with metrics.span("map_render"):      # time a block
+        ...
+    metrics.inc("gemini_errors")          # count an event
+
+Every span name gets a histogram: cumulative buckets for the Prometheus text
+exposition (render_text / start_exporter) plus a ring of recent samples for
+the rolling percentiles shown in the dashboard sidebar. Sizes go through
+observe(name, n, unit="bytes") and get their own buckets.
+"""
+import threading
+import time
+from bisect import bisect_left
+from collections import deque
+from functools import wraps
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PREFIX  = "traffic"
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1,
+           0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+SIZE_BUCKETS = (4096, 8192, 16384, 32768, 65536, 131072, 262144, 524288, 1048576)
+_UNITS  = {"seconds": BUCKETS, "bytes": SIZE_BUCKETS}
+WINDOW  = 512                  # recent samples kept per histogram
+
+
+class Histogram:
+    __slots__ = ("unit", "bounds", "buckets", "sum", "count", "recent", "lock")
+
+    def __init__(self, unit="seconds"):
+        self.unit    = unit
+        self.bounds  = _UNITS[unit]
+        self.buckets = [0] * (len(self.bounds) + 1)  # last one is +Inf
+        self.sum     = 0.0
+        self.count   = 0
+        self.recent  = deque(maxlen=WINDOW)
+        self.lock    = threading.Lock()
+
+    def observe(self, value):
+        i = bisect_left(self.bounds, value)
+        with self.lock:
+            self.buckets[i] += 1
+            self.sum   += value
+            self.count += 1
+            self.recent.append(value)
+
+    def rolling(self):
+        with self.lock:
+            xs = sorted(self.recent)
+        if not xs:
+            return None
+        pct = lambda p: xs[min(len(xs) - 1, int(p * len(xs)))]
+        return {"n": len(xs), "p50": pct(0.50), "p95": pct(0.95), "max": xs[-1]}
+
+
+class _Span:
+    __slots__ = ("hist", "t0")
+
+    def __init__(self, hist):
+        self.hist = hist
+
+    def __enter__(self):
+        self.t0 = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.hist.observe(time.perf_counter() - self.t0)
+
+
+class Registry:
+    def __init__(self):
+        self.histograms = {}
+        self.counters   = {}
+        self._lock      = threading.Lock()
+
+    def histogram(self, name, unit="seconds"):
+        hist = self.histograms.get(name)
+        if hist is None:
+            with self._lock:
+                hist = self.histograms.setdefault(name, Histogram(unit))
+        return hist
+
+    def span(self, name):
+        return _Span(self.histogram(name))
+
+    def observe(self, name, value, unit="seconds"):
+        self.histogram(name, unit).observe(value)
+
+    def inc(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def timed(self, name):
+        """Decorator form of span()."""
+        def deco(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                with self.span(name):
+                    return fn(*args, **kwargs)
+            return wrapper
+        return deco
+
+    def snapshot(self):
+        """Rolling stats per span / size histogram and current counter values."""
+        hists = sorted(self.histograms.items())
+        spans = {name: h.rolling() for name, h in hists if h.unit == "seconds"}
+        sizes = {name: h.rolling() for name, h in hists if h.unit == "bytes"}
+        with self._lock:
+            counters = dict(sorted(self.counters.items()))
+        return {"spans": {k: v for k, v in spans.items() if v},
+                "sizes": {k: v for k, v in sizes.items() if v}, "counters": counters}
+
+    def render_text(self):
+        """Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        with self._lock:
+            counters = sorted(self.counters.items())
+        for name, value in counters:
+            metric = f"{PREFIX}_{name}_total"
+            lines += [f"# TYPE {metric} counter", f"{metric} {value}"]
+        for name, h in sorted(self.histograms.items()):
+            metric = f"{PREFIX}_{name}_{h.unit}"
+            with h.lock:
+                buckets, total, count = list(h.buckets), h.sum, h.count
+            lines.append(f"# TYPE {metric} histogram")
+            cumulative = 0
+            for bound, n in zip(h.bounds + (float("inf"),), buckets):
+                cumulative += n
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f'{metric}_bucket{{le="{le}"}} {cumulative}')
+            lines += [f"{metric}_sum {total}", f"{metric}_count {count}"]
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+span     = REGISTRY.span
+observe  = REGISTRY.observe
+inc      = REGISTRY.inc
+timed    = REGISTRY.timed
+snapshot = REGISTRY.snapshot
+
+
+# ── HTTP exporter ────────────────────────────────────────────────────────────
+class _Handler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = REGISTRY.render_text().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "text/plain; version=0.0.4; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+_server = None
+_server_lock = threading.Lock()
+
+def start_exporter(port=9108, host="127.0.0.1"):
+    """Serve /metrics on a background thread (once per process)."""
+    global _server
+    with _server_lock:
+        if _server is None:
+            _server = ThreadingHTTPServer((host, port), _Handler)
+            threading.Thread(target=_server.serve_forever, daemon=True).start()
+        return _server.server_address
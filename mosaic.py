@@ -0,0 +1,214 @@
+"""Batch several camera frames into one Gemini request.
+
+The frames are tiled into a single mosaic JPEG (the free tier quota is per
+request, not per image), analyzed with gemini_analyzer.mosaic_prompt, and
+the result is split back into one analysis per camera with every box
+renormalized to its own source frame.
+
+    python mosaic.py --check     # prompt + split of a canned 2x2 response, no API call
+"""
+import argparse
+import math
+import sys
+import cv2
+import numpy as np
+from analysis_model import Analysis, AnalysisError, Detection
+from gemini_analyzer import analyze_frame, generate_json, mosaic_prompt
+
+TILE_SIZE  = (640, 360)    # (w, h) each camera is scaled to inside the mosaic
+BORDER     = 8             # black gutter between tiles, in pixels
+_BOX_KINDS = ("vehicles", "emergency_vehicles", "pedestrians", "hands")
+
+
+def grid_shape(n):
+    cols = math.ceil(math.sqrt(n))
+    return math.ceil(n / cols), cols
+
+
+def build_mosaic(images, tile_size=TILE_SIZE, border=BORDER):
+    """Tile BGR `images` into one frame.
+
+    Returns (mosaic, layout) where layout[i] is camera i's tile as
+    (y_min, x_min, y_max, x_max) normalized 0-1000 over the mosaic.
+    """
+    rows, cols = grid_shape(len(images))
+    tw, th = tile_size
+    mh = rows * th + (rows - 1) * border
+    mw = cols * tw + (cols - 1) * border
+    mosaic = np.zeros((mh, mw, 3), dtype=np.uint8)
+    layout = []
+    for i, img in enumerate(images):
+        r, c = divmod(i, cols)
+        y0, x0 = r * (th + border), c * (tw + border)
+        mosaic[y0:y0 + th, x0:x0 + tw] = cv2.resize(img, (tw, th), interpolation=cv2.INTER_AREA)
+        layout.append((y0 * 1000 / mh, x0 * 1000 / mw,
+                       (y0 + th) * 1000 / mh, (x0 + tw) * 1000 / mw))
+    return mosaic, layout
+
+
+def remap_box(box, region):
+    """Map a 0-1000 box from a parent frame into `region`'s own 0-1000 space
+    (region is also 0-1000 in the parent). Returns None if nothing is left."""
+    ry0, rx0, ry1, rx1 = region
+    sy, sx = 1000.0 / (ry1 - ry0), 1000.0 / (rx1 - rx0)
+    y0 = min(max((box[0] - ry0) * sy, 0), 1000)
+    x0 = min(max((box[1] - rx0) * sx, 0), 1000)
+    y1 = min(max((box[2] - ry0) * sy, 0), 1000)
+    x1 = min(max((box[3] - rx0) * sx, 0), 1000)
+    if y1 <= y0 or x1 <= x0:
+        return None
+    return [int(y0), int(x0), int(y1), int(x1)]
+
+
+def expand_box(box, region):
+    """Inverse of remap_box: a 0-1000 box inside `region` back to the parent."""
+    ry0, rx0, ry1, rx1 = region
+    sy, sx = (ry1 - ry0) / 1000.0, (rx1 - rx0) / 1000.0
+    return [int(ry0 + box[0] * sy), int(rx0 + box[1] * sx),
+            int(ry0 + box[2] * sy), int(rx0 + box[3] * sx)]
+
+
+def _tile_of(obj, layout):
+    cam = obj.get("camera")
+    if isinstance(cam, int) and not isinstance(cam, bool) and 0 <= cam < len(layout):
+        return cam
+    if not obj.get("box_2d"):
+        return None
+    # Fall back to whichever tile contains the box centre
+    y0, x0, y1, x1 = obj["box_2d"]
+    cy, cx = (y0 + y1) / 2, (x0 + x1) / 2
+    for i, (ty0, tx0, ty1, tx1) in enumerate(layout):
+        if ty0 <= cy <= ty1 and tx0 <= cx <= tx1:
+            return i
+    return None
+
+
+def _summaries(analysis):
+    out = {}
+    for c in analysis.get("cameras") or []:
+        cam = c.get("camera") if isinstance(c, dict) else None
+        if isinstance(cam, str) and cam.isdigit():
+            cam = int(cam)
+        if isinstance(cam, int) and not isinstance(cam, bool):
+            out[cam] = c
+    return out
+
+
+def split_analysis(analysis, layout):
+    """Split a raw mosaic response into one Analysis per camera tile.
+
+    Every object is validated like a single-frame response (AnalysisError
+    for anything off-schema). A camera the model gave no summary for gets
+    no traffic_density — unknown, not "low".
+    """
+    if not isinstance(analysis, dict):
+        raise AnalysisError(f"analysis is not an object: {type(analysis).__name__}")
+    per_cam = [{kind: [] for kind in _BOX_KINDS} for _ in layout]
+    for kind in _BOX_KINDS:
+        items = analysis.get(kind) or []
+        if not isinstance(items, list):
+            raise AnalysisError(f"{kind} is not a list")
+        for obj in items:
+            if Detection.from_dict(kind, obj) is None:
+                continue                # degenerate box
+            i = _tile_of(obj, layout)
+            if i is None:
+                continue
+            item = {k: v for k, v in obj.items() if k != "camera"}
+            if obj.get("box_2d"):
+                item["box_2d"] = remap_box(obj["box_2d"], layout[i])
+                if item["box_2d"] is None:
+                    continue
+            per_cam[i][kind].append(item)
+
+    summaries = _summaries(analysis)
+    out = []
+    for i, cam in enumerate(per_cam):
+        summary = summaries.get(i)
+        cam["recommended_action"] = analysis.get("recommended_action")
+        if summary is None:
+            cam["emergency_priority"] = bool(cam["emergency_vehicles"])
+            out.append(Analysis.from_dict(cam).replace(traffic_density=""))
+            continue
+        cam["traffic_density"]    = summary.get("traffic_density")
+        cam["emergency_priority"] = summary.get("emergency_priority", bool(cam["emergency_vehicles"]))
+        out.append(Analysis.from_dict(cam))
+    return out
+
+
+def encode_cameras(images, quality=90):
+    """The request for `images` — (jpeg, prompt, layout) — built before any
+    quota is spent on it. layout is None for a single camera."""
+    if len(images) == 1:
+        _, buf = cv2.imencode('.jpg', cv2.resize(images[0], (960, 540)),
+                              [cv2.IMWRITE_JPEG_QUALITY, quality])
+        return buf.tobytes(), None, None
+    mosaic, layout = build_mosaic(images)
+    _, buf = cv2.imencode('.jpg', mosaic, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    rows, cols = grid_shape(len(images))
+    return buf.tobytes(), mosaic_prompt(len(images), rows, cols), layout
+
+
+def send(request):
+    """The Gemini call for an encode_cameras() request; per-camera Analysis list."""
+    jpeg, prompt, layout = request
+    if layout is None:
+        return [analyze_frame(jpeg)]
+    return split_analysis(generate_json(jpeg, prompt=prompt), layout)
+
+
+def analyze_cameras(images, quality=90):
+    """One Gemini call for all `images`; returns a list of per-camera Analysis."""
+    return send(encode_cameras(images, quality))
+
+
+# ── Self-check ───────────────────────────────────────────────────────────────
+def check():
+    """Builds the 4-camera prompt and splits a canned response for it.
+    Returns a list of failures (empty when everything holds)."""
+    failures = []
+    prompt = mosaic_prompt(4, 2, 2)
+    for part in ('"emergency_priority": true|false', "mosaic of 4 traffic cameras",
+                 "2 rows x 2 columns", "numbered 0 to 3", '"cameras": [{"camera": 0'):
+        if part not in prompt:
+            failures.append(f"prompt lacks {part!r}")
+
+    _, layout = build_mosaic([np.zeros((720, 1280, 3), np.uint8)] * 4)
+    top_right, bottom_left = expand_box([100, 100, 500, 500], layout[1]), expand_box([200, 200, 600, 600], layout[2])
+    response = {
+        "emergency_priority": True,
+        "emergency_vehicles": [{"type": "ambulance", "box_2d": bottom_left, "camera": 2}],
+        "pedestrians":        [{"box_2d": top_right, "crossing": True}],      # tile from the box centre
+        "traffic_density":    "high",
+        "vehicles":           [{"type": "car", "box_2d": top_right, "camera": 1},
+                               {"type": "bus", "box_2d": bottom_left, "camera": 2}],
+        "recommended_action": "Clear the way for the ambulance",
+        "cameras": [{"camera": 0, "traffic_density": "low", "emergency_priority": False},
+                    {"camera": "1", "traffic_density": "medium", "emergency_priority": False},
+                    {"camera": 2, "traffic_density": "high", "emergency_priority": True}],
+    }
+    cams = split_analysis(response, layout)
+    got = [(len(a.vehicles), len(a.pedestrians), len(a.emergency_vehicles),
+            a.traffic_density, a.emergency_priority) for a in cams]
+    want = [(0, 0, 0, "low", False), (1, 1, 0, "medium", False),
+            (1, 0, 1, "high", True), (0, 0, 0, "", False)]      # camera 3: no summary — unknown
+    if got != want:
+        failures.append(f"split {got} != {want}")
+    for cam, box in ((1, [100, 100, 500, 500]), (2, [200, 200, 600, 600])):
+        back = list(cams[cam].vehicles[0].box)
+        if max(abs(a - b) for a, b in zip(back, box)) > 2:
+            failures.append(f"camera {cam} box {back} != {box}")
+    return failures
+
+
+if __name__ == "__main__":
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--check", action="store_true", help="run the self-check and exit")
+    if not ap.parse_args().check:
+        ap.print_help()
+        sys.exit(0)
+    failures = check()
+    for f in failures:
+        print("FAIL", f)
+    print("mosaic check:", "failed" if failures else "ok")
+    sys.exit(1 if failures else 0)
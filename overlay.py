@@ -0,0 +1,91 @@
+"""Compact, precomputed overlay geometry for the video frame.
+
+An analysis is turned into arrays once (normalized boxes, style index,
+label); per frame the boxes are converted to pixel rectangles in one
+vectorized step and drawing is a single loop over ready-made integers.
+"""
+import cv2
+import numpy as np
+from analysis_model import EMPTY
+
+# (BGR colour, box thickness, text thickness) per style index
+STYLES = (
+    ((0, 255, 0), 2, 1),        # 0 vehicle
+    ((0, 0, 255), 3, 2),        # 1 emergency vehicle
+    ((0, 0, 255), 2, 1),        # 2 pedestrian crossing
+    ((255, 165, 0), 2, 1),      # 3 pedestrian waiting
+)
+_KINDS = ("vehicles", "emergency_vehicles", "pedestrians")
+
+
+def style_of(kind, obj):
+    if kind == "vehicles":
+        return 0
+    if kind == "emergency_vehicles":
+        return 1
+    return 2 if obj.crossing else 3
+
+
+def label_of(kind, obj, track_id=None):
+    if kind == "pedestrians":
+        name = "pedestrian"
+    else:
+        name = obj.type or ("vehicle" if kind == "vehicles" else "emergency")
+    return f"{name} #{track_id}" if track_id is not None else name
+
+
+def build(analysis):
+    """(boxes (N,4) float 0-1000, styles (N,) int, labels) for an Analysis,
+    drawn as is — no tracker (engine.py camera groups and replay)."""
+    boxes, styles, labels = [], [], []
+    for obj in analysis.detections(_KINDS):
+        if obj.box:
+            boxes.append(obj.box)
+            styles.append(style_of(obj.kind, obj))
+            labels.append(label_of(obj.kind, obj, obj.track_id))
+    return (np.array(boxes, dtype=float).reshape(-1, 4),
+            np.array(styles, dtype=np.int8), labels)
+
+
+def to_pixels(boxes, w, h):
+    """0-1000 [y_min, x_min, y_max, x_max] → int32 pixel [x1, y1, x2, y2]."""
+    return (boxes[:, [1, 0, 3, 2]] * (w / 1000.0, h / 1000.0, w / 1000.0, h / 1000.0)).astype(np.int32)
+
+
+def draw(img, rects, styles, labels):
+    for (x1, y1, x2, y2), s, label in zip(rects.tolist(), styles.tolist(), labels):
+        color, thick, text_thick = STYLES[s]
+        cv2.rectangle(img, (x1, y1), (x2, y2), color, thick)
+        cv2.putText(img, label, (x1, max(y1 - 5, 0)),
+                    cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, text_thick)
+
+
+def draw_analysis(img, analysis):
+    """Draw `analysis` on `img` in place, once (e.g. a replayed keyframe)."""
+    boxes, styles, labels = build(analysis)
+    h, w = img.shape[:2]
+    draw(img, to_pixels(boxes, w, h), styles, labels)
+    return img
+
+
+class OverlayCache:
+    """The video thread's view of the latest analysis, keyed on analysis_version.
+
+    Only the video thread touches it, so reading state.analysis_version
+    without the lock is enough to know whether a new Analysis has landed;
+    Analysis objects are immutable, so holding a reference is enough.
+    Per-object styles and labels are derived once per version by the tracker
+    that this analysis seeds; per frame only the pixel conversion remains.
+    """
+    def __init__(self):
+        self.version  = -1
+        self.analysis = EMPTY
+
+    def refresh(self, state):
+        """Pick up state.last_analysis if the version moved; True if it did."""
+        if state.analysis_version == self.version:
+            return False
+        with state.lock:
+            self.analysis = state.last_analysis
+            self.version  = state.analysis_version
+        return True
@@ -0,0 +1,247 @@
+"""Frame path shared by the dashboard and the tools around it.
+
+`video_frame_callback` runs on the WebRTC media thread for every frame: it
+posts the frame to state.mailbox, tracks and draws. When a look at the scene
+is due it submits `analyze_latest` to state.executor, which takes the newest
+frame from the mailbox and does the gate, encode and Gemini call off the
+media thread. Both only talk to the rest of the app through `state`, so they
+can be driven without Streamlit (see benchmark.py).
+"""
+import time
+import random
+import re as _re
+import av
+from analysis_model import Analysis, AnalysisError
+from gemini_analyzer import analyze_frame, analyze_frame_stream
+from scene_gate import signature
+import metrics
+import overlay
+import state
+
+# ── Constants ────────────────────────────────────────────────────────────────
+_CALL_INTERVAL = 12.0          # minimum spacing between calls
+_429_BACKOFF   = 120.0
+_GATE_RECHECK  = 1.0           # re-check an unchanged scene this often (free)
+_TRACKED_EVERY = 0.5           # publish tracked boxes to the dashboard this often
+
+# ── Stage timing hook ────────────────────────────────────────────────────────
+# Every stage is wrapped in span(name); benchmark.py swaps in its own recorder.
+span = metrics.span
+
+class _locked:
+    """`with state.lock`, with the time spent waiting reported as a stage."""
+    def __enter__(self):
+        with span("lock_wait"):
+            state.lock.acquire()
+
+    def __exit__(self, *exc):
+        state.lock.release()
+
+# ── Background analysis ──────────────────────────────────────────────────────
+def mock_analysis():
+    # Simulate a slight delay then return fake data
+    time.sleep(0.5)
+    return Analysis.from_dict({
+        "vehicles": [{"type": "car", "box_2d": [400, 400, 600, 600]}] if random.random() > 0.5 else [],
+        "emergency_vehicles": [],
+        "pedestrians": [{"box_2d": [700, 300, 800, 400], "crossing": True}] if random.random() > 0.5 else [],
+        "traffic_density": random.choice(["low", "medium", "high"]),
+        "recommended_action": "Mock mode active",
+        "emergency_priority": False
+    })
+
+class _PartialPublisher:
+    """Puts the fields of a streamed response into state.last_analysis as
+    they complete, and wakes the engine as soon as an emergency is reported
+    — before the (long) vehicle list has been generated."""
+    def __init__(self, payload, t0):
+        self.payload    = payload
+        self.t0         = t0
+        self.fields     = {}
+        self.before     = None
+        self.dispatched = False
+
+    def on_field(self, key, value):
+        self.fields[key] = value
+        if key not in Analysis._fields:
+            return
+        try:
+            partial = state.encoder.to_frame(Analysis.from_dict(self.fields), self.payload)
+        except AnalysisError:
+            return                      # the full response will be rejected too
+        changes = {k: getattr(partial, k) for k in self.fields if k in Analysis._fields}
+        with state.lock:
+            if self.before is None:
+                self.before = state.last_analysis
+            state.last_analysis = state.last_analysis.replace(**changes)
+        if not self.dispatched and (partial.emergency_priority or partial.emergency_vehicles):
+            self.dispatched = True
+            metrics.observe("time_to_emergency", time.perf_counter() - self.t0)
+            metrics.inc("early_emergency_dispatch")
+            state.wake.set()
+
+    def rollback(self):
+        """The stream failed — drop the fields it had published."""
+        if self.before is not None:
+            with state.lock:
+                state.last_analysis = self.before
+
+def analyze_latest():
+    """Executor job: gate, budget and encode the newest frame, then analyze it."""
+    payload = None
+    try:
+        payload = _prepare(state.mailbox.take())
+    finally:
+        if payload is None:
+            with _locked():
+                state.analyzing = False
+    if payload is not None:
+        run_analysis(payload)
+
+def _prepare(img):
+    """Payload for a Gemini call on `img`, or None if the call is not worth
+    making (scene unchanged) or not affordable yet."""
+    if img is None:
+        return None
+    now = time.time()
+    with span("gate"):
+        sig = signature(img)
+        changed  = not state.last_analysis or state.gate.changed(sig)
+        priority = state.priority_pending or state.gate.major_change(sig)
+    if not changed and not priority:
+        # Scene effectively unchanged — keep the cached analysis
+        with _locked():
+            state.gate_hits += 1
+            state.next_allowed_call = now + _GATE_RECHECK
+        metrics.inc("gate_hits")
+        return None
+    # Follow-ups while an emergency is reported may use the reserve too (capped by it)
+    priority = priority or state.last_analysis.emergency_priority
+    if not (state.use_mock or state.scheduler.try_acquire(priority=priority)):
+        # Worth a call, but no budget yet — look again shortly
+        with _locked():
+            state.next_allowed_call = now + _GATE_RECHECK
+        return None
+    with span("encode"):
+        payload = state.encoder.encode(img)
+    state.gate.commit(sig)
+    with _locked():
+        state.priority_pending = False
+        state.gate_misses += 1
+    metrics.inc("gate_misses")
+    return payload
+
+def backoff_after(e):
+    """Count a failed Gemini call and tell the scheduler about a 429.
+    Returns the seconds to wait before the next call, or None once the
+    daily quota is exhausted."""
+    err = str(e)
+    print(f"Gemini analysis error: {e}")
+    metrics.inc("gemini_errors")
+    if "429" not in err and "RESOURCE_EXHAUSTED" not in err:
+        return _CALL_INTERVAL
+    # Detect DAILY quota exhaustion vs per-minute rate limit
+    if "PerDay" in err or "per_day" in err.lower():
+        print("  → DAILY quota exhausted — no more calls until tomorrow")
+        state.scheduler.on_daily_exhausted()
+        metrics.inc("daily_quota_exhausted")
+        return None
+    # Per-minute limit: honour the server's retry delay
+    match = _re.search(r"retryDelay.*?(\d+)", err)
+    backoff = float(match.group(1)) + 5 if match else _429_BACKOFF
+    state.scheduler.on_rate_limited(backoff)
+    metrics.inc("rate_limited")
+    print(f"  → per-minute rate limit, backing off {backoff:.0f}s")
+    return backoff
+
+def run_analysis(payload):
+    with span("run_analysis"):
+        _run_analysis(payload)
+
+def _run_analysis(payload):
+    with state.lock:
+        state.api_calls_made += 1
+    metrics.inc("gemini_calls")
+    ok, t0, partial = False, time.perf_counter(), None
+    try:
+        with span("analyze"):
+            if state.use_mock:
+                result = mock_analysis()
+            elif state.use_streaming:
+                partial = _PartialPublisher(payload, t0)
+                result  = analyze_frame_stream(payload.data, on_field=partial.on_field)
+            else:
+                result = analyze_frame(payload.data)
+        ok = True
+        result = state.encoder.to_frame(result, payload)    # ROI crop → full frame
+        with state.lock:
+            state.last_analysis     = result
+            state.next_allowed_call = time.time() + _CALL_INTERVAL
+            state.analysis_version += 1
+            state.analysis_at       = time.time()
+        if result.emergency_priority and not (partial and partial.dispatched):
+            state.wake.set()            # don't wait for the engine's next tick
+        if state.recorder:
+            state.recorder.analysis(result, jpeg=payload.data)
+    except Exception as e:
+        if partial is not None:
+            partial.rollback()
+        state.gate.reset()      # nothing cached for this scene — retry it
+        backoff = backoff_after(e)
+        if backoff is None:
+            return
+        with state.lock:
+            state.next_allowed_call = time.time() + backoff
+    finally:
+        state.encoder.record(payload, time.perf_counter() - t0, ok)
+        with state.lock:
+            state.analyzing = False
+
+# ── Per-frame callback ───────────────────────────────────────────────────────
+def video_frame_callback(frame):
+    with span("video_frame_callback"):
+        img = process_image(frame.to_ndarray(format="bgr24"))
+        return av.VideoFrame.from_ndarray(img, format="bgr24")
+
+def process_image(img):
+    """Gate / analyze / track one BGR frame and draw the overlay on it in place.
+    Used by the WebRTC callback and by engine.py's own capture loop."""
+    state.camera_active = True          # mark camera as live
+    now = time.time()
+    # Copy the analysis only when a new one has landed
+    cache = state.overlay
+    new_analysis = cache.refresh(state)
+    analysis = cache.analysis
+    with span("post_frame"):
+        state.mailbox.post(img)         # before the overlay is drawn on it
+    detector = state.local_detector
+    if state.use_local_detector and detector is not None:
+        with span("local_detect"):
+            local = detector.analyze(img)
+        with _locked():
+            state.local_analysis = local
+    else:
+        local = None
+    if now >= state.next_allowed_call and not state.analyzing:
+        # The worker picks the newest frame when it starts, not this one
+        with _locked():
+            state.analyzing = True
+        state.executor.submit(analyze_latest)
+    # Carry boxes forward: optical flow every frame, re-seeded by new detections
+    with span("track"):
+        tracker = state.tracker
+        tracker.step(img, now)
+        if new_analysis:
+            tracker.seed(analysis, now)
+        if local is not None:
+            tracker.seed(local, now, source="local")
+        if now - state.tracked_at >= _TRACKED_EVERY:
+            # Track ids, dwell and speed for the engine snapshot (app.py)
+            tracked = tracker.as_analysis(analysis, now)
+            with state.lock:
+                state.tracked, state.tracked_at = tracked, now
+    with span("draw_boxes"):
+        boxes, styles, labels = tracker.geometry()
+        h, w = img.shape[:2]
+        overlay.draw(img, overlay.to_pixels(boxes, w, h), styles, labels)
+    return img
@@ -0,0 +1,64 @@
+import time
+import cv2
+import numpy as np
+
+# ── Tunables ─────────────────────────────────────────────────────────────────
+HASH_THRESHOLD  = 6        # dHash bits (out of 64) that must flip to count as a change
+DELTA_THRESHOLD = 6.0      # mean absolute grey-level change on the thumbnail (0-255)
+MAX_CACHE_AGE   = 300.0    # re-analyze at least this often even on a static scene
+MAJOR_FACTOR    = 3.0      # a change this many times over threshold is a priority trigger
+
+_THUMB_SIZE = (32, 18)     # keeps the 16:9 aspect of the camera
+
+
+def signature(img):
+    """Cheap perceptual signature of a BGR frame: (dhash, grey thumbnail)."""
+    grey  = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+    small = cv2.resize(grey, (9, 8), interpolation=cv2.INTER_AREA)
+    bits  = (small[:, 1:] > small[:, :-1]).flatten()
+    dhash = int.from_bytes(np.packbits(bits).tobytes(), "big")
+    thumb = cv2.resize(grey, _THUMB_SIZE, interpolation=cv2.INTER_AREA).astype(np.int16)
+    return dhash, thumb
+
+
+def change_score(a, b):
+    """Return (hamming distance, mean pixel delta) between two signatures."""
+    hamming = bin(a[0] ^ b[0]).count("1")
+    delta   = float(np.mean(np.abs(a[1] - b[1])))
+    return hamming, delta
+
+
+class SceneGate:
+    """Decides whether a frame is different enough from the last analyzed one
+    to be worth an API call."""
+
+    def __init__(self, hash_threshold=HASH_THRESHOLD, delta_threshold=DELTA_THRESHOLD,
+                 max_age=MAX_CACHE_AGE):
+        self.hash_threshold  = hash_threshold
+        self.delta_threshold = delta_threshold
+        self.max_age         = max_age
+        self._last_sig  = None
+        self._last_time = 0.0
+
+    def changed(self, sig, now=None):
+        now = time.time() if now is None else now
+        if self._last_sig is None or now - self._last_time >= self.max_age:
+            return True
+        return self._exceeds(sig, 1.0)
+
+    def major_change(self, sig):
+        """True for a large scene change (MAJOR_FACTOR x the thresholds)."""
+        return self._last_sig is not None and self._exceeds(sig, MAJOR_FACTOR)
+
+    def _exceeds(self, sig, factor):
+        hamming, delta = change_score(sig, self._last_sig)
+        return (hamming >= self.hash_threshold * factor
+                or delta >= self.delta_threshold * factor)
+
+    def commit(self, sig, now=None):
+        """Remember `sig` as the signature of the frame just sent for analysis."""
+        self._last_sig  = sig
+        self._last_time = time.time() if now is None else now
+
+    def reset(self):
+        self._last_sig = None
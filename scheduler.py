@@ -0,0 +1,193 @@
+"""Quota-aware scheduling of Gemini calls.
+
+Three budgets gate every call:
+  * a sliding one-minute window (the API's RPM limit — a token bucket
+    would allow twice the limit within one minute after an idle spell),
+  * a per-day bucket (RPD), split into
+      - a routine share, paced evenly across the operating hours so the
+        quota lasts until closing time, and
+      - a reserved burst pool that only priority triggers (PIR edge, large
+        scene change, emergency) may draw from.
+Server-side 429s push a hard `blocked_until`, and a daily-exhaustion error
+closes the day until the next local midnight.
+"""
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+PER_MINUTE  = 10
+PER_DAY     = 20
+RESERVE     = 5            # of PER_DAY, kept back for priority triggers
+OPEN_HOUR   = 7            # operating window, local time
+CLOSE_HOUR  = 22
+
+
+class TokenBucket:
+    def __init__(self, capacity, refill_per_sec, tokens=None):
+        self.capacity = capacity
+        self.rate     = refill_per_sec
+        self.tokens   = capacity if tokens is None else tokens
+        self._last    = None
+
+    def refill(self, now):
+        if self._last is not None and now > self._last:
+            self.tokens = min(self.capacity, self.tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def take(self, now, n=1):
+        self.refill(now)
+        if self.tokens >= n:
+            self.tokens -= n
+            return True
+        return False
+
+    def time_until(self, now, n=1):
+        self.refill(now)
+        if self.tokens >= n:
+            return 0.0
+        return float("inf") if self.rate <= 0 else (n - self.tokens) / self.rate
+
+
+class QuotaScheduler:
+    def __init__(self, per_minute=PER_MINUTE, per_day=PER_DAY, reserve=RESERVE,
+                 open_hour=OPEN_HOUR, close_hour=CLOSE_HOUR, clock=time.time):
+        self.per_minute = per_minute
+        self.per_day    = per_day
+        self.reserve    = min(reserve, per_day)
+        self.open_hour  = open_hour
+        self.close_hour = close_hour
+        self.clock      = clock
+        self._lock      = threading.Lock()
+        self._recent    = deque()       # times of the calls in the last minute
+        self._day       = None
+        self._roll(clock())
+
+    # ── Day bookkeeping ──────────────────────────────────────────────────────
+    def _window(self, now):
+        day = datetime.fromtimestamp(now).replace(hour=0, minute=0, second=0, microsecond=0)
+        return ((day + timedelta(hours=self.open_hour)).timestamp(),
+                (day + timedelta(hours=self.close_hour)).timestamp())
+
+    def _roll(self, now):
+        today = datetime.fromtimestamp(now).date()
+        if today == self._day:
+            return
+        self._day          = today
+        self.used_today    = 0
+        self.routine_used  = 0
+        self.priority_used = 0
+        self.exhausted_day = False
+        self.blocked_until = 0.0
+        self._routine      = TokenBucket(1, 0.0, tokens=1)   # first call after opening is free
+
+    def _routine_left(self):
+        return max(0, self.per_day - self.reserve - self.routine_used)
+
+    def _pace(self, now):
+        """Refill rate that spreads the remaining routine budget to closing time."""
+        start, end = self._window(now)
+        if now < start or now >= end:
+            return 0.0
+        owed = self._routine_left() - self._routine.tokens
+        if owed <= 0:
+            return 0.0
+        # +0.5 so the last routine call lands half an interval before closing
+        return (owed + 0.5) / max(end - now, 1.0)
+
+    def _refill_routine(self, now):
+        self._routine.refill(now)              # accrue at the rate in force until now
+        self._routine.rate = self._pace(now)
+        if self._routine_left() == 0:
+            self._routine.tokens = 0
+
+    def _minute_left(self, now):
+        while self._recent and self._recent[0] <= now - 60.0:
+            self._recent.popleft()
+        return self.per_minute - len(self._recent)
+
+    # ── Public API ───────────────────────────────────────────────────────────
+    def acquire(self, priority=False):
+        """Spend one call if the budget allows it; returns the grant
+        (pool, time) for refund(), or None. Priority calls may use the
+        reserved pool once the routine share has no token ready."""
+        now = self.clock()
+        with self._lock:
+            self._roll(now)
+            if self.exhausted_day or now < self.blocked_until or self.used_today >= self.per_day:
+                return None
+            if self._minute_left(now) < 1:
+                return None
+            self._refill_routine(now)
+            start, end = self._window(now)
+            if start <= now < end and self._routine.tokens >= 1:
+                self._routine.tokens -= 1
+                self.routine_used += 1
+                pool = "routine"
+            elif priority and self.priority_used < self.reserve:
+                self.priority_used += 1
+                pool = "reserve"
+            else:
+                return None
+            self._recent.append(now)
+            self.used_today += 1
+            return pool, now
+
+    def try_acquire(self, priority=False):
+        return self.acquire(priority) is not None
+
+    def refund(self, grant):
+        """Give back a grant that was never used for a call (fleet.py)."""
+        pool, t = grant
+        with self._lock:
+            if datetime.fromtimestamp(t).date() != self._day:
+                return                  # yesterday's budget is gone anyway
+            try:
+                self._recent.remove(t)
+            except ValueError:
+                pass                    # already out of the minute window
+            self.used_today -= 1
+            if pool == "routine":
+                self.routine_used -= 1
+                self._routine.tokens += 1
+            else:
+                self.priority_used -= 1
+
+    def on_rate_limited(self, retry_after):
+        with self._lock:
+            self.blocked_until = max(self.blocked_until, self.clock() + retry_after)
+
+    def on_daily_exhausted(self):
+        with self._lock:
+            self.exhausted_day = True
+
+    def exhausted(self):
+        with self._lock:
+            self._roll(self.clock())
+            return self.exhausted_day or self.used_today >= self.per_day
+
+    def forecast(self):
+        """Budget snapshot for the dashboard."""
+        now = self.clock()
+        with self._lock:
+            self._roll(now)
+            self._refill_routine(now)
+            start, end = self._window(now)
+            next_routine = self._routine.time_until(now)
+            if now < start and self._routine_left():
+                next_routine = start - now
+            blocked = max(0.0, self.blocked_until - now)
+            hours_left = max(0.0, end - max(now, start)) / 3600.0
+            return {
+                "used_today":         self.used_today,
+                "per_day":            self.per_day,
+                "routine_left":       self._routine_left(),
+                "reserve_left":       self.reserve - self.priority_used,
+                "minute_tokens":      self._minute_left(now),
+                "next_routine_in":    max(next_routine, blocked),
+                "routine_interval":   (hours_left * 3600 / self._routine_left()
+                                       if self._routine_left() else float("inf")),
+                "hours_left":         hours_left,
+                "blocked_for":        blocked,
+                "exhausted":          self.exhausted_day or self.used_today >= self.per_day,
+            }
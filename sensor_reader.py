@@ -1,27 +1,208 @@
 import threading
 import time
 import random
+from array import array
+
+LANES = ("lane1", "lane2")
+
+class EventRing:
+    """Fixed-size, array-backed ring of (timestamp, lane index, occupancy ms)."""
+    def __init__(self, capacity=4096):
+        self.capacity = capacity
+        self.ts   = array('d', bytes(8 * capacity))
+        self.lane = array('b', bytes(capacity))
+        self.occ  = array('f', bytes(4 * capacity))
+        self.head = 0           # next slot to write
+        self.size = 0
+
+    def append(self, t, lane_idx, occ_ms):
+        i = self.head
+        self.ts[i], self.lane[i], self.occ[i] = t, lane_idx, occ_ms
+        self.head = (i + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+
+    def last(self, n):
+        """Newest-last list of up to n (t, lane, occ_ms) events."""
+        n = min(n, self.size)
+        out = []
+        for k in range(n, 0, -1):
+            i = (self.head - k) % self.capacity
+            out.append((self.ts[i], LANES[self.lane[i]], self.occ[i]))
+        return out
+
+class _LaneWindow:
+    """Per-second cumulative bins for one lane.
+
+    bins[s % horizon] holds running totals at the end of second s, so any
+    window up to `horizon` seconds is a difference of two bins — O(1) per
+    query, amortized O(1) per event.
+    """
+    def __init__(self, horizon):
+        self.horizon = horizon
+        self.cnt  = array('l', bytes(8 * horizon))    # vehicles
+        self.occ  = array('d', bytes(8 * horizon))    # occupied seconds
+        self.hw   = array('d', bytes(8 * horizon))    # sum of headways
+        self.hwn  = array('l', bytes(8 * horizon))    # number of headways
+        self.sec  = None
+        self.tot  = [0, 0.0, 0.0, 0]
+        self.last_t = None
+
+    def _write(self, i):
+        self.cnt[i], self.occ[i], self.hw[i], self.hwn[i] = self.tot
+
+    def advance(self, sec):
+        if self.sec is None:
+            self.sec = sec
+        elif sec > self.sec:
+            for s in range(max(self.sec + 1, sec - self.horizon + 1), sec + 1):
+                self._write(s % self.horizon)
+            self.sec = sec
+
+    def add(self, t, occ_s):
+        self.advance(int(t))
+        self.tot[0] += 1
+        self.tot[1] += occ_s
+        if self.last_t is not None and t > self.last_t:
+            self.tot[2] += t - self.last_t
+            self.tot[3] += 1
+        self.last_t = t
+        self._write(self.sec % self.horizon)
+
+    def window(self, now, seconds):
+        sec = int(now)
+        self.advance(sec)
+        seconds = max(1, min(int(seconds), self.horizon - 1))
+        i, j = sec % self.horizon, (sec - seconds) % self.horizon
+        return (self.cnt[i] - self.cnt[j], self.occ[i] - self.occ[j],
+                self.hw[i] - self.hw[j], self.hwn[i] - self.hwn[j], seconds)
 
 class SensorReader:
-    def __init__(self, port="MOCK", baud=9600):
-        self.counts = {"lane1": 0, "lane2": 0}
-        self.running = True
-        # Serial connection is commented out for mocking
-        # self.serial_conn = serial.Serial(port, baud, timeout=1)
+    """Per-lane vehicle detector events, from a serial port or a mock source.
+
+    Serial lines are `1`, `L1` or `lane1`, optionally followed by
+    `,<occupancy ms>` (time the loop/beam was covered).
+    """
+    def __init__(self, port="MOCK", baud=9600, capacity=4096, horizon=3600, verbose=False):
+        self.port     = port
+        self.baud     = baud
+        self.verbose  = verbose
+        self.running  = False
+        self.clock    = time.time
+        self.started_at = None      # rates cover at most the time since then
+        self.parse_errors = 0
+        self._lock    = threading.Lock()
+        self._ring    = EventRing(capacity)
+        self._lanes   = {lane: _LaneWindow(horizon) for lane in LANES}
+        self.serial_conn = None
+
+    # ── Ingestion ─────────────────────────────────────────────────────────────
+    def record(self, lane, occ_ms=0.0, t=None):
+        t = self.clock() if t is None else t
+        with self._lock:
+            self._ring.append(t, LANES.index(lane), occ_ms)
+            self._lanes[lane].add(t, occ_ms / 1000.0)
 
     def start(self):
-        # Starts the background thread for the "fake" data loop
-        thread = threading.Thread(target=self._mock_read_loop, daemon=True)
+        self.running = True
+        self.started_at = self.clock()
+        target = self._mock_read_loop if self.port == "MOCK" else self._serial_read_loop
+        thread = threading.Thread(target=target, daemon=True)
         thread.start()
 
+    def stop(self):
+        self.running = False
+
     def _mock_read_loop(self):
         """Simulates vehicles passing by every 5-10 seconds."""
         while self.running:
-            time.sleep(random.randint(5, 10)) 
-            lane = random.choice(["lane1", "lane2"])
-            self.counts[lane] += 1
-            print(f"MOCK DATA: {lane} incremented to {self.counts[lane]}")
+            time.sleep(random.randint(5, 10))
+            lane = random.choice(LANES)
+            self.record(lane, occ_ms=random.uniform(150, 600))
+            if self.verbose:
+                print(f"MOCK DATA: {lane} incremented to {self.get_counts()[lane]}")
+
+    @staticmethod
+    def _parse_line(line):
+        name, _, occ = line.strip().partition(",")
+        name = name.strip().lower()
+        if name.startswith("lane"):
+            name = name[4:]
+        elif name.startswith("l"):
+            name = name[1:]
+        lane = f"lane{int(name)}"
+        if lane not in LANES:
+            raise ValueError(line)
+        return lane, float(occ) if occ else 0.0
+
+    def _serial_read_loop(self):
+        """Reads whatever bytes are waiting and ingests every complete line —
+        no per-event prints, so bursts of events do not back up."""
+        import serial   # pyserial — only needed for real hardware
+        self.serial_conn = serial.Serial(self.port, self.baud, timeout=0.1)
+        pending = b""
+        while self.running:
+            chunk = self.serial_conn.read(self.serial_conn.in_waiting or 1)
+            if not chunk:
+                continue
+            now = self.clock()
+            *lines, pending = (pending + chunk).split(b"\n")
+            for raw in lines:
+                if not raw.strip():
+                    continue
+                try:
+                    lane, occ = self._parse_line(raw.decode(errors="replace"))
+                except ValueError:
+                    self.parse_errors += 1
+                    continue
+                self.record(lane, occ, t=now)
+        self.serial_conn.close()
 
+    def replay(self, trace, speed=10.0, block=False):
+        """Feeds a recorded trace of (offset_s, lane, occ_ms) events, `speed`
+        times faster than real time. The reader's clock runs at the same
+        accelerated rate, so windowed rates read as in the original trace."""
+        t0, m0 = time.time(), time.monotonic()
+        self.clock = lambda: t0 + (time.monotonic() - m0) * speed
+        self.started_at = t0
+
+        def _run():
+            for offset, lane, occ in sorted(trace):
+                delay = offset / speed - (time.monotonic() - m0)
+                if delay > 0:
+                    time.sleep(delay)
+                self.record(lane, occ, t=t0 + offset)
+
+        self.running = True
+        if block:
+            _run()
+        else:
+            threading.Thread(target=_run, daemon=True).start()
+
+    # ── Queries ───────────────────────────────────────────────────────────────
     def get_counts(self):
-        # Returns the current fake counts to the dashboard
-        return self.counts.copy()
+        # Running totals per lane
+        with self._lock:
+            return {lane: w.tot[0] for lane, w in self._lanes.items()}
+
+    def get_rates(self, window=60):
+        """Per-lane vehicles/minute, mean headway (s) and occupancy (0-1)
+        over the last `window` seconds (fewer — `window_s` — right after start)."""
+        now = self.clock()
+        if self.started_at is not None:
+            window = min(window, now - self.started_at)
+        out = {}
+        with self._lock:
+            for lane, w in self._lanes.items():
+                cnt, occ, hw, hwn, secs = w.window(now, window)
+                out[lane] = {
+                    "vehicles_per_min": cnt * 60.0 / secs,
+                    "headway_s":        hw / hwn if hwn else None,
+                    "occupancy":        min(1.0, occ / secs),
+                    "count":            cnt,
+                    "window_s":         secs,
+                }
+        return out
+
+    def recent_events(self, n=100):
+        with self._lock:
+            return self._ring.last(n)
@@ -1,20 +1,226 @@
+"""Adaptive two-phase signal control: vehicle green / pedestrian walk.
+
+engine.py ticks the controller about once a second with the latest analysis
+and the loop detectors' windowed rates (SensorReader.get_rates; a replay has
+only their totals). From a rolling window of both it estimates
+  * the vehicle queue — camera counts blended into a queue model driven by
+    the arrival rate (loop detectors, or a density-based guess without them),
+  * pedestrian demand — how many are waiting (not already crossing) and
+    since when; one analysis that misses them does not restart the clock,
+and runs the phases green → yellow → walk → clearance → green:
+  * green lasts at least MIN_GREEN and rests there while nobody waits to
+    cross. With someone waiting it ends once the queue has discharged (or
+    had the green it needs, at most MAX_GREEN) and the pedestrians' waiting
+    time outweighs the delay a walk phase would cause vehicles — or in any
+    case in time to keep every wait under MAX_PED_WAIT from arrival (which
+    may be up to one analysis interval before they are first seen),
+  * walk is extended while people are still crossing, up to MAX_WALK,
+  * an emergency vehicle preempts: walk cuts to clearance, yellow returns
+    to green (the walk is skipped) and green is held until the vehicle has
+    not been seen for EMERGENCY_HOLD (at most PREEMPT_MAX). Pedestrians who
+    waited through it are served right after a short recovery green.
+signal_sim.py measures it against the old fixed multipliers.
+"""
 import time
+from collections import deque
+from analysis_model import Analysis
+
+# ── Timing (seconds) ─────────────────────────────────────────────────────────
+MIN_GREEN      = 10
+MAX_GREEN      = 60
+YELLOW         = 4
+MIN_WALK       = 7
+MAX_WALK       = 20
+PED_CLEARANCE  = 10        # flashing DON'T WALK — time to finish crossing
+MAX_PED_WAIT   = 60        # longest wait to cross from arrival, outside an emergency
+RECOVERY_GREEN = 5         # green after a preemption before waiting pedestrians go
+EMERGENCY_HOLD = 10        # keep preempting this long after the last sighting
+PREEMPT_MAX    = 90
+
+# ── Queue model ──────────────────────────────────────────────────────────────
+SAT_HEADWAY   = 2.0        # seconds per vehicle leaving a queue on green
+CAMERA_WEIGHT = 0.5        # share of a new camera count in the queue estimate
+WINDOW        = 60         # rolling history, seconds
+MIN_SPAN      = 5          # sensor history needed before its rate is trusted
+ANALYSIS_GAP  = 12.0       # assumed analysis interval until two have been seen (pipeline.py)
+MAX_GAP       = 24.0       # longer gaps are an unchanged scene (scene gate), not a blind spot
+PED_GONE_AFTER = 3         # consecutive analyses without anyone waiting before the wait resets
+PED_WEIGHT    = 2.0        # a pedestrian-second of waiting against a vehicle-second of delay
+DENSITY_RATE  = {"low": 0.05, "medium": 0.15, "high": 0.3, "gridlock": 0.4}   # veh/s
+
+LIGHT = {"green": "green", "yellow": "yellow", "walk": "red", "clearance": "red"}
+
 
 class TrafficSignalController:
-    def __init__(self):
-        self.base_green_time = 30
-        self.emergency_mode = False
-
-    def update(self, analysis: dict, sensor_counts: dict):
-        if analysis.get("emergency_priority"):
-            self.emergency_mode = True
-            return {"action": "emergency_clear", "message": "Emergency vehicle approaching!"}
-        
-        pedestrians = analysis.get("pedestrians", [])
-        if any(p.get("crossing") for p in pedestrians):
-            return {"action": "pedestrian_crossing", "message": "Pedestrian crossing active"}
-            
-        density = analysis.get("traffic_density", "medium")
-        multiplier = {"low": 0.7, "medium": 1.0, "high": 1.3, "gridlock": 1.5}
-        green_time = self.base_green_time * multiplier.get(density, 1.0)
-        return {"action": "adaptive", "message": f"Density: {density} - green: {green_time:.0f}s"}
+    def __init__(self, clock=time.time, window=WINDOW):
+        self.clock  = clock
+        self.window = window
+        self.phase          = "green"
+        self.phase_started  = None
+        self.queue          = 0.0
+        self.ped_since      = None      # first pedestrian waiting to cross
+        self.ped_missing    = 0         # analyses in a row without anyone waiting
+        self.preempt_since  = None
+        self.last_emergency = None
+        self.recovering     = False
+        self._analyses = deque()        # (t, vehicle count, density)
+        self._sensors  = deque()        # (t, total loop-detector count)
+        self._rates    = None           # SensorReader.get_rates(), when live
+        self._seen     = None
+        self._last     = None
+
+    # ── Observations ─────────────────────────────────────────────────────────
+    def _observe(self, analysis, sensor_counts, sensor_rates, now):
+        cutoff = now - self.window
+        new = analysis is not self._seen
+        if new:
+            self._seen = analysis
+            self._analyses.append((now, len(analysis.vehicles), analysis.traffic_density))
+            self.queue += CAMERA_WEIGHT * (len(analysis.vehicles) - self.queue)
+        self._rates = sensor_rates
+        if sensor_counts and not sensor_rates:
+            self._sensors.append((now, sum(sensor_counts.values())))
+        for history in (self._analyses, self._sensors):
+            while len(history) > 1 and history[0][0] < cutoff:
+                history.popleft()
+        if self.waiting(analysis) and self.phase != "walk":
+            self.ped_missing = 0
+            if self.ped_since is None:
+                self.ped_since = now
+        elif new and not self.waiting(analysis) and self.ped_since is not None:
+            # A single missed detection must not restart the clock
+            self.ped_missing += 1
+            if self.ped_missing >= PED_GONE_AFTER:
+                self.ped_since, self.ped_missing = None, 0      # gone — nobody left to serve
+
+    @staticmethod
+    def waiting(analysis):
+        """Pedestrians waiting to cross — those already crossing are not."""
+        return analysis.counts["pedestrians"] - analysis.counts["crossing"]
+
+    def analysis_gap(self):
+        """Longest interval between analyses in the window: how long someone
+        may have been waiting before an analysis first showed them."""
+        times = [t for t, _, _ in self._analyses]
+        if len(times) < 2:
+            return ANALYSIS_GAP
+        return min(MAX_GAP, max(b - a for a, b in zip(times, times[1:])))
+
+    def arrival_rate(self):
+        """Vehicles per second approaching, over the rolling window: the
+        loop detectors' own windowed rates when live, else the difference
+        of their totals (replays, logs), else a guess from camera density."""
+        if self._rates and min(r["window_s"] for r in self._rates.values()) >= MIN_SPAN:
+            return sum(r["vehicles_per_min"] for r in self._rates.values()) / 60.0
+        if len(self._sensors) > 1:
+            (t0, n0), (t1, n1) = self._sensors[0], self._sensors[-1]
+            if t1 - t0 >= MIN_SPAN:
+                return max(0.0, (n1 - n0) / (t1 - t0))
+        if self._analyses:
+            rates = [DENSITY_RATE.get(d, DENSITY_RATE["medium"]) for _, _, d in self._analyses]
+            return sum(rates) / len(rates)
+        return DENSITY_RATE["medium"]
+
+    def green_target(self, rate):
+        """Green needed to discharge the queue plus what arrives meanwhile."""
+        spare = 1.0 - rate * SAT_HEADWAY
+        if spare <= 0.05:
+            return MAX_GREEN            # oversaturated
+        return min(MAX_GREEN, max(MIN_GREEN, self.queue * SAT_HEADWAY / spare))
+
+    def _walk_cost(self, rate):
+        """Vehicle-seconds of delay a pedestrian phase started now would add:
+        the queue plus the vehicles arriving meanwhile, all held for its length."""
+        red = YELLOW + MIN_WALK + PED_CLEARANCE
+        return (self.queue + rate * red / 2) * red
+
+    def _ped_delay(self, analysis, wait):
+        """Pedestrian-seconds spent waiting so far, weighted by PED_WEIGHT."""
+        return PED_WEIGHT * max(1, self.waiting(analysis)) * wait
+
+    def _preempting(self, analysis, now):
+        if analysis.emergency_priority or analysis.counts["ambulance"]:
+            if self.preempt_since is None:
+                self.preempt_since = now
+            self.last_emergency = now
+        elif self.preempt_since is not None and now - self.last_emergency >= EMERGENCY_HOLD:
+            self.preempt_since = None
+            self.recovering    = True
+        return self.preempt_since is not None and now - self.preempt_since < PREEMPT_MAX
+
+    # ── Phases ───────────────────────────────────────────────────────────────
+    def _enter(self, phase, now):
+        self.phase, self.phase_started = phase, now
+        if phase == "walk":
+            self.ped_since, self.recovering = None, False
+
+    def update(self, analysis: Analysis, sensor_counts: dict, now=None, sensor_rates=None):
+        now = self.clock() if now is None else now
+        if self.phase_started is None:
+            self.phase_started = now
+        self._observe(analysis, sensor_counts, sensor_rates, now)
+        rate = self.arrival_rate()
+        dt = min(5.0, max(0.0, now - self._last)) if self._last is not None else 0.0
+        self._last = now
+        # Queue model between camera counts: arrivals in, saturation flow out on green
+        self.queue += rate * dt
+        if self.phase == "green":
+            self.queue = max(0.0, self.queue - dt / SAT_HEADWAY)
+
+        preempt = self._preempting(analysis, now)
+        elapsed = now - self.phase_started
+        wait    = now - self.ped_since if self.ped_since is not None else 0.0
+        target  = self.green_target(rate)
+        if self.phase == "green":
+            if self.ped_since is None:
+                self.recovering = False     # nobody waited through the preemption
+            min_green = RECOVERY_GREEN if self.recovering else MIN_GREEN
+            # Walk must start within MAX_PED_WAIT of arrival, not of being seen
+            deadline = MAX_PED_WAIT - YELLOW - self.analysis_gap() - 1.0    # - one tick
+            if (not preempt and self.ped_since is not None and elapsed >= min_green and
+                    (self.recovering or wait >= deadline or
+                     (self.queue < 1 or elapsed >= target) and
+                     self._ped_delay(analysis, wait) >= self._walk_cost(rate))):
+                self._enter("yellow", now)
+        elif self.phase == "yellow":
+            if preempt:
+                self._enter("green", now)
+            elif elapsed >= YELLOW:
+                self._enter("walk", now)
+        elif self.phase == "walk":
+            crossing = analysis.counts["crossing"] and elapsed < MAX_WALK
+            if preempt or (elapsed >= MIN_WALK and not crossing):
+                self._enter("clearance", now)
+        elif elapsed >= PED_CLEARANCE:
+            self._enter("green", now)
+        return self._signal(now, preempt, rate, target)
+
+    def _signal(self, now, preempt, rate, target):
+        phase   = self.phase
+        elapsed = now - self.phase_started
+        wait    = now - self.ped_since if self.ped_since is not None else 0.0
+        if preempt:
+            action, message = "emergency_clear", "Emergency vehicle approaching! Holding the crossing."
+        elif phase == "walk":
+            action, message = "pedestrian_crossing", f"Pedestrian crossing active — walk {elapsed:.0f}s"
+        elif phase == "clearance":
+            action, message = "pedestrian_crossing", "Pedestrians clearing the crosswalk"
+        elif phase == "yellow":
+            action, message = "adaptive", "Changing for pedestrians"
+        else:
+            action  = "adaptive"
+            message = f"Queue ~{self.queue:.0f} veh, {rate * 60:.0f}/min — green {elapsed:.0f}/{target:.0f}s"
+            if self.ped_since is not None:
+                message += f" · pedestrian waiting {wait:.0f}s"
+        return {
+            "action":       action,
+            "message":      message,
+            "light_state":  LIGHT[phase],
+            "walk_sign":    phase == "walk",
+            "phase":        phase,
+            "elapsed":      round(elapsed, 1),
+            "green_target": round(target, 1),
+            "queue":        round(self.queue, 1),
+            "arrivals":     round(rate * 60, 1),     # vehicles / minute
+            "ped_wait":     round(wait, 1),
+        }
@@ -0,0 +1,284 @@
+"""Discrete-event simulation of the intersection, for comparing signal controllers.
+
+    python signal_sim.py                       # one day, adaptive vs fixed
+    python signal_sim.py --days 7 --seed 3 --out sim.json
+
+Vehicles and pedestrians arrive as Poisson streams with morning and evening
+peaks; a few emergency vehicles a day are seen EMS_APPROACH seconds before
+they reach the stop line. Vehicles leave the queue one per SAT_HEADWAY on
+green. Controllers see what engine.py gives them: an Analysis from the camera
+every ANALYSIS_EVERY seconds (at once when an emergency vehicle appears, as
+with streamed responses) and the two loop-detector totals, ticked once a
+second. The loop detectors are a SensorReader on the simulation clock, so
+the adaptive controller gets the same windowed rates as on the street. Days
+of traffic run in seconds.
+
+The baseline is the previous controller: green = BASE_GREEN x a density
+multiplier, with a walk phase every cycle. ped_over_max counts pedestrians
+who waited longer than MAX_PED_WAIT without an emergency in between — the
+adaptive controller promises none.
+"""
+import argparse
+import heapq
+import json
+import math
+import random
+import time
+from collections import Counter, deque
+from analysis_model import Analysis, Detection, density_from_count
+from sensor_reader import SensorReader
+from signal_controller import (TrafficSignalController, LIGHT, EMERGENCY_HOLD, MAX_PED_WAIT,
+                               MIN_WALK, PED_CLEARANCE, RECOVERY_GREEN, SAT_HEADWAY, WINDOW,
+                               YELLOW)
+
+# ── Scenario ─────────────────────────────────────────────────────────────────
+DAY            = 86_400
+TICK           = 1.0         # controller tick, as in engine.py
+ANALYSIS_EVERY = 12.0        # pipeline._CALL_INTERVAL
+CAMERA_CAP     = 20          # vehicles the camera can see queued
+CROSS_TIME     = 8.0         # a pedestrian is on the crosswalk this long
+EMS_APPROACH   = 10.0        # emergency vehicle seen this long before the stop line
+VEH_BASE, VEH_PEAK = 200, 1000      # vehicles / hour, off-peak and at the peaks
+PED_BASE, PED_PEAK = 15, 150        # pedestrians / hour
+EMERGENCIES    = 6           # per day
+
+# ── Baseline ─────────────────────────────────────────────────────────────────
+BASE_GREEN = 30
+MULTIPLIER = {"low": 0.7, "medium": 1.0, "high": 1.3, "gridlock": 1.5}
+
+
+class FixedMultiplierController:
+    """The previous timing as a fixed cycle: green for BASE_GREEN x the density
+    multiplier, then yellow, walk and clearance every cycle."""
+    def __init__(self):
+        self.phase   = "green"
+        self.started = None
+        self.green   = BASE_GREEN
+
+    def update(self, analysis, sensor_counts, now, sensor_rates=None):
+        if self.started is None:
+            self.started = now
+        length = {"green": self.green, "yellow": YELLOW, "walk": MIN_WALK,
+                  "clearance": PED_CLEARANCE}[self.phase]
+        if now - self.started >= length:
+            order = ("green", "yellow", "walk", "clearance")
+            self.phase   = order[(order.index(self.phase) + 1) % len(order)]
+            self.started = now
+            if self.phase == "green":
+                self.green = BASE_GREEN * MULTIPLIER.get(analysis.traffic_density or "medium", 1.0)
+        return {"light_state": LIGHT[self.phase], "walk_sign": self.phase == "walk"}
+
+
+CONTROLLERS = {"fixed": FixedMultiplierController, "adaptive": TrafficSignalController}
+
+
+# ── Arrivals ─────────────────────────────────────────────────────────────────
+def hourly_rate(t, base, peak):
+    """Arrivals per second at time t: a base rate plus 08:00 and 17:30 peaks."""
+    h = (t % DAY) / 3600
+    bump = math.exp(-((h - 8.0) / 1.2) ** 2) + math.exp(-((h - 17.5) / 1.5) ** 2)
+    return (base + (peak - base) * min(1.0, bump)) / 3600
+
+
+def arrivals(rng, base, peak, end):
+    """Arrival times of a non-homogeneous Poisson stream (by thinning)."""
+    top, t = peak / 3600, 0.0
+    while True:
+        t += rng.expovariate(top) if top > 0 else end
+        if t >= end:
+            return
+        if rng.random() * top < hourly_rate(t, base, peak):
+            yield t
+
+
+# ── Simulation ───────────────────────────────────────────────────────────────
+class Simulation:
+    def __init__(self, controller, days=1.0, seed=0, veh=(VEH_BASE, VEH_PEAK),
+                 ped=(PED_BASE, PED_PEAK), emergencies=EMERGENCIES):
+        self.controller = controller
+        self.end    = days * DAY
+        self.rng    = random.Random(seed)
+        self.events = []
+        self.seq    = 0
+        self.signal = {"light_state": "green", "walk_sign": False}
+        self.queue, self.waiting = deque(), deque()     # arrival times
+        self.crossing = deque()                         # times pedestrians stepped out
+        self.ems_seen, self.ems_waiting = 0, deque()
+        self.now      = 0.0
+        self.sensors  = SensorReader()
+        self.sensors.clock, self.sensors.started_at = (lambda: self.now), 0.0
+        self.depart_pending, self.last_depart = False, -SAT_HEADWAY
+        self.analysis = Analysis()
+        self.veh_delay, self.ped_wait, self.ems_delay = [], [], []
+        self.ped_over_max = 0
+        self.ems_spans    = []                          # (seen, preemption over) per emergency
+        self.served = Counter()                         # vehicles per hour of simulation
+        streams = {
+            "veh": arrivals(random.Random(seed * 3 + 1), *veh, self.end),
+            "ped": arrivals(random.Random(seed * 3 + 2), *ped, self.end),
+            "ems": arrivals(random.Random(seed * 3 + 3), emergencies / 24, emergencies / 24, self.end),
+        }
+        for kind, stream in streams.items():
+            self._next(kind, stream)
+        self._push(0.0, "tick")
+        self._push(0.0, "camera", True)
+
+    def _push(self, t, kind, data=None):
+        self.seq += 1
+        heapq.heappush(self.events, (t, self.seq, kind, data))
+
+    def _next(self, kind, stream):
+        t = next(stream, None)
+        if t is not None:
+            self._push(t, kind, stream)
+
+    # ── Events ───────────────────────────────────────────────────────────────
+    def _green(self):
+        return self.signal["light_state"] == "green"
+
+    def _schedule_departure(self, t):
+        if self._green() and self.queue and not self.depart_pending:
+            self.depart_pending = True
+            self._push(max(t, self.last_depart + SAT_HEADWAY), "depart")
+
+    def on_veh(self, t, stream):
+        self.queue.append(t)
+        self.sensors.record("lane1" if self.rng.random() < 0.5 else "lane2", t=t)
+        self._schedule_departure(t)
+        self._next("veh", stream)
+
+    def on_depart(self, t, _):
+        self.depart_pending = False
+        if self._green() and self.queue:
+            self.veh_delay.append(t - self.queue.popleft())
+            self.served[int(t // 3600)] += 1
+            self.last_depart = t
+        self._schedule_departure(t)
+
+    def on_ped(self, t, stream):
+        if self.signal["walk_sign"]:
+            self.ped_wait.append(0.0)
+            self.crossing.append(t)
+        else:
+            self.waiting.append(t)
+        self._next("ped", stream)
+
+    def _ped_served(self, arrived, t):
+        self.ped_wait.append(t - arrived)
+        self.crossing.append(t)
+        if t - arrived > MAX_PED_WAIT and not any(s < t and e > arrived for s, e in self.ems_spans):
+            self.ped_over_max += 1
+
+    def on_ems(self, t, stream):
+        self.ems_seen += 1
+        self._push(t + EMS_APPROACH, "ems_stop")
+        self._push(t, "camera", False)          # an emergency is reported at once
+        self._next("ems", stream)
+
+    def on_ems_stop(self, t, _):
+        self.ems_waiting.append(t)
+        self._pass_emergencies(t)
+
+    def _pass_emergencies(self, t):
+        while self._green() and self.ems_waiting:
+            stopped = self.ems_waiting.popleft()
+            self.ems_delay.append(t - stopped)
+            # Preemption runs from the sighting to EMERGENCY_HOLD after it passes, then recovery
+            self.ems_spans.append((stopped - EMS_APPROACH,
+                                   t + EMERGENCY_HOLD + RECOVERY_GREEN + YELLOW))
+            self.ems_seen -= 1
+            self._push(t, "camera", False)
+
+    def on_tick(self, t, _):
+        self.signal = self.controller.update(self.analysis, self.sensors.get_counts(), now=t,
+                                             sensor_rates=self.sensors.get_rates(WINDOW))
+        if self.signal["walk_sign"]:
+            while self.waiting:
+                self._ped_served(self.waiting.popleft(), t)
+        self._schedule_departure(t)
+        self._pass_emergencies(t)
+        if t + TICK < self.end:
+            self._push(t + TICK, "tick")
+
+    def on_camera(self, t, periodic):
+        while self.crossing and t - self.crossing[0] > CROSS_TIME:
+            self.crossing.popleft()
+        n = min(len(self.queue), CAMERA_CAP)
+        self.analysis = Analysis(
+            vehicles=[Detection("vehicles", type="car")] * n,
+            emergency_vehicles=[Detection("emergency_vehicles", type="ambulance")] * self.ems_seen,
+            pedestrians=[Detection("pedestrians")] * len(self.waiting) +
+                        [Detection("pedestrians", crossing=True)] * len(self.crossing),
+            traffic_density=density_from_count(n),
+            emergency_priority=self.ems_seen > 0)
+        if periodic and t + ANALYSIS_EVERY < self.end:
+            self._push(t + ANALYSIS_EVERY, "camera", True)
+
+    def run(self):
+        started = time.perf_counter()
+        handlers = {kind: getattr(self, f"on_{kind}") for kind in
+                    ("veh", "depart", "ped", "ems", "ems_stop", "tick", "camera")}
+        while self.events:
+            t, _, kind, data = heapq.heappop(self.events)
+            self.now = t
+            handlers[kind](t, data)
+        return self.report(time.perf_counter() - started)
+
+    def report(self, wall):
+        def mean(xs):
+            return sum(xs) / len(xs) if xs else None
+
+        def pct(xs, q):
+            return sorted(xs)[int(q * (len(xs) - 1))] if xs else None
+
+        hours = self.end / 3600
+        return {
+            "vehicles":          len(self.veh_delay),
+            "veh_delay_mean_s":  mean(self.veh_delay),
+            "veh_delay_p95_s":   pct(self.veh_delay, 0.95),
+            "throughput_per_h":  len(self.veh_delay) / hours,
+            "peak_hour_veh":     max(self.served.values(), default=0),
+            "left_queued":       len(self.queue),
+            "pedestrians":       len(self.ped_wait),
+            "ped_wait_mean_s":   mean(self.ped_wait),
+            "ped_wait_max_s":    max(self.ped_wait, default=None),
+            "ped_over_max":      self.ped_over_max,
+            "emergencies":       len(self.ems_delay),
+            "ems_delay_mean_s":  mean(self.ems_delay),
+            "ems_delay_max_s":   max(self.ems_delay, default=None),
+            "wall_s":            wall,
+        }
+
+
+def compare(days=1.0, seed=0, **scenario):
+    """Same arrivals through every controller."""
+    return {name: Simulation(make(), days, seed, **scenario).run()
+            for name, make in CONTROLLERS.items()}
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--days", type=float, default=1.0)
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--veh-peak", type=int, default=VEH_PEAK, help="vehicles / hour at the peaks")
+    ap.add_argument("--ped-peak", type=int, default=PED_PEAK, help="pedestrians / hour at the peaks")
+    ap.add_argument("--emergencies", type=float, default=EMERGENCIES, help="per day")
+    ap.add_argument("--out", help="write the results as JSON")
+    args = ap.parse_args(argv)
+
+    results = compare(args.days, args.seed, veh=(VEH_BASE, args.veh_peak),
+                      ped=(PED_BASE, args.ped_peak), emergencies=args.emergencies)
+    names = list(results)
+    print(f"{args.days:g} day(s), seed {args.seed}")
+    print(f"{'':<20}" + "".join(f"{name:>12}" for name in names))
+    for key in results[names[0]]:
+        cells = "".join(f"{'-' if results[n][key] is None else format(results[n][key], '.1f'):>12}"
+                        for n in names)
+        print(f"{key:<20}{cells}")
+    if args.out:
+        with open(args.out, "w") as f:
+            json.dump({"days": args.days, "seed": args.seed, "results": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
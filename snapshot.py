@@ -0,0 +1,111 @@
+"""Single-writer shared-memory snapshot of the engine's latest state.
+
+engine.py publishes with SnapshotWriter.publish(); every dashboard reads with
+SnapshotReader.read() — no locks, sockets or per-viewer work in the engine.
+It is a seqlock: the writer makes the sequence number odd while it writes
+and even again when done, and a reader retries if the number moved while it
+was copying.
+
+Layout: seq (u64) | meta, frame and map lengths (3 x u32) | meta JSON | frame JPEG | map PNG
+"""
+import json
+import os
+import struct
+import time
+from multiprocessing import shared_memory
+
+NAME = os.getenv("TRAFFIC_SNAPSHOT", "traffic_engine")
+SIZE = 4 * 1024 * 1024
+
+_SEQ     = struct.Struct("<Q")
+_LENGTHS = struct.Struct("<III")
+_DATA    = _SEQ.size + _LENGTHS.size
+
+
+def _to_dict(obj):
+    if hasattr(obj, "to_dict"):         # Analysis
+        return obj.to_dict()
+    raise TypeError(f"{type(obj).__name__} is not JSON serializable")
+
+
+class SnapshotWriter:
+    def __init__(self, name=NAME, size=SIZE):
+        try:
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        except FileExistsError:
+            # Left behind by an engine that did not shut down cleanly
+            stale = shared_memory.SharedMemory(name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name, create=True, size=size)
+        self.seq = 0
+        _SEQ.pack_into(self.shm.buf, 0, 0)
+
+    def publish(self, meta, frame=b"", map_png=b""):
+        body = json.dumps(meta, separators=(",", ":"), default=_to_dict).encode()
+        if _DATA + len(body) + len(frame) + len(map_png) > self.shm.size:
+            frame = b""                 # drop the preview rather than the state
+        if _DATA + len(body) + len(map_png) > self.shm.size:
+            raise ValueError("snapshot does not fit in shared memory")
+        buf = self.shm.buf
+        self.seq += 1
+        _SEQ.pack_into(buf, 0, self.seq)            # odd — write in progress
+        off = _DATA
+        for part in (body, frame, map_png):
+            buf[off:off + len(part)] = part
+            off += len(part)
+        _LENGTHS.pack_into(buf, _SEQ.size, len(body), len(frame), len(map_png))
+        self.seq += 1
+        _SEQ.pack_into(buf, 0, self.seq)            # even — consistent again
+
+    def close(self):
+        self.shm.close()
+        self.shm.unlink()
+
+
+def _attach(name):
+    try:
+        return shared_memory.SharedMemory(name, track=False)     # Python 3.13+
+    except TypeError:
+        # Older versions register every attach with the resource tracker, which
+        # unlinks it at exit — a reader must never remove the engine's segment
+        from multiprocessing import resource_tracker
+        register, resource_tracker.register = resource_tracker.register, lambda *args: None
+        try:
+            return shared_memory.SharedMemory(name)
+        finally:
+            resource_tracker.register = register
+
+
+class SnapshotReader:
+    def __init__(self, name=NAME):
+        self.shm = _attach(name)
+
+    def read(self, retries=100):
+        """Latest snapshot as the published meta dict plus "frame" and "map"
+        bytes, or None if nothing has been published yet."""
+        buf = self.shm.buf
+        for _ in range(retries):
+            seq = _SEQ.unpack_from(buf, 0)[0]
+            if seq == 0:
+                return None
+            if seq & 1:
+                time.sleep(0.0005)
+                continue
+            n_meta, n_frame, n_map = _LENGTHS.unpack_from(buf, _SEQ.size)
+            data = bytes(buf[_DATA:_DATA + n_meta + n_frame + n_map])
+            if _SEQ.unpack_from(buf, 0)[0] != seq:
+                continue                # overwritten while copying
+            snap = json.loads(data[:n_meta])
+            snap["frame"] = data[n_meta:n_meta + n_frame]
+            snap["map"]   = data[n_meta + n_frame:]
+            return snap
+        return None
+
+
+def attach(name=NAME):
+    """Reader for a running engine's snapshot, or None if there is none."""
+    try:
+        return SnapshotReader(name)
+    except FileNotFoundError:
+        return None
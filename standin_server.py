@@ -0,0 +1,398 @@
+"""Local stand-in for the Gemini and ElevenLabs APIs, for load and failure testing.
+
+    python standin_server.py --port 8765 --rpm 10 --rpd 50 --latency lognormal:1.2,0.4
+    GEMINI_BASE_URL=http://127.0.0.1:8765 ELEVENLABS_BASE_URL=http://127.0.0.1:8765 python engine.py ...
+
+Speaks enough of both APIs for gemini_analyzer.py and voice_alerts.py:
+    POST /v1beta/models/<model>:generateContent
+    POST /v1beta/models/<model>:streamGenerateContent?alt=sse
+    POST /v1/text-to-speech/<voice_id>[/stream]
+Quota is per API key, as on the real services: a sliding-minute limit
+answered with 429 RESOURCE_EXHAUSTED and a retryDelay, and a daily limit
+answered with the PerDay quota violation until the day rolls over (the day
+can be shortened with --day-seconds). Latency comes from a scripted
+distribution; response bodies are canned analyses — generated, or taken
+from a JSON / JSON-lines file or an event log directory (event_log.py).
+
+GET /standin/stats reports what was served; POST /standin/reset clears the
+quotas and counters. load_test.py drives it with concurrent sessions.
+"""
+import argparse
+import json
+import math
+import os
+import random
+import re
+import threading
+import time
+from collections import Counter, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+PORT        = 8765
+FIRST_CHUNK = 0.3          # share of the latency before the first streamed chunk
+CHUNK_CHARS = 64           # streamed response text per SSE event
+PROMPT_ORDER = ("emergency_priority", "emergency_vehicles", "pedestrians", "traffic_density",
+                "vehicles", "hands", "recommended_action")
+
+_GEMINI = re.compile(r"^/v1(?:beta|alpha)?/models/([^/:]+):(generateContent|streamGenerateContent)$")
+_TTS    = re.compile(r"^/v1/text-to-speech/([^/]+)(/stream)?$")
+
+# One silent MPEG-1 Layer III frame (128 kbit/s, 44.1 kHz, ~26 ms)
+_SILENT_FRAME = b"\xff\xfb\x90\x64" + bytes(413)
+
+
+# ── Scripted behaviour ───────────────────────────────────────────────────────
+class Latency:
+    """fixed:S | uniform:A,B | normal:MEAN,SD | lognormal:MEDIAN,SIGMA (seconds)."""
+    def __init__(self, spec):
+        self.spec = spec
+        kind, _, params = spec.partition(":")
+        self.kind   = kind
+        self.params = [float(p) for p in params.split(",") if p]
+        if kind not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"unknown latency distribution: {spec}")
+
+    def draw(self, rng):
+        p = self.params
+        if self.kind == "fixed":
+            return p[0]
+        if self.kind == "uniform":
+            return rng.uniform(p[0], p[1])
+        if self.kind == "normal":
+            return max(0.0, rng.gauss(p[0], p[1]))
+        return p[0] * math.exp(rng.gauss(0.0, p[1]))
+
+
+def random_analysis(rng, emergency_rate=0.0):
+    """A plausible analysis dict, in the order the prompt asks for."""
+    n_cars, n_peds = rng.randint(0, 12), rng.randint(0, 4)
+    box = lambda: (rng.randint(0, 800), rng.randint(0, 800))
+    vehicles = []
+    for _ in range(n_cars):
+        y, x = box()
+        vehicles.append({"type": rng.choice(["car", "car", "truck", "bus"]),
+                         "box_2d": [y, x, y + rng.randint(40, 200), x + rng.randint(60, 200)]})
+    pedestrians = []
+    for _ in range(n_peds):
+        y, x = box()
+        pedestrians.append({"box_2d": [y, x, y + 150, x + 50], "crossing": rng.random() > 0.5})
+    emergency = []
+    if emergency_rate and rng.random() < emergency_rate:
+        y, x = box()
+        emergency.append({"type": rng.choice(["ambulance", "police"]),
+                          "box_2d": [y, x, y + 150, x + 200]})
+    return {"emergency_priority": bool(emergency), "emergency_vehicles": emergency,
+            "pedestrians": pedestrians,
+            "traffic_density": ["low", "medium", "high"][min(2, n_cars // 4)],
+            "vehicles": vehicles, "hands": [], "recommended_action": "stand-in"}
+
+
+def load_payloads(path):
+    """Canned analyses from a JSON list / object, a JSON-lines file or an event log."""
+    if os.path.isdir(path):
+        from event_log import LogReader
+        log = LogReader(path)
+        payloads = [value for _, _, value in log.range(kinds=("analysis",))]
+        log.close()
+    else:
+        with open(path) as f:
+            text = f.read()
+        try:
+            payloads = json.loads(text)
+        except json.JSONDecodeError:
+            payloads = [json.loads(line) for line in text.splitlines() if line.strip()]
+        if isinstance(payloads, dict):
+            payloads = [payloads]
+    if not payloads:
+        raise ValueError(f"no analyses in {path}")
+    # Priority fields first, as the real model is asked to stream them
+    return [{k: p[k] for k in sorted(p, key=lambda k: PROMPT_ORDER.index(k)
+                                     if k in PROMPT_ORDER else len(PROMPT_ORDER))}
+            for p in payloads]
+
+
+class Scenario:
+    def __init__(self, latency="lognormal:1.2,0.35", tts_latency="lognormal:0.4,0.3",
+                 rpm=10, rpd=250, day_seconds=86_400, error_rate=0.0, emergency_rate=0.05,
+                 payloads=None, tts_rpm=100, tts_concurrency=2, seed=0):
+        self.latency         = Latency(latency)
+        self.tts_latency     = Latency(tts_latency)
+        self.rpm             = rpm
+        self.rpd             = rpd
+        self.day_seconds     = day_seconds
+        self.error_rate      = error_rate
+        self.emergency_rate  = emergency_rate
+        self.payloads        = load_payloads(payloads) if payloads else None
+        self.tts_rpm         = tts_rpm
+        self.tts_concurrency = tts_concurrency
+        self.seed            = seed
+
+    @staticmethod
+    def add_arguments(ap):
+        ap.add_argument("--latency", default="lognormal:1.2,0.35",
+                        help="Gemini latency: fixed:S, uniform:A,B, normal:MEAN,SD or lognormal:MEDIAN,SIGMA")
+        ap.add_argument("--tts-latency", default="lognormal:0.4,0.3")
+        ap.add_argument("--rpm", type=int, default=10, help="Gemini requests / minute per key")
+        ap.add_argument("--rpd", type=int, default=250, help="Gemini requests / day per key")
+        ap.add_argument("--day-seconds", type=float, default=86_400,
+                        help="length of a quota day (shorten to test exhaustion and reset)")
+        ap.add_argument("--error-rate", type=float, default=0.0, help="share of 503 UNAVAILABLE answers")
+        ap.add_argument("--emergency-rate", type=float, default=0.05,
+                        help="share of generated analyses with an emergency vehicle")
+        ap.add_argument("--payloads", help="canned analyses: JSON / JSON-lines file or event log directory")
+        ap.add_argument("--tts-rpm", type=int, default=100, help="ElevenLabs requests / minute per key")
+        ap.add_argument("--tts-concurrency", type=int, default=2, help="concurrent ElevenLabs requests per key")
+        ap.add_argument("--seed", type=int, default=0)
+
+    @classmethod
+    def from_args(cls, args):
+        return cls(latency=args.latency, tts_latency=args.tts_latency, rpm=args.rpm, rpd=args.rpd,
+                   day_seconds=args.day_seconds, error_rate=args.error_rate,
+                   emergency_rate=args.emergency_rate, payloads=args.payloads,
+                   tts_rpm=args.tts_rpm, tts_concurrency=args.tts_concurrency, seed=args.seed)
+
+
+class Quota:
+    """Per-key sliding-minute and daily request limits."""
+    def __init__(self, per_minute, per_day=None, day_seconds=86_400):
+        self.per_minute  = per_minute
+        self.per_day     = per_day
+        self.day_seconds = day_seconds
+        self._minute = {}               # key -> deque of request times
+        self._day    = {}               # key -> (day number, requests)
+        self._lock   = threading.Lock()
+
+    def check(self, key, now):
+        """None if the request may go ahead (and counts it), otherwise
+        ("minute" | "day", seconds until it would be accepted)."""
+        with self._lock:
+            day = int(now // self.day_seconds)
+            if self.per_day is not None:
+                d, used = self._day.get(key, (day, 0))
+                if d != day:
+                    used = 0
+                if used >= self.per_day:
+                    return "day", (day + 1) * self.day_seconds - now
+            window = self._minute.setdefault(key, deque())
+            while window and now - window[0] >= 60.0:
+                window.popleft()
+            if len(window) >= self.per_minute:
+                return "minute", 60.0 - (now - window[0])
+            window.append(now)
+            if self.per_day is not None:
+                self._day[key] = (day, used + 1)
+            return None
+
+
+# ── Server ───────────────────────────────────────────────────────────────────
+class StandIn:
+    def __init__(self, scenario):
+        self.scenario = scenario
+        self.rng      = random.Random(scenario.seed)
+        self.started  = time.time()
+        self.reset()
+
+    def reset(self):
+        s = self.scenario
+        self.gemini_quota = Quota(s.rpm, s.rpd, s.day_seconds)
+        self.tts_quota    = Quota(s.tts_rpm)
+        self.tts_active   = Counter()
+        self.counts       = Counter()   # (service, outcome)
+        self.by_key       = {}          # key -> Counter of outcomes
+        self._lock        = threading.Lock()
+
+    def count(self, service, outcome, key):
+        with self._lock:
+            self.counts[f"{service}_{outcome}"] += 1
+            self.by_key.setdefault(key[-6:], Counter())[f"{service}_{outcome}"] += 1
+
+    def stats(self):
+        with self._lock:
+            return {"uptime_s": time.time() - self.started, "counts": dict(self.counts),
+                    "by_key": {k: dict(v) for k, v in self.by_key.items()}}
+
+    def analysis_text(self):
+        s = self.scenario
+        payload = (self.rng.choice(s.payloads) if s.payloads
+                   else random_analysis(self.rng, s.emergency_rate))
+        return json.dumps(payload)
+
+
+def _quota_error(which, retry, model, limit):
+    """429 body shaped like the Generative Language API's."""
+    period = "PerDay" if which == "day" else "PerMinute"
+    return 429, {"error": {
+        "code": 429, "status": "RESOURCE_EXHAUSTED",
+        "message": f"You exceeded your current quota, please check your plan and billing details. "
+                   f"Please retry in {retry:.1f}s.",
+        "details": [
+            {"@type": "type.googleapis.com/google.rpc.QuotaFailure",
+             "violations": [{"quotaMetric": "generativelanguage.googleapis.com/generate_content_free_tier_requests",
+                             "quotaId": f"GenerateRequests{period}PerProjectPerModel-FreeTier",
+                             "quotaDimensions": {"location": "global", "model": model},
+                             "quotaValue": str(limit)}]},
+            {"@type": "type.googleapis.com/google.rpc.RetryInfo", "retryDelay": f"{max(1, int(retry))}s"},
+        ]}}
+
+
+def _candidate(text, done):
+    out = {"content": {"parts": [{"text": text}], "role": "model"}, "index": 0}
+    if done:
+        out["finishReason"] = "STOP"
+    return out
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    verbose = False
+
+    def log_message(self, fmt, *args):
+        if self.verbose:
+            super().log_message(fmt, *args)
+
+    def handle(self):
+        try:
+            super().handle()
+        except (BrokenPipeError, ConnectionResetError):
+            pass                # the client hung up mid-response (a load_test session ending)
+
+    def _send_json(self, status, body):
+        data = json.dumps(body).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            return json.loads(raw) if raw else {}
+        except json.JSONDecodeError:
+            return {}
+
+    def do_GET(self):
+        if self.path.startswith("/standin/stats"):
+            self._send_json(200, self.server.standin.stats())
+        else:
+            self._send_json(404, {"error": {"code": 404, "message": "not found", "status": "NOT_FOUND"}})
+
+    def do_POST(self):
+        path = self.path.split("?", 1)[0]
+        if path == "/standin/reset":
+            self._body()
+            self.server.standin.reset()
+            return self._send_json(200, {"ok": True})
+        match = _GEMINI.match(path)
+        if match:
+            return self._gemini(match.group(1), match.group(2) == "streamGenerateContent")
+        match = _TTS.match(path)
+        if match:
+            return self._tts()
+        self._body()
+        self._send_json(404, {"error": {"code": 404, "message": f"no stand-in for {path}", "status": "NOT_FOUND"}})
+
+    # ── Gemini ───────────────────────────────────────────────────────────────
+    def _gemini(self, model, stream):
+        standin, s = self.server.standin, self.server.standin.scenario
+        self._body()
+        key = self.headers.get("x-goog-api-key") or "anonymous"
+        limited = standin.gemini_quota.check(key, time.time())
+        if limited:
+            which, retry = limited
+            standin.count("gemini", "daily_exhausted" if which == "day" else "rate_limited", key)
+            return self._send_json(*_quota_error(which, retry, model, s.rpd if which == "day" else s.rpm))
+        latency = s.latency.draw(standin.rng)
+        if standin.rng.random() < s.error_rate:
+            time.sleep(latency)
+            standin.count("gemini", "unavailable", key)
+            return self._send_json(503, {"error": {"code": 503, "status": "UNAVAILABLE",
+                                                   "message": "The model is overloaded. Please try again later."}})
+        text = standin.analysis_text()
+        usage = {"promptTokenCount": 1290, "candidatesTokenCount": len(text) // 4,
+                 "totalTokenCount": 1290 + len(text) // 4}
+        if not stream:
+            time.sleep(latency)
+            standin.count("gemini", "ok", key)
+            return self._send_json(200, {"candidates": [_candidate(text, True)],
+                                         "usageMetadata": usage, "modelVersion": model})
+        # Server-sent events, one partial response per chunk of text
+        chunks = [text[i:i + CHUNK_CHARS] for i in range(0, len(text), CHUNK_CHARS)]
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        time.sleep(latency * FIRST_CHUNK)
+        for i, chunk in enumerate(chunks):
+            if i:
+                time.sleep(latency * (1 - FIRST_CHUNK) / max(1, len(chunks) - 1))
+            event = {"candidates": [_candidate(chunk, i == len(chunks) - 1)], "modelVersion": model}
+            if i == len(chunks) - 1:
+                event["usageMetadata"] = usage
+            self.wfile.write(b"data: " + json.dumps(event).encode() + b"\r\n\r\n")
+            self.wfile.flush()
+        self.close_connection = True
+        standin.count("gemini", "ok_stream", key)
+
+    # ── ElevenLabs ───────────────────────────────────────────────────────────
+    def _tts(self):
+        standin, s = self.server.standin, self.server.standin.scenario
+        text = str(self._body().get("text", ""))
+        key = self.headers.get("xi-api-key") or "anonymous"
+        with standin._lock:
+            busy = standin.tts_active[key] >= s.tts_concurrency
+            if not busy:
+                standin.tts_active[key] += 1
+        if busy:
+            standin.count("tts", "too_many_concurrent", key)
+            return self._send_json(429, {"detail": {"status": "too_many_concurrent_requests",
+                                                    "message": "Too many concurrent requests for this plan."}})
+        try:
+            if standin.tts_quota.check(key, time.time()):
+                standin.count("tts", "rate_limited", key)
+                return self._send_json(429, {"detail": {"status": "rate_limit_exceeded",
+                                                        "message": "Rate limit exceeded."}})
+            time.sleep(s.tts_latency.draw(standin.rng))
+            audio = _SILENT_FRAME * max(1, len(text) // 3)     # ~ speaking time
+            self.send_response(200)
+            self.send_header("Content-Type", "audio/mpeg")
+            self.send_header("Content-Length", str(len(audio)))
+            self.end_headers()
+            self.wfile.write(audio)
+            standin.count("tts", "ok", key)
+        finally:
+            with standin._lock:
+                standin.tts_active[key] -= 1
+
+
+def start(scenario, host="127.0.0.1", port=PORT, verbose=False):
+    """Serve `scenario` on a background thread; returns the server (see .url)."""
+    handler = type("Handler", (_Handler,), {"verbose": verbose})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    server.standin = StandIn(scenario)
+    server.url = f"http://{host}:{server.server_address[1]}"
+    threading.Thread(target=server.serve_forever, daemon=True, name="standin-server").start()
+    return server
+
+
+def main(argv=None):
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=PORT)
+    ap.add_argument("--verbose", action="store_true", help="log every request")
+    Scenario.add_arguments(ap)
+    args = ap.parse_args(argv)
+
+    server = start(Scenario.from_args(args), args.host, args.port, args.verbose)
+    print(f"stand-in serving on {server.url} — GEMINI_BASE_URL / ELEVENLABS_BASE_URL={server.url}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,58 @@
+"""Process-wide shared state.
+
+Streamlit re-executes app.py on every rerun, but imported modules are only
+loaded once, so anything stored here survives reruns and is shared between
+the WebRTC video thread and the dashboard script.
+"""
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from scene_gate import SceneGate
+from tracker import BoxTracker
+from overlay import OverlayCache
+from scheduler import QuotaScheduler
+from encoder import PayloadEncoder
+from frame_mailbox import FrameMailbox
+from analysis_model import EMPTY
+
+lock     = threading.Lock()
+executor = ThreadPoolExecutor(max_workers=1)
+
+# ── Latest Gemini result ──────────────────────────────────────────────────────
+last_analysis    = EMPTY   # Analysis — immutable, share without copying
+analysis_version = 0
+analysis_at      = 0.0     # time.time() it landed
+
+# ── API call bookkeeping ─────────────────────────────────────────────────────
+api_calls_made    = 0
+next_allowed_call = 0.0     # earliest next look at the scene (spacing, backoff)
+analyzing         = False   # an analyze_latest job is queued or running
+scheduler         = QuotaScheduler()
+priority_pending  = False   # set on a PIR edge — next call may use the reserve
+use_mock          = False
+use_streaming     = True    # stream Gemini responses, act on emergency fields early
+wake              = threading.Event()   # run the engine's controller now (emergency)
+encoder           = PayloadEncoder.from_env()   # ROI crop + byte budget, logs bytes / RTT
+
+# ── Scene-change gate ────────────────────────────────────────────────────────
+gate        = SceneGate()
+gate_hits   = 0    # frames answered from the cached analysis
+gate_misses = 0    # frames that changed enough to spend an API call
+
+# ── Local (CPU) detector ─────────────────────────────────────────────────────
+use_local_detector = False
+local_detector     = None   # created on first enable — MOG2 needs warm-up frames
+local_analysis     = EMPTY
+
+# ── Overlay tracker (video thread only) ──────────────────────────────────────
+overlay    = OverlayCache()  # last analysis + its geometry, per analysis_version
+tracker    = BoxTracker()
+tracked    = EMPTY           # latest tracked boxes (with track_id / dwell / speed)
+tracked_at = 0.0
+
+camera_active = False
+mailbox       = FrameMailbox()   # newest camera frame, for the analysis worker
+
+# ── Engine (one per process, see engine.py) ──────────────────────────────────
+engine   = None    # embedded Engine, when no engine.py process is running
+reader   = None    # SnapshotReader attached to a running engine.py
+recorder = None    # event_log.EventLog when recording (engine.py --record)
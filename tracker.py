@@ -0,0 +1,247 @@
+"""Lightweight multi-object tracker for the video overlay.
+
+Detections (Gemini analyses, or the local detector) seed tracks via greedy IoU
+association. Between detections each track is moved by the median sparse
+optical flow (Lucas-Kanade) of a few points inside its box, and every box
+coordinate is smoothed by a constant-velocity Kalman filter. Boxes stay in
+the analysis' normalized 0-1000 [y_min, x_min, y_max, x_max] space.
+"""
+import itertools
+import cv2
+import numpy as np
+import overlay
+
+_PROC_WIDTH = 320            # optical flow runs on a downscaled grey frame
+_GRID       = 3              # flow points per box: _GRID x _GRID
+_LK_PARAMS  = dict(winSize=(15, 15), maxLevel=2,
+                   criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 10, 0.03))
+
+# Kalman noise (normalized box units)
+_Q_ACCEL   = 400.0           # process noise — how hard boxes may accelerate
+_R_DETECT  = 25.0            # detection measurement variance
+_R_FLOW    = 4.0             # optical-flow measurement variance (flow is precise)
+_P_INIT    = 1e4
+
+_KINDS = ("vehicles", "emergency_vehicles", "pedestrians")
+
+
+def _iou_matrix(a, b):
+    """IoU between every row of a (N,4) and b (M,4) box arrays."""
+    y1 = np.maximum(a[:, None, 0], b[None, :, 0])
+    x1 = np.maximum(a[:, None, 1], b[None, :, 1])
+    y2 = np.minimum(a[:, None, 2], b[None, :, 2])
+    x2 = np.minimum(a[:, None, 3], b[None, :, 3])
+    inter  = np.clip(y2 - y1, 0, None) * np.clip(x2 - x1, 0, None)
+    area_a = (a[:, 2] - a[:, 0]) * (a[:, 3] - a[:, 1])
+    area_b = (b[:, 2] - b[:, 0]) * (b[:, 3] - b[:, 1])
+    union  = area_a[:, None] + area_b[None, :] - inter
+    return np.where(union > 0, inter / np.maximum(union, 1e-9), 0.0)
+
+
+class BoxTracker:
+    def __init__(self, iou_threshold=0.2, max_flow_lost=30, max_local_misses=5):
+        self.iou_threshold    = iou_threshold
+        self.max_flow_lost    = max_flow_lost
+        self.max_local_misses = max_local_misses
+        self._ids   = itertools.count(1)
+        self._prev  = None          # previous downscaled grey frame
+        self._time  = None
+        # Per-track arrays (N = number of live tracks)
+        self.pos    = np.zeros((0, 4))          # filtered box
+        self.vel    = np.zeros((0, 4))          # box units / second
+        self.p00    = np.zeros((0, 4))          # covariance terms per coordinate
+        self.p01    = np.zeros((0, 4))
+        self.p11    = np.zeros((0, 4))
+        self.meta   = []                        # dicts: id, kind, fields (Detection), source, ...
+        self._geom  = None                      # cached (styles, labels) for overlay
+
+    # ── Kalman ───────────────────────────────────────────────────────────────
+    def _predict(self, dt):
+        if dt <= 0 or not len(self.pos):
+            return
+        q = _Q_ACCEL
+        self.pos += self.vel * dt
+        self.p00 += dt * (2 * self.p01 + dt * self.p11) + q * dt ** 3 / 3
+        self.p01 += dt * self.p11 + q * dt ** 2 / 2
+        self.p11 += q * dt
+
+    def _correct(self, idx, z, r):
+        """Measurement update for rows `idx` with measured boxes z (K,4)."""
+        s  = self.p00[idx] + r
+        k0 = self.p00[idx] / s
+        k1 = self.p01[idx] / s
+        innov = z - self.pos[idx]
+        self.pos[idx] += k0 * innov
+        self.vel[idx] += k1 * innov
+        p00, p01, p11 = self.p00[idx], self.p01[idx], self.p11[idx]
+        self.p00[idx] = (1 - k0) * p00
+        self.p01[idx] = (1 - k0) * p01
+        self.p11[idx] = p11 - k1 * p01
+
+    def _keep(self, mask):
+        mask = np.asarray(mask, dtype=bool)
+        for name in ("pos", "vel", "p00", "p01", "p11"):
+            setattr(self, name, getattr(self, name)[mask])
+        self.meta = [m for m, k in zip(self.meta, mask) if k]
+        self._geom = None
+
+    @staticmethod
+    def _restyle(meta):
+        meta["style"] = overlay.style_of(meta["kind"], meta["fields"])
+        meta["label"] = overlay.label_of(meta["kind"], meta["fields"], meta["id"])
+
+    # ── Detections ───────────────────────────────────────────────────────────
+    def seed(self, analysis, now, source="gemini"):
+        """Associate a fresh analysis with existing tracks.
+
+        Gemini analyses are authoritative: its tracks that find no match are
+        dropped. Local-detector tracks are dropped after a few misses.
+        """
+        self._predict(now - self._time if self._time is not None else 0.0)
+        self._time = now
+
+        matched_tracks = set()
+        new_rows = []
+        for kind in _KINDS:
+            dets = [d for d in getattr(analysis, kind) if d.box]
+            if not dets:
+                continue
+            det_boxes = np.array([d.box for d in dets], dtype=float)
+            rows = [i for i, m in enumerate(self.meta) if m["kind"] == kind]
+            used = set()
+            if rows:
+                iou = _iou_matrix(self.pos[rows], det_boxes)
+                for flat in np.argsort(iou, axis=None)[::-1]:
+                    ti, di = divmod(int(flat), len(dets))
+                    if iou[ti, di] < self.iou_threshold:
+                        break
+                    if rows[ti] in matched_tracks or di in used:
+                        continue
+                    matched_tracks.add(rows[ti])
+                    used.add(di)
+                    self._correct([rows[ti]], det_boxes[di][None, :], _R_DETECT)
+                    meta = self.meta[rows[ti]]
+                    meta["misses"] = 0
+                    # Local boxes only move a Gemini track; they never relabel it
+                    if source == "gemini" or meta["source"] != "gemini":
+                        meta["fields"] = dets[di]
+                        meta["source"] = source
+                        self._restyle(meta)
+            for di, d in enumerate(dets):
+                if di not in used:
+                    new_rows.append((kind, d, det_boxes[di]))
+
+        keep = []
+        for i, m in enumerate(self.meta):
+            if i in matched_tracks:
+                keep.append(True)
+            elif m["source"] == source == "gemini":
+                keep.append(False)
+            elif m["source"] == source:
+                m["misses"] += 1
+                keep.append(m["misses"] <= self.max_local_misses)
+            else:
+                keep.append(True)
+        self._keep(keep)
+
+        if new_rows:
+            n = len(new_rows)
+            self.pos = np.vstack([self.pos, [b for _, _, b in new_rows]])
+            self.vel = np.vstack([self.vel, np.zeros((n, 4))])
+            self.p00 = np.vstack([self.p00, np.full((n, 4), _R_DETECT)])
+            self.p01 = np.vstack([self.p01, np.zeros((n, 4))])
+            self.p11 = np.vstack([self.p11, np.full((n, 4), _P_INIT)])
+            for kind, d, _ in new_rows:
+                meta = {
+                    "id": next(self._ids), "kind": kind, "source": source,
+                    "fields": d,
+                    "first_seen": now, "misses": 0, "flow_lost": 0,
+                }
+                self._restyle(meta)
+                self.meta.append(meta)
+        self._geom = None
+
+    # ── Per-frame update ─────────────────────────────────────────────────────
+    def step(self, img, now):
+        """Advance all tracks to `now` using optical flow on `img` (BGR)."""
+        grey = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        # Halve with pyrDown (smoothed, ~4x cheaper than INTER_AREA) down to
+        # under twice _PROC_WIDTH, then a linear resize for the rest
+        while grey.shape[1] >= 2 * _PROC_WIDTH:
+            grey = cv2.pyrDown(grey)
+        gh, gw = grey.shape
+        if gw > _PROC_WIDTH:
+            gh, gw = gh * _PROC_WIDTH // gw, _PROC_WIDTH
+            grey = cv2.resize(grey, (gw, gh), interpolation=cv2.INTER_LINEAR)
+
+        dt = now - self._time if self._time is not None else 0.0
+        self._time = now
+        prev, self._prev = self._prev, grey
+        if not len(self.pos):
+            return
+        start = self.pos.copy()
+        self._predict(dt)
+        if prev is None or prev.shape != grey.shape:
+            return
+
+        # Grid of points inside each (pre-prediction) box, in grey-pixel coords
+        n = len(start)
+        f = (np.arange(_GRID) + 0.5) / _GRID
+        ys = start[:, 0:1] + (start[:, 2:3] - start[:, 0:1]) * f        # (N,G)
+        xs = start[:, 1:2] + (start[:, 3:4] - start[:, 1:2]) * f
+        py = np.repeat(ys, _GRID, axis=1) * gh / 1000.0                  # (N,G*G)
+        px = np.tile(xs, (1, _GRID)) * gw / 1000.0
+        pts = np.stack([px, py], axis=-1).reshape(-1, 1, 2).astype(np.float32)
+
+        nxt, status, _ = cv2.calcOpticalFlowPyrLK(prev, grey, pts, None, **_LK_PARAMS)
+        flow = (nxt - pts).reshape(n, _GRID * _GRID, 2)
+        good = status.reshape(n, _GRID * _GRID).astype(bool)
+
+        # Median flow per track over its tracked points (one vectorized pass)
+        flow[~good] = np.nan
+        tracked = good.sum(axis=1) >= 3
+        for i, ok in enumerate(tracked.tolist()):
+            self.meta[i]["flow_lost"] = 0 if ok else self.meta[i]["flow_lost"] + 1
+        if tracked.any():
+            # nanmedian by hand: NaNs sort last, so the middle of the first
+            # `cnt` entries is the median (np.nanmedian detours via numpy.ma)
+            srt = np.sort(flow[tracked], axis=1)                        # (K,G*G,2)
+            cnt = good[tracked].sum(axis=1)
+            row = np.arange(len(cnt))
+            med = (srt[row, (cnt - 1) // 2] + srt[row, cnt // 2]) / 2   # (K,2) dx, dy
+            dx = med[:, 0:1] * 1000.0 / gw
+            dy = med[:, 1:2] * 1000.0 / gh
+            shift = np.hstack([dy, dx, dy, dx])
+            self._correct(np.flatnonzero(tracked), start[tracked] + shift, _R_FLOW)
+
+        inside = ((self.pos[:, 2] > 0) & (self.pos[:, 0] < 1000)
+                  & (self.pos[:, 3] > 0) & (self.pos[:, 1] < 1000))
+        alive = [m["flow_lost"] <= self.max_flow_lost for m in self.meta]
+        self._keep(inside & np.array(alive, dtype=bool))
+
+    # ── Output ───────────────────────────────────────────────────────────────
+    def as_analysis(self, base, now):
+        """`base` (an Analysis) with its box lists replaced by the tracked boxes.
+
+        Each detection keeps its fields and gains `track_id`, `dwell` (seconds
+        since first seen) and `speed` (box-centre units per second).
+        """
+        out = {kind: [] for kind in _KINDS}
+        boxes = np.clip(self.pos, 0, 1000).astype(int)
+        for m, box, vel in zip(self.meta, boxes, self.vel):
+            out[m["kind"]].append(m["fields"].replace(
+                box=box.tolist(), track_id=m["id"], dwell=now - m["first_seen"],
+                speed=float(np.hypot((vel[0] + vel[2]) / 2, (vel[1] + vel[3]) / 2))))
+        return base.replace(**out)
+
+    def geometry(self):
+        """(boxes, styles, labels) for overlay.draw. The style/label arrays are
+        rebuilt only when tracks are added, removed or relabelled."""
+        if self._geom is None:
+            self._geom = (np.array([m["style"] for m in self.meta], dtype=np.int8),
+                          [m["label"] for m in self.meta])
+        styles, labels = self._geom
+        return np.clip(self.pos, 0, 1000), styles, labels
+
+    def __len__(self):
+        return len(self.meta)
@@ -1,25 +1,265 @@
 import os
-from elevenlabs.client import ElevenLabs
-from elevenlabs import play
+import hashlib
+import threading
+import time
+from collections import OrderedDict, deque
+from contextlib import nullcontext
 from dotenv import load_dotenv
+import metrics
 
 load_dotenv()
-el_client = ElevenLabs(api_key=os.getenv("ELEVENLABS_API_KEY"))
 
-def generate_alert(event_type: str, details: str):
+VOICE_ID  = "pNInz6obpgDQGcFmaJgB"  # "Adam"
+MODEL_ID  = "eleven_turbo_v2_5"
+CACHE_DIR = os.getenv("TTS_CACHE_DIR", ".tts_cache")
+BASE_URL  = os.getenv("ELEVENLABS_BASE_URL")   # standin_server.py or a proxy
+MEMORY_ITEMS = 16          # recent dynamic announcements kept in memory (never on disk)
+
+# Fixed phrases — synthesized once, then always served from the disk cache
+PHRASES = {
+    "walk":                "Walk sign is on. You may cross now.",
+    "wait":                "Please wait. Vehicles are approaching.",
+    "pedestrians_on_road": "Pedestrians detected on the road.",
+    "do_not_cross":        "Do not cross. Emergency vehicle approaching.",
+}
+
+def alert_text(event_type: str, details: str = "") -> str:
+    if event_type in PHRASES:
+        return PHRASES[event_type]
     messages = {
         "emergency": f"Attention: {details}. All vehicles clear the intersection.",
         "pedestrian": f"Pedestrian crossing detected. {details}.",
         "status": f"Traffic status update: {details}."
     }
-    text = messages.get(event_type, details)
-    audio = el_client.text_to_speech.convert(
-        text=text,
-        voice_id="pNInz6obpgDQGcFmaJgB", # "Adam"
-        model_id="eleven_turbo_v2_5"
-    )
-    return audio
-
-def play_alert(event_type: str, details: str):
-    audio = generate_alert(event_type, details)
+    return messages.get(event_type, details)
+
+# ── TTS backends ─────────────────────────────────────────────────────────────
+class ElevenLabsBackend:
+    name = "elevenlabs"
+
+    def __init__(self, api_key=None, base_url=BASE_URL):
+        from elevenlabs.client import ElevenLabs
+        api_key = api_key or os.getenv("ELEVENLABS_API_KEY")
+        if base_url:
+            self.client = ElevenLabs(api_key=api_key or "stand-in", base_url=base_url)
+            # Own cache directory — stand-in audio must never be served as the real thing
+            self.name = "elevenlabs-" + base_url.split("//")[-1].strip("/").replace(":", "_").replace("/", "_")
+        else:
+            self.client = ElevenLabs(api_key=api_key)
+
+    def synthesize(self, text, voice_id, model_id) -> bytes:
+        audio = self.client.text_to_speech.convert(text=text, voice_id=voice_id, model_id=model_id)
+        # convert() streams chunks — join them so the result can be cached
+        return audio if isinstance(audio, bytes) else b"".join(audio)
+
+class StubBackend:
+    """Offline stand-in: deterministic fake audio plus a call log."""
+    name = "stub"
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.calls   = []
+
+    def synthesize(self, text, voice_id, model_id) -> bytes:
+        self.calls.append(text)
+        if self.latency:
+            time.sleep(self.latency)
+        return f"STUB-AUDIO|{voice_id}|{model_id}|{text}".encode()
+
+def _default_backend():
+    if os.getenv("TTS_BACKEND") == "stub" or not (os.getenv("ELEVENLABS_API_KEY") or BASE_URL):
+        return StubBackend()
+    return ElevenLabsBackend()
+
+# ── Content-addressed disk cache ─────────────────────────────────────────────
+class AudioCache:
+    """Static phrases (`persistent`, PHRASES by default) are kept on disk
+    forever. Anything else — status lines with live queue counts, emergency
+    details — is only held in a small in-memory LRU, so the disk cache
+    stays at one file per phrase."""
+    def __init__(self, backend, cache_dir=CACHE_DIR, voice_id=VOICE_ID, model_id=MODEL_ID,
+                 persistent=None, memory_items=MEMORY_ITEMS):
+        self.backend   = backend
+        # One sub-directory per backend so stub audio never masks real audio
+        self.cache_dir = os.path.join(cache_dir, getattr(backend, "name", "default"))
+        self.voice_id  = voice_id
+        self.model_id  = model_id
+        self.persistent   = set(PHRASES.values() if persistent is None else persistent)
+        self.memory_items = memory_items
+        self.hits = self.misses = 0
+        self.limiter = None             # text -> context manager gating synthesis (fleet.py)
+        self._recent = OrderedDict()    # dynamic text -> audio, least recently used first
+        self._lock = threading.Lock()
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    def path_for(self, text):
+        key = hashlib.sha256(f"{self.voice_id}\0{self.model_id}\0{text}".encode()).hexdigest()
+        return os.path.join(self.cache_dir, f"{key}.mp3")
+
+    def _read(self, path):
+        try:
+            with open(path, "rb") as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+        with self._lock:
+            self.hits += 1
+        metrics.inc("tts_cache_hits")
+        return data
+
+    def _recall(self, text):
+        with self._lock:
+            data = self._recent.get(text)
+            if data is not None:
+                self._recent.move_to_end(text)
+                self.hits += 1
+        if data is not None:
+            metrics.inc("tts_cache_hits")
+        return data
+
+    def _synthesize(self, text, recheck):
+        with self.limiter(text) if self.limiter else nullcontext():
+            # Someone else may have made it while we waited for the slot
+            data = recheck() if self.limiter else None
+            if data is not None:
+                return data, False
+            metrics.inc("tts_cache_misses")
+            with metrics.span("tts_synthesize"):
+                return self.backend.synthesize(text, self.voice_id, self.model_id), True
+
+    def get(self, text) -> bytes:
+        if text not in self.persistent:
+            data = self._recall(text)
+            if data is not None:
+                return data
+            data, made = self._synthesize(text, lambda: self._recall(text))
+            if made:
+                with self._lock:
+                    self._recent[text] = data
+                    while len(self._recent) > self.memory_items:
+                        self._recent.popitem(last=False)
+                    self.misses += 1
+            return data
+        path = self.path_for(text)
+        data = self._read(path)
+        if data is not None:
+            return data
+        data, made = self._synthesize(text, lambda: self._read(path))
+        if not made:
+            return data
+        tmp = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, path)           # atomic — readers never see half a file
+        with self._lock:
+            self.misses += 1
+        return data
+
+    def prune(self):
+        """Delete cached files that are not a persistent phrase (older
+        versions kept every announcement on disk). Returns how many."""
+        keep = {os.path.basename(self.path_for(t)) for t in self.persistent}
+        removed = 0
+        for name in os.listdir(self.cache_dir):
+            if name.endswith(".mp3") and name not in keep:
+                try:
+                    os.remove(os.path.join(self.cache_dir, name))
+                    removed += 1
+                except FileNotFoundError:
+                    pass                # pruned by another process
+        return removed
+
+    def warm(self, texts):
+        for text in texts:
+            if not os.path.exists(self.path_for(text)):
+                try:
+                    self.get(text)
+                except Exception as e:
+                    print(f"TTS warm-up failed for {text!r}: {e}")
+
+# ── Ordered, non-blocking playback ───────────────────────────────────────────
+def _play(audio):
+    from elevenlabs import play
     play(audio)
+
+def _print_stub(audio):
+    print(f"VOICE ALERT (stub): {audio.decode(errors='replace').rsplit('|', 1)[-1]}")
+
+class AlertQueue:
+    """Single worker that synthesizes (via the cache) and plays alerts in order.
+
+    A new alert supersedes anything still waiting, so stale announcements are
+    dropped instead of piling up; an identical pending alert is coalesced.
+    """
+    def __init__(self, cache, player=_play):
+        self.cache   = cache
+        self.player  = player
+        self.dropped = 0
+        self._pending = deque()
+        self._cond    = threading.Condition()
+        threading.Thread(target=self._worker, daemon=True).start()
+
+    def enqueue(self, texts, supersede=True):
+        texts = tuple(texts)
+        with self._cond:
+            if supersede:
+                # Drop everything else still waiting — keep an identical one in place
+                stale = [p for p in self._pending if p != texts]
+                self.dropped += len(stale)
+                self._pending = deque(p for p in self._pending if p == texts)
+            if texts in self._pending:
+                return
+            self._pending.append(texts)
+            self._cond.notify()
+
+    def pending(self):
+        with self._cond:
+            return len(self._pending)
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._pending:
+                    self._cond.wait()
+                texts = self._pending.popleft()
+            for text in texts:
+                try:
+                    with metrics.span("generate_alert"):
+                        audio = self.cache.get(text)
+                    self.player(audio)
+                except Exception as e:
+                    print(f"Voice alert error: {e}")
+
+_queue = None
+_queue_lock = threading.Lock()
+
+def get_queue() -> AlertQueue:
+    global _queue
+    with _queue_lock:
+        if _queue is None:
+            backend = _default_backend()
+            player  = _play if isinstance(backend, ElevenLabsBackend) else _print_stub
+            _queue  = AlertQueue(AudioCache(backend), player=player)
+        return _queue
+
+def warm_cache():
+    """Synthesize every static phrase in the background (no-op once cached)
+    and drop whatever else an older version left in the disk cache."""
+    cache = get_queue().cache
+
+    def _run():
+        cache.prune()
+        cache.warm(list(PHRASES.values()))
+    threading.Thread(target=_run, daemon=True).start()
+
+@metrics.timed("generate_alert")
+def generate_alert(event_type: str, details: str = "") -> bytes:
+    return get_queue().cache.get(alert_text(event_type, details))
+
+def play_alert(event_type: str, details: str = "", supersede: bool = True):
+    """Queue an alert for playback; returns immediately."""
+    get_queue().enqueue([alert_text(event_type, details)], supersede=supersede)
+
+def play_sequence(*event_types, supersede: bool = True):
+    """Queue several phrases to be played back-to-back as one alert."""
+    get_queue().enqueue([alert_text(e) for e in event_types], supersede=supersede)